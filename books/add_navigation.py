@@ -4,12 +4,16 @@ Add improved navigation to World English Bible HTML files.
 - Sidebar with all books
 - Breadcrumb navigation
 - Chapter dropdown
-- Prev/Next buttons
+- Prev/Next buttons, and a prefetch hint for the next chapter
 """
 
 import os
 import re
-import glob
+import json
+import argparse
+from functools import lru_cache
+
+from build_stats import NULL_STATS, add_arguments, run_with_stats
 
 # Book data: (filename_prefix, display_name, chapter_count, testament)
 BOOKS = [
@@ -99,78 +103,161 @@ BOOKS = [
     ('Revelation', 'Revelation', 22, 'nt'),
 ]
 
-def get_book_info(filename_prefix):
-    """Get book info from filename prefix."""
-    for book in BOOKS:
-        if book[0] == filename_prefix:
-            return book
-    return None
+# Index by filename prefix, plus case-insensitive aliases (e.g. JOB31.htm)
+BOOK_INDEX = {book[0]: book for book in BOOKS}
+BOOK_ALIASES = {book[0].lower(): book for book in BOOKS}
 
-def generate_sidebar_html(current_book=None):
-    """Generate the sidebar HTML."""
-    html = '''  <aside class="sidebar" id="sidebar">
+SIDEBAR_SECTIONS = [
+    ('ot', 'Old Testament', ' open'),
+    ('dc', 'Deuterocanon', ''),
+    ('nt', 'New Testament', ''),
+]
+
+ACTIVE_ATTR = ' class="active"'
+SELECTED_ATTR = ' selected'
+
+
+def get_book_info(filename_prefix, table=None):
+    """Get book info from filename prefix."""
+    if table is not None:
+        return table.get_book_info(filename_prefix)
+    book = BOOK_INDEX.get(filename_prefix)
+    if book is None:
+        book = BOOK_ALIASES.get(filename_prefix.lower())
+    return book
+
+
+def chapter_filename(book_prefix, chapter, table=None):
+    """Return the chapter filename; Psalms chapters are padded to 3 digits."""
+    if table is not None:
+        return table.chapter_filename(book_prefix, chapter)
+    book = get_book_info(book_prefix)
+    width = 3 if book and book[0] == 'Psalms' else 2
+    return f'{book_prefix}{chapter:0{width}d}.htm'
+
+
+@lru_cache(maxsize=None)
+def sidebar_template(table=None):
+    """Render the sidebar once per book table.
+
+    Returns (html, offsets) where offsets maps each book prefix to the
+    position at which its active marker is inserted.
+    """
+    books = table.books if table is not None else BOOKS
+    parts = ['''  <aside class="sidebar" id="sidebar">
     <div class="sidebar-header">
       <h2>Books</h2>
       <button class="sidebar-close" aria-label="Close menu">&times;</button>
     </div>
-
-    <details class="sidebar-section" open>
-      <summary>Old Testament</summary>
+''']
+    size = len(parts[0])
+    offsets = {}
+    for testament, title, is_open in SIDEBAR_SECTIONS:
+        parts.append(f'''
+    <details class="sidebar-section"{is_open}>
+      <summary>{title}</summary>
       <ul>
-'''
-    for book in BOOKS:
-        if book[3] == 'ot':
-            active = ' class="active"' if book[0] == current_book else ''
-            html += f'        <li><a href="{book[0]}01.htm"{active}>{book[1]}</a></li>\n'
-
-    html += '''      </ul>
+''')
+        size += len(parts[-1])
+        for book in books:
+            if book[3] == testament:
+                head = f'        <li><a href="{book[0]}01.htm"'
+                parts.append(f'{head}>{book[1]}</a></li>\n')
+                offsets[book[0]] = size + len(head)
+                size += len(parts[-1])
+        parts.append('''      </ul>
     </details>
+''')
+        size += len(parts[-1])
+    parts.append('''  </aside>
+  <div class="sidebar-overlay" id="sidebar-overlay"></div>
+''')
+    return ''.join(parts), offsets
 
-    <details class="sidebar-section">
-      <summary>Deuterocanon</summary>
-      <ul>
-'''
-    for book in BOOKS:
-        if book[3] == 'dc':
-            active = ' class="active"' if book[0] == current_book else ''
-            html += f'        <li><a href="{book[0]}01.htm"{active}>{book[1]}</a></li>\n'
 
-    html += '''      </ul>
-    </details>
+def generate_sidebar_html(current_book=None, table=None):
+    """Generate the sidebar HTML."""
+    html, offsets = sidebar_template(table)
+    pos = offsets.get(current_book)
+    if pos is None:
+        return html
+    return html[:pos] + ACTIVE_ATTR + html[pos:]
+
+
+@lru_cache(maxsize=None)
+def chapter_options_template(book_prefix, chapter_count, table=None):
+    """Render a book's chapter options once; returns (html, offsets by chapter)."""
+    lines = []
+    size = 0
+    offsets = {}
+    for i in range(1, chapter_count + 1):
+        head = f'        <option value="{chapter_filename(book_prefix, i, table)}"'
+        lines.append(f'{head}>Chapter {i}</option>')
+        offsets[i] = size + len(head)
+        size += len(lines[-1]) + 1
+    return '\n'.join(lines), offsets
 
-    <details class="sidebar-section">
-      <summary>New Testament</summary>
-      <ul>
-'''
-    for book in BOOKS:
-        if book[3] == 'nt':
-            active = ' class="active"' if book[0] == current_book else ''
-            html += f'        <li><a href="{book[0]}01.htm"{active}>{book[1]}</a></li>\n'
 
-    html += '''      </ul>
-    </details>
+def generate_chapter_options(book_prefix, chapter_count, current_chapter, table=None):
+    """Generate chapter dropdown options."""
+    html, offsets = chapter_options_template(book_prefix, chapter_count, table)
+    pos = offsets.get(int(current_chapter))
+    if pos is None:
+        return html
+    return html[:pos] + SELECTED_ATTR + html[pos:]
+
+
+BOOK_TABLE_JS = 'books.js'
+
+
+def render_book_table_js(book_table=None):
+    """Render the shared book table that navigation.js builds the shell from."""
+    books = book_table.books if book_table is not None else BOOKS
+    table = {
+        'ext': '.htm',
+        'sections': [[testament, title, bool(is_open)]
+                     for testament, title, is_open in SIDEBAR_SECTIONS],
+        'books': [[book[0], book[1], book[2], book[3],
+                   book_table.chapter_width(book[0]) if book_table is not None
+                   else 3 if book[0] == 'Psalms' else 2]
+                  for book in books],
+    }
+    return ('// Generated by books/add_navigation.py from the book table - do not edit\n'
+            f'window.WEB_NAV = {json.dumps(table, separators=(",", ":"))};\n')
+
+
+def generate_shell_sidebar_html(current_book=None):
+    """Generate the empty sidebar that navigation.js fills from the book table."""
+    return f'''  <aside class="sidebar" id="sidebar" data-book="{current_book or ''}">
+    <div class="sidebar-header">
+      <h2>Books</h2>
+      <button class="sidebar-close" aria-label="Close menu">&times;</button>
+    </div>
+    <p class="sidebar-fallback"><a href="../index.htm">All books</a></p>
   </aside>
   <div class="sidebar-overlay" id="sidebar-overlay"></div>
 '''
-    return html
-
 
-def generate_chapter_options(book_prefix, chapter_count, current_chapter):
-    """Generate chapter dropdown options."""
-    options = []
-    for i in range(1, chapter_count + 1):
-        ch_str = f'{i:02d}' if book_prefix == 'Psalms' and i < 100 else f'{i:02d}'
-        if book_prefix == 'Psalms':
-            ch_str = f'{i:03d}'
-        selected = ' selected' if str(i) == str(current_chapter) else ''
-        options.append(f'        <option value="{book_prefix}{ch_str}.htm"{selected}>Chapter {i}</option>')
-    return '\n'.join(options)
 
+def generate_nav_html(book_prefix, book_name, chapter_num, chapter_count, prev_href, next_href,
+                      shared=False, table=None):
+    """Generate the navigation HTML.
 
-def generate_nav_html(book_prefix, book_name, chapter_num, chapter_count, prev_href, next_href):
-    """Generate the navigation HTML."""
+    With shared set, the chapter dropdown is left to navigation.js and the
+    page only carries a link to the book's chapter list.
+    """
     # Chapter dropdown
-    chapter_options = generate_chapter_options(book_prefix, chapter_count, chapter_num)
+    if shared:
+        chapter_nav = f'''    <div class="chapter-nav" data-prefix="{book_prefix}" data-chapter="{chapter_num}">
+      <a href="{book_prefix}.htm">Chapters</a>
+    </div>'''
+    else:
+        chapter_options = generate_chapter_options(book_prefix, chapter_count, chapter_num, table)
+        chapter_nav = f'''    <div class="chapter-nav">
+      <select aria-label="Select chapter">
+{chapter_options}
+      </select>
+    </div>'''
 
     # Prev/Next classes
     prev_class = '' if prev_href else ' class="disabled"'
@@ -189,11 +276,7 @@ def generate_nav_html(book_prefix, book_name, chapter_num, chapter_count, prev_h
       <span class="current">Chapter {chapter_num}</span>
     </nav>
 
-    <div class="chapter-nav">
-      <select aria-label="Select chapter">
-{chapter_options}
-      </select>
-    </div>
+{chapter_nav}
 
     <div class="prev-next">
       <a href="{prev_href}"{prev_class} title="Previous">&larr;</a>
@@ -204,69 +287,95 @@ def generate_nav_html(book_prefix, book_name, chapter_num, chapter_count, prev_h
     return html
 
 
-def process_chapter_file(filepath):
-    """Process a chapter file and add navigation."""
-    basename = os.path.basename(filepath)
-
-    # Parse filename to get book and chapter
-    if basename == 'Psalms.htm':
-        return None  # Skip chapter list pages
-
-    match = re.match(r'^(.+?)(\d+)\.htm$', basename)
-    if not match:
-        return None
+def split_chapter_stem(stem, table=None):
+    """Return (book_prefix, book_info, chapter_num) for 'Mark15', or None.
 
-    book_prefix = match.group(1)
-    chapter_str = match.group(2)
-    chapter_num = int(chapter_str)
+    A prefix may end in digits (Psalm_151), so the longest known prefix
+    followed by at least one digit wins: Psalm_15101 is chapter 1.
+    """
+    base = stem.rstrip('0123456789')
+    digits = stem[len(base):]
+    for split in range(len(digits) - 1, -1, -1):
+        book_info = get_book_info(base + digits[:split], table)
+        if book_info:
+            return base + digits[:split], book_info, int(digits[split:])
+    return None
 
-    book_info = get_book_info(book_prefix)
-    if not book_info:
-        return None
 
-    book_name = book_info[1]
-    chapter_count = book_info[2]
+def parse_chapter_page_name(basename, table=None):
+    """Return (book_prefix, book_info, chapter_num) for a chapter page name, or None."""
+    if basename == 'Psalms.htm' or not basename.endswith('.htm'):
+        return None  # Skip chapter list pages
 
-    # Determine prev/next links
-    prev_href = None
-    next_href = None
-
-    if chapter_num > 1:
-        prev_ch = chapter_num - 1
-        if book_prefix == 'Psalms':
-            prev_href = f'{book_prefix}{prev_ch:03d}.htm'
-        else:
-            prev_href = f'{book_prefix}{prev_ch:02d}.htm'
-
-    if chapter_num < chapter_count:
-        next_ch = chapter_num + 1
-        if book_prefix == 'Psalms':
-            next_href = f'{book_prefix}{next_ch:03d}.htm'
-        else:
-            next_href = f'{book_prefix}{next_ch:02d}.htm'
+    return split_chapter_stem(basename[:-len('.htm')], table)
 
-    # Read existing file
-    with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read()
 
-    # Check if already processed
-    if 'class="sidebar"' in content:
-        return None
+def extract_page_parts(content):
+    """Return (main_content, footnote_content) of a page, or None without <main>.
 
-    # Extract the main content
+    Pages that already have navigation are rebuilt from their own <main>,
+    so this is safe to rerun.
+    """
     main_match = re.search(r'<main class="main">(.*?)</main>', content, re.DOTALL)
     if not main_match:
         return None
 
-    main_content = main_match.group(1)
+    main_content = main_match.group(1).lstrip('\n').rstrip()
 
     # Extract footnotes
     footnote_match = re.search(r'<footer class="footnote">(.*?)</footer>', content, re.DOTALL)
     footnote_content = footnote_match.group(0) if footnote_match else ''
+    return main_content, footnote_content
+
+
+def process_chapter_file(filepath, shared_nav=False, stats=NULL_STATS):
+    """Process a chapter file and add navigation.
+
+    With shared_nav set the page gets the minimal navigation shell and
+    loads the book table from ../scripts/books.js instead.
+    """
+    parsed = parse_chapter_page_name(os.path.basename(filepath))
+    if not parsed:
+        return None
+    book_prefix, book_info, chapter_num = parsed
+
+    # Read existing file
+    with stats.stage('read'):
+        with open(filepath, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+    with stats.stage('render'):
+        parts = extract_page_parts(content)
+        if parts is None:
+            return None
+        return render_chapter_page(*parts, book_prefix, book_info, chapter_num, shared_nav)
+
+
+def render_chapter_page(main_content, footnote_content, book_prefix, book_info, chapter_num,
+                        shared_nav=False, table=None):
+    """Build a chapter page with full navigation around its main content and footnotes.
+
+    table is the edition's BookTable; the built-in WEB tables by default.
+    """
+    book_name = book_info[1]
+    chapter_count = book_info[2]
+
+    # Determine prev/next links
+    prev_href = chapter_filename(book_prefix, chapter_num - 1, table) if chapter_num > 1 else None
+    next_href = chapter_filename(book_prefix, chapter_num + 1, table) if chapter_num < chapter_count else None
+    # Fetched while the reader is on this page, so "next" opens from cache
+    prefetch_html = f'\n  <link rel="prefetch" href="{next_href}">' if next_href else ''
 
     # Generate new HTML
-    sidebar_html = generate_sidebar_html(book_prefix)
-    nav_html = generate_nav_html(book_prefix, book_name, chapter_num, chapter_count, prev_href, next_href)
+    if shared_nav:
+        sidebar_html = generate_shell_sidebar_html(book_info[0])
+        scripts_html = f'''  <script src="../scripts/{BOOK_TABLE_JS}"></script>
+  <script src="../scripts/navigation.js"></script>'''
+    else:
+        sidebar_html = generate_sidebar_html(book_info[0], table)
+        scripts_html = '  <script src="../scripts/navigation.js"></script>'
+    nav_html = generate_nav_html(book_prefix, book_name, chapter_num, chapter_count, prev_href, next_href,
+                                 shared=shared_nav, table=table)
 
     new_html = f'''<!DOCTYPE html>
 <html lang="en">
@@ -275,7 +384,7 @@ def process_chapter_file(filepath):
   <meta name="viewport" content="width=device-width, initial-scale=1.0">
   <meta name="description" content="{book_name} Chapter {chapter_num} - World English Bible">
   <title>World English Bible - {book_name} {chapter_num}</title>
-  <link rel="stylesheet" href="../styles/styles.css">
+  <link rel="stylesheet" href="../styles/styles.css">{prefetch_html}
 </head>
 <body>
   <div class="page-wrapper">
@@ -293,42 +402,48 @@ def process_chapter_file(filepath):
       </footer>
     </div>
   </div>
-  <script src="../scripts/navigation.js"></script>
+{scripts_html}
 </body>
 </html>
 '''
     return new_html
 
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Add navigation to chapter pages')
+    parser.add_argument('--force', action='store_true',
+                        help='ignore the build manifest and rebuild every page')
+    parser.add_argument('--shared-nav', action='store_true',
+                        help='write the book table once to scripts/books.js and '
+                             'let navigation.js build the sidebar and dropdown')
+    parser.add_argument('--watch', action='store_true',
+                        help='after the run, keep rebuilding pages as they are edited')
+    add_arguments(parser)
+    # Imported here because the pipeline and watch mode are built on this module
+    from pipeline import build
+    from watch import add_watch_arguments, watch_from_args
+    add_watch_arguments(parser)
+    args = parser.parse_args(argv)
+
     books_dir = os.path.dirname(os.path.abspath(__file__))
-    htm_files = glob.glob(os.path.join(books_dir, '*.htm'))
-
-    # Skip certain files
-    skip_files = {'links.htm', 'webfaq.htm', 'copyright.htm', 'index.htm'}
-
-    # Only process chapter files (with numbers)
-    chapter_files = [f for f in htm_files
-                     if re.search(r'\d+\.htm$', os.path.basename(f))
-                     and os.path.basename(f) not in skip_files]
-
-    print(f"Found {len(chapter_files)} chapter files")
-
-    updated = 0
-    for filepath in sorted(chapter_files):
-        basename = os.path.basename(filepath)
-        try:
-            new_content = process_chapter_file(filepath)
-            if new_content:
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    f.write(new_content)
-                updated += 1
-                if updated % 100 == 0:
-                    print(f"  Processed {updated} files...")
-        except Exception as e:
-            print(f"  Error processing {basename}: {e}")
-
-    print(f"\nUpdated {updated} files with new navigation")
+    run_with_stats(args, 'add_navigation', books_dir,
+                   lambda stats: build(books_dir, ['navigation'], force=args.force,
+                                       shared_nav=args.shared_nav, stats=stats))
+    if args.watch:
+        watch_from_args(args, books_dir, ['navigation'], 1, shared_nav=args.shared_nav)
+
+
+def print_size_report(bytes_before, bytes_after, pages, scripts_dir, shared_nav):
+    """Report the output size and the bytes sent per page view."""
+    shared_files = ['navigation.js'] + ([BOOK_TABLE_JS] if shared_nav else [])
+    shared_bytes = sum(os.path.getsize(os.path.join(scripts_dir, name))
+                       for name in shared_files
+                       if os.path.exists(os.path.join(scripts_dir, name)))
+    per_page = bytes_after // pages
+    print(f"Rebuilt pages: {bytes_before:,} bytes before, {bytes_after:,} bytes after "
+          f"({bytes_after - bytes_before:+,})")
+    print(f"Per page view: {per_page:,} bytes cached, "
+          f"{per_page + shared_bytes:,} bytes on first view ({', '.join(shared_files)})")
 
 
 if __name__ == '__main__':
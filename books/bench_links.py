@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the link rewriter in modernize_bible.py.
+- Compares update_links_in_content against the old one-re.sub-per-book loop
+- Runs over the real books/ corpus, plus a copy whose links are turned
+  back into upstream abbreviations (ABB01.htm) so every href is rewritten
+- Checks that both implementations produce identical output
+"""
+
+import os
+import re
+import glob
+import time
+import argparse
+
+from modernize_bible import BOOK_MAPPING, abbrev_alternation, update_links_in_content
+
+
+def update_links_loop(content):
+    """The original rewriter: one re.sub per abbreviation."""
+    for old_abbrev, new_name in BOOK_MAPPING.items():
+        pattern = rf"(href=['\"]){old_abbrev}(\d*\.htm['\"])"
+        replacement = rf"\g<1>{new_name}\2"
+        content = re.sub(pattern, replacement, content)
+    return content
+
+
+def to_upstream_links(content):
+    """Rewrite href="Genesis01.html" style links to href='GEN01.htm'."""
+    abbrevs = {name: abbrev for abbrev, name in BOOK_MAPPING.items()}
+
+    def replace(match):
+        abbrev = abbrevs.get(match.group(1))
+        if abbrev is None:
+            return match.group(0)
+        return f"href='{abbrev}{match.group(2)}.htm'"
+
+    return re.sub(rf'href="({abbrev_alternation(abbrevs)})(\d*)\.html?"', replace, content)
+
+
+def load_corpus(books_dir):
+    """Read every page in the books directory."""
+    docs = []
+    for filepath in sorted(glob.glob(os.path.join(books_dir, '*.htm*'))):
+        with open(filepath, 'r', encoding='utf-8') as f:
+            docs.append(f.read())
+    return docs
+
+
+def time_rewriter(func, docs, repeat):
+    """Best-of-N wall time for running func over all docs."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for doc in docs:
+            func(doc)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the link rewriter')
+    parser.add_argument('--repeat', type=int, default=3, help='timing runs per case (best is kept)')
+    args = parser.parse_args(argv)
+
+    books_dir = os.path.dirname(os.path.abspath(__file__))
+    corpus = load_corpus(books_dir)
+    total_mb = sum(len(doc) for doc in corpus) / 1e6
+    print(f"Loaded {len(corpus)} files ({total_mb:.1f} MB)")
+
+    cases = [
+        ('current corpus', corpus),
+        ('upstream links', [to_upstream_links(doc) for doc in corpus]),
+    ]
+    for label, docs in cases:
+        for doc in docs:
+            if update_links_loop(doc) != update_links_in_content(doc):
+                raise SystemExit(f"Output mismatch in '{label}' corpus")
+
+        old = time_rewriter(update_links_loop, docs, args.repeat)
+        new = time_rewriter(update_links_in_content, docs, args.repeat)
+        print(f"  {label:15s}  per-book loop {old * 1000:8.1f} ms   "
+              f"single pass {new * 1000:8.1f} ms   speedup {old / new:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for each stage of the books/ pipeline.
+- Stages run one at a time, each in a fresh process, so peak RSS is per
+  stage: links (update_links_in_content), clean (clean_chapter_content),
+  footnotes (clean_footnotes) and navigation (the pipeline's registered
+  navigation stage, as pipeline.build runs it)
+- Inputs are rebuilt from the chapter pages: the modernize stages get
+  upstream-style pages (ABB01.htm, <div class='main'>, ...), the navigation
+  stage gets pages as modernize_bible writes them
+- Each stage runs over the real corpus and over a synthetic corpus made of
+  N passes over it (--scales 1,10)
+- Reports files/s, MB/s and peak RSS, saves the results as JSON and
+  compares them with a baseline; a regression past the thresholds fails
+  the run
+
+Usage:
+  python bench_pipeline.py --out baseline.json
+  python bench_pipeline.py --baseline baseline.json --max-slowdown 0.15
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import platform
+import resource
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pipeline
+from add_navigation import BOOKS
+from book_tables import load_book_table
+from build_stats import NULL_STATS
+from corpus import find_chapter_files, extract_main
+from modernize_bible import (BOOK_MAPPING, abbrev_alternation, clean_chapter_content, clean_footnotes,
+                             update_links_in_content)
+
+STAGES = ['links', 'clean', 'footnotes', 'navigation']
+RESULTS_NAME = 'bench_results.json'
+
+# Upstream abbreviation for each filename prefix
+UPSTREAM_ABBREVS = {}
+for _abbrev, _prefix in BOOK_MAPPING.items():
+    UPSTREAM_ABBREVS.setdefault(_prefix, _abbrev)
+
+_FOOTER_RE = re.compile(r'<footer class="footnote">(.*?)</footer>', re.DOTALL)
+_FOOTNOTE_RE = re.compile(r'<p class="f" id="(FN\d+)"><span class="notemark">([^<]*)</span> '
+                          r'<a class="notebackref" href="#v(\d+)">([^<]*)</a> ([^<]*)</p>')
+_LINK_RE = re.compile(rf'href="({abbrev_alternation(UPSTREAM_ABBREVS)})(\d*)\.html?"')
+
+
+def upstream_name(prefix, chapter):
+    """Upstream filename for a chapter: ('Mark', 15) -> 'MRK15.htm'."""
+    width = 3 if prefix == 'Psalms' else 2
+    return f'{UPSTREAM_ABBREVS[prefix]}{chapter:0{width}d}.htm'
+
+
+def to_upstream_page(page_html, prefix, chapter, chapter_count):
+    """Rebuild an upstream eBible page from a cleaned chapter page."""
+    main = extract_main(page_html).strip('\n')
+    main = re.sub(r'<span class="verse" id="v(\d+)">(\d+)</span> ',
+                  r'<span class="verse" id="V\1">\2&#160;</span>', main)
+    main = re.sub(r'<a href="#(FN\d+)" class="notemark" title="([^"]*)">([^<]*)</a>',
+                  r'<a href="#\1" class="notemark">\3<span class="popup">\2</span></a>', main)
+    main = re.sub(r'<h2 class="chapterlabel">([^<]*)</h2>',
+                  r'''<div class='chapterlabel' id="V0"> \1</div>''', main)
+    main = re.sub(r'<p class="(\w+)">(.*?)</p>', r"<div class='\1'>\2</div>", main)
+    main = re.sub(r'<div class="(\w+)">', r"<div class='\1'>", main)
+
+    def upstream_link(match):
+        abbrev = UPSTREAM_ABBREVS.get(match.group(1))
+        return f"href='{abbrev}{match.group(2)}.htm'" if abbrev else match.group(0)
+
+    main = _LINK_RE.sub(upstream_link, main)
+
+    footer = _FOOTER_RE.search(page_html)
+    notes = ''.join(
+        f'<p class="f" id="{fn_id}"><span class="notemark">{mark}</span>'
+        f'<a class="notebackref" href="#V{verse}">{ref}</a>\n<span class="ft">{text}</span></p>\n'
+        for fn_id, mark, verse, ref, text in _FOOTNOTE_RE.findall(footer.group(1) if footer else ''))
+
+    abbrev = UPSTREAM_ABBREVS[prefix]
+    links = [("index.htm", '^'), (f'{abbrev}.htm', abbrev)]
+    if chapter > 1:
+        links.append((upstream_name(prefix, chapter - 1), '&lt;'))
+    if chapter < chapter_count:
+        links.append((upstream_name(prefix, chapter + 1), '&gt;'))
+    nav = "<ul class='tnav'>\n" + ''.join(f"<li><a href='{href}'>{text}</a></li>\n"
+                                          for href, text in links) + '</ul>\n'
+    return ('<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="UTF-8" />\n'
+            '<title>World English Bible</title>\n</head>\n<body>\n'
+            f"{nav}<div class='main'>\n{main}\n{nav}<div class='footnote'>\n<hr />\n{notes}</div>\n"
+            '</body></html>\n')
+
+
+def load_upstream_corpus(books_dir):
+    """Return [(prefix, chapter, upstream page)] for every chapter page."""
+    pages = []
+    for ordinal, chapter, path in find_chapter_files(books_dir):
+        prefix, _, count, _ = BOOKS[ordinal]
+        with open(path, 'r', encoding='utf-8') as f:
+            pages.append((prefix, chapter, to_upstream_page(f.read(), prefix, chapter, count)))
+    return pages
+
+
+def prepare_stage(stage, books_dir):
+    """Build the inputs of a stage: (list of call arguments, total input bytes)."""
+    pages = load_upstream_corpus(books_dir)
+    if stage == 'links':
+        calls = [(page,) for _, _, page in pages]
+        size = sum(len(page.encode('utf-8')) for _, _, page in pages)
+        return calls, size
+
+    cleaned = []
+    for prefix, chapter, page in pages:
+        page = update_links_in_content(page)
+        width = 3 if prefix == 'Psalms' else 2
+        cleaned.append((prefix, f'{chapter:0{width}d}', page))
+
+    if stage == 'clean':
+        calls = [(page, prefix.replace('_', ' '), chapter) for prefix, chapter, page in cleaned]
+        return calls, sum(len(call[0].encode('utf-8')) for call in calls)
+
+    if stage == 'footnotes':
+        calls = []
+        for _, _, page in cleaned:
+            match = re.search(r"<div class=['\"]footnote['\"]>(.*?)</div>", page, re.DOTALL)
+            calls.append((match.group(1) if match else '',))
+        return calls, sum(len(call[0].encode('utf-8')) for call in calls)
+
+    # navigation: modernized pages, named and rendered through the book table
+    # of the chapter pages (load_book_table fails on a directory without any)
+    table = load_book_table(books_dir)
+    options = {'books_dir': books_dir, 'label': None, 'table': table, 'shared_nav': False}
+    calls = []
+    size = 0
+    for prefix, chapter, page in cleaned:
+        content = clean_chapter_content(page, prefix.replace('_', ' '), chapter)
+        calls.append((table.chapter_filename(prefix, int(chapter)), content, options))
+        size += len(content.encode('utf-8'))
+    # Timing a stage that leaves every page alone would measure nothing
+    name, content, _ = calls[0]
+    if run_navigation(*calls[0]).content == content:
+        raise RuntimeError(f"the navigation stage left {name} unchanged")
+    return calls, size
+
+
+def run_navigation(name, content, options):
+    """The registered navigation stage on one modernized page; returns the Document."""
+    doc = pipeline.Document(None, name, content)
+    pipeline.STAGES['navigation'].func(doc, options, NULL_STATS)
+    return doc
+
+
+STAGE_FUNCTIONS = {
+    'links': update_links_in_content,
+    'clean': clean_chapter_content,
+    'footnotes': clean_footnotes,
+    'navigation': run_navigation,
+}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_stage(stage, books_dir, scale, repeat):
+    """Time one stage over scale passes of the corpus (run in a fresh process)."""
+    calls, size = prepare_stage(stage, books_dir)
+    rss_inputs = peak_rss_mb()
+    func = STAGE_FUNCTIONS[stage]
+    best = best_cpu = None
+    for _ in range(repeat):
+        start, start_cpu = time.perf_counter(), time.process_time()
+        for _ in range(scale):
+            for args in calls:
+                func(*args)
+        elapsed, cpu = time.perf_counter() - start, time.process_time() - start_cpu
+        best = elapsed if best is None else min(best, elapsed)
+        best_cpu = cpu if best_cpu is None else min(best_cpu, cpu)
+
+    files = len(calls) * scale
+    total = size * scale
+    return {
+        'files': files,
+        'bytes': total,
+        'seconds': round(best, 4),
+        'cpu_seconds': round(best_cpu, 4),
+        'files_per_s': round(files / best, 1),
+        'mb_per_s': round(total / 1e6 / best, 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'input_rss_mb': round(rss_inputs, 1),
+    }
+
+
+def run_isolated(stage, books_dir, scale, repeat):
+    """Run a stage in a newly spawned process so its peak RSS is its own."""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run_stage, stage, books_dir, scale, repeat).result()
+
+
+def compare(results, baseline, max_slowdown, max_rss_growth):
+    """Return a list of regression messages against a baseline results dict."""
+    regressions = []
+    for key, current in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        if current['mb_per_s'] < base['mb_per_s'] * (1 - max_slowdown):
+            regressions.append(f"{key}: {current['mb_per_s']} MB/s vs {base['mb_per_s']} MB/s baseline "
+                               f"({current['mb_per_s'] / base['mb_per_s'] - 1:+.0%})")
+        if current['peak_rss_mb'] > base['peak_rss_mb'] * (1 + max_rss_growth):
+            regressions.append(f"{key}: peak RSS {current['peak_rss_mb']} MB vs {base['peak_rss_mb']} MB "
+                               f"baseline ({current['peak_rss_mb'] / base['peak_rss_mb'] - 1:+.0%})")
+    return regressions
+
+
+def main(argv=None):
+    books_dir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description='Benchmark each stage of the books/ pipeline')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help=f'comma-separated stages to run (default: {",".join(STAGES)})')
+    parser.add_argument('--scales', default='1,10',
+                        help='corpus sizes as multiples of the real corpus (default: 1,10)')
+    parser.add_argument('--repeat', type=int, default=3, help='timing runs per case (best is kept)')
+    parser.add_argument('--out', default=os.path.join(books_dir, RESULTS_NAME),
+                        help='where to save the results as JSON')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--max-slowdown', type=float, default=0.10,
+                        help='allowed MB/s drop against the baseline (default: 0.10 = 10%%)')
+    parser.add_argument('--max-rss-growth', type=float, default=0.20,
+                        help='allowed peak RSS growth against the baseline (default: 0.20 = 20%%)')
+    args = parser.parse_args(argv)
+
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(sorted(unknown))}")
+    scales = [int(s) for s in args.scales.split(',')]
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    print(f"{'case':22s} {'files':>7s} {'MB':>7s} {'sec':>7s} {'files/s':>9s} {'MB/s':>7s} {'peak RSS':>9s}")
+    for stage in stages:
+        for scale in scales:
+            key = f'{stage}/x{scale}'
+            result = run_isolated(stage, books_dir, scale, args.repeat)
+            results[key] = result
+            print(f"{key:22s} {result['files']:7d} {result['bytes'] / 1e6:7.1f} {result['seconds']:7.2f} "
+                  f"{result['files_per_s']:9.0f} {result['mb_per_s']:7.1f} {result['peak_rss_mb']:7.1f} MB")
+
+    report = {
+        'machine': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'repeat': args.repeat,
+        'results': results,
+    }
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    print(f"Wrote {args.out}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.max_slowdown, args.max_rss_growth)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for message in regressions:
+                print(f"  {message}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Derive the book tables of an edition from its metadata and its files.
+- The books, their order and their display names come from the edition's
+  Paratext meta/*VernacularParms.xml, which sits next to books/
+- Chapter counts and the width of chapter numbers (Psalms001.htm) come
+  from the chapter files on disk, upstream (PSA001.htm) or modernized,
+  .htm or published .html; an edition without any is an error
+- Filename prefixes follow BOOK_MAPPING, so a book has the same URL in
+  every edition; codes it does not know are named after the book
+- The pipeline threads a BookTable through its stages; the tables
+  hardcoded in add_navigation and modernize_bible stay the default for
+  everything else
+
+Usage:
+  python book_tables.py [BOOKS_DIR ...]
+"""
+
+import os
+import re
+import sys
+import glob
+import json
+import hashlib
+from xml.etree import ElementTree
+
+from add_navigation import BOOKS
+from modernize_bible import BOOK_MAPPING, LEGACY_FILENAMES, make_link_rewriter, make_name_splitter
+
+BOOKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# USFM book codes by testament; any other book with chapters is deuterocanon
+OT_CODES = frozenset('''GEN EXO LEV NUM DEU JOS JDG RUT 1SA 2SA 1KI 2KI 1CH 2CH EZR NEH EST JOB
+    PSA PRO ECC SNG ISA JER LAM EZK DAN HOS JOL AMO OBA JON MIC NAM HAB ZEP HAG ZEC MAL'''.split())
+NT_CODES = frozenset('''MAT MRK LUK JHN ACT ROM 1CO 2CO GAL EPH PHP COL 1TH 2TH 1TI 2TI TIT PHM
+    HEB JAS 1PE 2PE 1JN 2JN 3JN JUD REV'''.split())
+
+# USFM peripherals: renamed like books but kept out of the book list
+PERIPHERAL_CODES = frozenset('FRT INT BAK OTH CNC GLO TDX NDX'.split())
+
+# Preferred display name first
+NAME_PARMS = ('vernacularAbbreviatedName', 'vernacularFullName', 'vernacularBookAbbreviation')
+
+DEFAULT_WIDTH = 2
+
+
+class BookTable:
+    """Books, abbreviation mapping and chapter number widths of one edition.
+
+    books holds (filename_prefix, display_name, chapter_count, testament)
+    tuples like add_navigation.BOOKS; mapping is code -> filename prefix
+    like modernize_bible.BOOK_MAPPING. Tables compare equal when their
+    contents do, so they can key caches in every worker process.
+    """
+
+    def __init__(self, books, mapping, widths=None, names=None):
+        self.books = tuple(tuple(book) for book in books)
+        self.mapping = dict(mapping)
+        self.widths = dict(widths or {})
+        self.names = dict(names or {})
+        self.index = {book[0]: book for book in self.books}
+        # Case-insensitive aliases (e.g. JOB31.htm)
+        self.aliases = {book[0].lower(): book for book in self.books}
+        self.digest = hashlib.sha256(json.dumps(
+            [self.books, sorted(self.mapping.items()), sorted(self.widths.items()),
+             sorted(self.names.items())]).encode('utf-8')).hexdigest()
+        self._rewrite = self._split = None
+
+    def __eq__(self, other):
+        return isinstance(other, BookTable) and self.digest == other.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __getstate__(self):
+        # The compiled link rewriter and name splitter are closures and cannot be pickled
+        state = dict(self.__dict__)
+        state['_rewrite'] = state['_split'] = None
+        return state
+
+    def get_book_info(self, filename_prefix):
+        book = self.index.get(filename_prefix)
+        if book is None:
+            book = self.aliases.get(filename_prefix.lower())
+        return book
+
+    def chapter_width(self, book_prefix):
+        book = self.get_book_info(book_prefix)
+        return self.widths.get(book[0] if book else book_prefix, DEFAULT_WIDTH)
+
+    def chapter_filename(self, book_prefix, chapter):
+        return f'{book_prefix}{chapter:0{self.chapter_width(book_prefix)}d}.htm'
+
+    def display_name(self, book_prefix):
+        book = self.get_book_info(book_prefix)
+        if book:
+            return book[1]
+        return self.names.get(book_prefix) or book_prefix.replace('_', ' ')
+
+    def split_name(self, basename):
+        """Split an upstream filename into (code, chapter digits), or (None, None)."""
+        if self._split is None:
+            self._split = make_name_splitter(self.mapping)
+        return self._split(basename)
+
+    def output_filename(self, basename):
+        """Return the modernized filename for an upstream file, or None."""
+        abbrev, chapter = self.split_name(basename)
+        new_name = self.mapping.get(abbrev)
+        if not new_name:
+            return None
+        return f"{new_name}{chapter}.htm" if chapter else f"{new_name}.htm"
+
+    def rewrite_links(self, content):
+        if self._rewrite is None:
+            self._rewrite = make_link_rewriter(self.mapping)
+        return self._rewrite(content)
+
+
+def find_vernacular_parms(books_dir):
+    """Return the VernacularParms file of the edition books_dir belongs to, or None."""
+    matches = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(books_dir)),
+                                            'meta', '*VernacularParms.xml')))
+    return matches[0] if matches else None
+
+
+def read_vernacular_parms(path):
+    """Return [(code, {parm: text})] in file order."""
+    books = {}
+    for element in ElementTree.parse(path).getroot().iter('scriptureBook'):
+        code = element.get('ubsAbbreviation', '').upper()
+        if code and element.text and element.text.strip():
+            books.setdefault(code, {})[element.get('parm')] = element.text.strip()
+    return list(books.items())
+
+
+def prefix_for(code, name):
+    """Filename prefix of a book: the BOOK_MAPPING name, else made from its display name."""
+    prefix = BOOK_MAPPING.get(code)
+    if prefix:
+        return prefix
+    return re.sub(r'\W+', '_', name).strip('_') or code
+
+
+def scan_chapters(books_dir, stems):
+    """Return {code: (highest chapter, widest chapter number)} for files on disk.
+
+    stems maps each lowercase filename stem ('psa', 'psalms') to its code.
+    A stem may end in digits ('ps2'), so the longest matching stem wins.
+    Pages under a legacy name count as the chapter they stand for.
+    """
+    legacy = {os.path.splitext(old)[0].lower(): os.path.splitext(new)[0].lower()
+              for old, new in LEGACY_FILENAMES.items()}
+    found = {}
+    for path in glob.glob(os.path.join(books_dir, '*.htm')) + glob.glob(os.path.join(books_dir, '*.html')):
+        name = os.path.splitext(os.path.basename(path))[0].lower()
+        name = legacy.get(name, name)
+        base = name.rstrip('0123456789')
+        digits = name[len(base):]
+        for split in range(len(digits), -1, -1):
+            code = stems.get(base + digits[:split])
+            if code is None:
+                continue
+            chapter = digits[split:]
+            if chapter:
+                highest, width = found.get(code, (0, 0))
+                found[code] = (max(highest, int(chapter)), max(width, len(chapter)))
+            break
+    return found
+
+
+def load_book_table(books_dir, parms_path=None):
+    """Build the BookTable of the edition in books_dir.
+
+    Raises ValueError when the edition has no VernacularParms file or no
+    chapter pages.
+    """
+    parms_path = parms_path or find_vernacular_parms(books_dir)
+    if not parms_path:
+        raise ValueError(f"no meta/*VernacularParms.xml next to {books_dir}")
+    entries = read_vernacular_parms(parms_path)
+
+    mapping = {}
+    names = {}
+    stems = {}
+    for code, parms in entries:
+        name = next((parms[parm] for parm in NAME_PARMS if parm in parms), code)
+        prefix = prefix_for(code, name)
+        mapping[code] = prefix
+        names[prefix] = name
+        stems[code.lower()] = code
+        stems[prefix.lower()] = code
+
+    chapters = scan_chapters(books_dir, stems)
+    if not chapters:
+        raise ValueError(f"no chapter pages in {books_dir}")
+    books = []
+    widths = {}
+    for code, parms in entries:
+        if code in PERIPHERAL_CODES or code not in chapters:
+            continue
+        prefix = mapping[code]
+        highest, width = chapters[code]
+        testament = 'ot' if code in OT_CODES else 'nt' if code in NT_CODES else 'dc'
+        books.append((prefix, names[prefix], highest, testament))
+        if width != DEFAULT_WIDTH:
+            widths[prefix] = width
+    return BookTable(books, mapping, widths, names)
+
+
+def compare_with_builtin(table):
+    """Return lines describing where table differs from BOOKS / BOOK_MAPPING."""
+    lines = []
+    builtin = {book[0]: book for book in BOOKS}
+    for book in table.books:
+        old = builtin.pop(book[0], None)
+        if old is None:
+            lines.append(f"  + {book[0]} ({book[1]}, {book[2]} chapters)")
+        elif old != book:
+            lines.append(f"  ~ {book[0]}: {old[1:]} -> {book[1:]}")
+    for prefix in builtin:
+        lines.append(f"  - {prefix} (no chapter files)")
+    for code, prefix in table.mapping.items():
+        if BOOK_MAPPING.get(code) != prefix:
+            lines.append(f"  mapping {code}: {BOOK_MAPPING.get(code)} -> {prefix}")
+    return lines
+
+
+def main(argv=None):
+    books_dirs = (sys.argv[1:] if argv is None else argv) or [BOOKS_DIR]
+    for books_dir in books_dirs:
+        try:
+            table = load_book_table(books_dir)
+        except ValueError as e:
+            print(f"{books_dir}: {e}")
+            continue
+        chapters = sum(book[2] for book in table.books)
+        print(f"{books_dir}: {len(table.books)} books, {chapters} chapters, "
+              f"{len(table.mapping)} codes")
+        for prefix, width in sorted(table.widths.items()):
+            print(f"  {prefix}: chapter numbers padded to {width} digits")
+        differences = compare_with_builtin(table)
+        if differences:
+            print("  Differences from the built-in WEB tables:")
+            print('\n'.join(differences))
+
+
+if __name__ == '__main__':
+    main()
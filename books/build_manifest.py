@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Build manifest for incremental runs of the books/ scripts.
+- Records, for every output, the hash of its input and a fingerprint of
+  the generator (its source code plus the tables it renders from)
+- Lets a rerun skip outputs whose input and generator are unchanged
+- Only rewrites a file when its bytes actually change
+"""
+
+import os
+import json
+import hashlib
+
+MANIFEST_NAME = '.build_manifest.json'
+
+
+def hash_bytes(data):
+    """Return the hex SHA-256 of a bytes object."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path):
+    """Return the hex SHA-256 of a file's contents."""
+    with open(path, 'rb') as f:
+        return hash_bytes(f.read())
+
+
+def generator_fingerprint(source_files, *tables):
+    """Fingerprint generator code and the data tables it renders from.
+
+    source_files are hashed byte for byte, so any change to a template or
+    helper invalidates the outputs. tables are serialized as JSON.
+    """
+    digest = hashlib.sha256()
+    for path in source_files:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    digest.update(json.dumps(tables, sort_keys=True, default=repr).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def file_stat(path):
+    """Return (mtime_ns, size) for path, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def write_if_changed(path, content):
+    """Write content (str) to path unless the file already holds those bytes.
+
+    Returns True if the file was written.
+    """
+    data = content.encode('utf-8')
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(path, 'wb') as f:
+        f.write(data)
+    return True
+
+
+class BuildManifest:
+    """Per-script section of the build manifest in a books directory.
+
+    Each entry is keyed by output filename and stores the input name and
+    hash, the generator fingerprint, and the hash and stat of the output
+    as it was written.
+    """
+
+    def __init__(self, books_dir, section, fingerprint, force=False):
+        self.path = os.path.join(books_dir, MANIFEST_NAME)
+        self.books_dir = books_dir
+        self.section = section
+        self.fingerprint = fingerprint
+        self.force = force
+        self.data = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.data = {}
+        self.entries = self.data.setdefault(section, {})
+
+    def is_fresh(self, output_name, input_hash=None, check_output=True):
+        """Return True if output_name does not need to be rebuilt.
+
+        input_hash is the hash of a separate input file; leave it as None
+        for scripts that rewrite their output in place. When check_output
+        is set, the output must still hold the bytes that were recorded.
+        """
+        if self.force:
+            return False
+        entry = self.entries.get(output_name)
+        if not entry or entry.get('fingerprint') != self.fingerprint:
+            return False
+        if input_hash is not None and entry.get('input_hash') != input_hash:
+            return False
+
+        output_path = os.path.join(self.books_dir, output_name)
+        stat = file_stat(output_path)
+        if stat is None:
+            return False
+        if not check_output or stat == entry.get('output_stat'):
+            return True
+
+        # Touched but possibly unchanged: fall back to the content hash
+        if hash_file(output_path) != entry.get('output_hash'):
+            return False
+        entry['output_stat'] = stat
+        return True
+
+    def record(self, output_name, output_hash, input_name=None, input_hash=None):
+        """Record a freshly built (or verified) output."""
+        entry = {
+            'fingerprint': self.fingerprint,
+            'output_hash': output_hash,
+            'output_stat': file_stat(os.path.join(self.books_dir, output_name)),
+        }
+        if input_name is not None:
+            entry['input'] = input_name
+            entry['input_hash'] = input_hash
+        self.entries[output_name] = entry
+
+    def save(self):
+        """Write the manifest back to disk."""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
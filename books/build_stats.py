@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Per-stage timing and profiling for the books/ build scripts.
+- BuildStats records wall and CPU time per stage (read, links, clean,
+  footnotes, render, write), bytes in and out per file and the slowest files
+- Stage times are exclusive: a stage nested in another (footnotes inside
+  clean) is not counted twice
+- Workers of a process pool keep their own BuildStats and send the
+  per-file records back to be merged
+- run_profiled() wraps a run in cProfile or tracemalloc; either sees the
+  main process only, so with worker processes (-j) the report says the
+  workers' time and memory are not in it
+- The report is JSON, written next to the scripts by default
+"""
+
+import os
+import json
+import time
+import pstats
+import cProfile
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+PROFILE_MODES = ('cprofile', 'tracemalloc')
+TOP_ENTRIES = 25
+
+
+class NullStats:
+    """Stand-in used when stats are off; every call is a no-op."""
+
+    enabled = False
+    _context = nullcontext()
+
+    def stage(self, name):
+        return self._context
+
+    def begin_file(self, name, path=None):
+        pass
+
+    def end_file(self, bytes_out=0):
+        pass
+
+
+NULL_STATS = NullStats()
+
+
+class BuildStats:
+    """Stage timings and per-file sizes for one run of a build script."""
+
+    enabled = True
+
+    def __init__(self, script):
+        self.script = script
+        self.stages = {}     # stage -> [calls, wall, cpu]
+        self.files = {}      # filename -> {'stages': {stage: wall}, 'bytes_in', 'bytes_out'}
+        self.current = None
+        self._stack = []
+        self.started = time.perf_counter()
+        self.started_cpu = time.process_time()
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block as one stage of the current file."""
+        child = [0.0, 0.0]   # time spent in nested stages
+        self._stack.append(child)
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall0
+            cpu = time.process_time() - cpu0
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1][0] += wall
+                self._stack[-1][1] += cpu
+            self._add(name, wall - child[0], cpu - child[1])
+
+    def _add(self, name, wall, cpu):
+        totals = self.stages.setdefault(name, [0, 0.0, 0.0])
+        totals[0] += 1
+        totals[1] += wall
+        totals[2] += cpu
+        if self.current is not None:
+            stages = self.files[self.current]['stages']
+            stages[name] = stages.get(name, 0.0) + wall
+
+    def begin_file(self, name, path=None):
+        """Attribute the following stages to a file; path is the input read for it."""
+        self.current = name
+        record = self.files.setdefault(name, {'stages': {}, 'bytes_in': 0, 'bytes_out': 0})
+        if path is not None:
+            record['bytes_in'] += os.path.getsize(path)
+
+    def end_file(self, bytes_out=0):
+        if self.current is not None:
+            self.files[self.current]['bytes_out'] += bytes_out
+        self.current = None
+
+    def export(self):
+        """Stage totals and file records, for sending back from a worker."""
+        return self.stages, self.files
+
+    def merge(self, exported):
+        """Add the stage totals and file records of a worker's BuildStats."""
+        stages, files = exported
+        for name, (calls, wall, cpu) in stages.items():
+            totals = self.stages.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += calls
+            totals[1] += wall
+            totals[2] += cpu
+        for name, record in files.items():
+            mine = self.files.setdefault(name, {'stages': {}, 'bytes_in': 0, 'bytes_out': 0})
+            mine['bytes_in'] += record['bytes_in']
+            mine['bytes_out'] += record['bytes_out']
+            for stage, wall in record['stages'].items():
+                mine['stages'][stage] = mine['stages'].get(stage, 0.0) + wall
+
+    def report(self, slowest=10, extra=None):
+        """Return the run as a JSON-serializable dict."""
+        wall = time.perf_counter() - self.started
+        cpu = time.process_time() - self.started_cpu
+        files = []
+        for name, record in self.files.items():
+            total = sum(record['stages'].values())
+            files.append({'file': name, 'seconds': round(total, 6),
+                          'bytes_in': record['bytes_in'], 'bytes_out': record['bytes_out'],
+                          'stages': {s: round(t, 6) for s, t in record['stages'].items()}})
+        files.sort(key=lambda f: -f['seconds'])
+        report = {
+            'script': self.script,
+            'wall_seconds': round(wall, 4),
+            'cpu_seconds': round(cpu, 4),
+            'files': len(self.files),
+            'bytes_in': sum(f['bytes_in'] for f in files),
+            'bytes_out': sum(f['bytes_out'] for f in files),
+            'stages': {name: {'calls': calls, 'wall_seconds': round(w, 4), 'cpu_seconds': round(c, 4)}
+                       for name, (calls, w, c) in self.stages.items()},
+            'slowest': files[:slowest],
+        }
+        if extra:
+            report.update(extra)
+        return report
+
+
+def print_report(report):
+    """Print a short human-readable summary of a report."""
+    print(f"\nStats: {report['files']} files, {report['bytes_in'] / 1e6:.1f} MB in, "
+          f"{report['bytes_out'] / 1e6:.1f} MB out, {report['wall_seconds']:.2f}s wall, "
+          f"{report['cpu_seconds']:.2f}s CPU (this process)")
+    for name, stage in sorted(report['stages'].items(), key=lambda item: -item[1]['wall_seconds']):
+        print(f"  {name:10s} {stage['wall_seconds']:8.3f}s wall {stage['cpu_seconds']:8.3f}s CPU "
+              f"{stage['calls']:6d} calls")
+    if report['slowest']:
+        print("  Slowest files:")
+        for record in report['slowest']:
+            print(f"    {record['file']:28s} {record['seconds'] * 1000:8.2f} ms "
+                  f"{record['bytes_in']:>9,} -> {record['bytes_out']:,} bytes")
+    profile = report.get('profile')
+    if profile and profile['workers']:
+        print(f"  The {profile['mode']} profile covers the main process only, "
+              f"not the {profile['workers']} workers")
+
+
+def write_report(report, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    print(f"Wrote {path}")
+
+
+def run_profiled(func, mode, prof_path, jobs=1):
+    """Run func() under cProfile or tracemalloc; return (result, report section).
+
+    cProfile data is also dumped to prof_path for snakeviz / pstats. With
+    jobs > 1, func's pages are processed in workers the profile does not see.
+    """
+    workers = jobs if jobs > 1 else 0
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        result = profiler.runcall(func)
+        profiler.dump_stats(prof_path)
+        stats = pstats.Stats(profiler)
+        top = []
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            top.append({'function': f'{os.path.basename(filename)}:{line}({name})', 'calls': calls,
+                        'tottime': round(tottime, 6), 'cumtime': round(cumtime, 6)})
+        top.sort(key=lambda entry: -entry['tottime'])
+        print(f"Wrote {prof_path}")
+        return result, {'profile': {'mode': mode, 'workers': workers, 'path': prof_path,
+                                    'top': top[:TOP_ENTRIES]}}
+
+    tracemalloc.start()
+    try:
+        result = func()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    top = [{'location': str(stat.traceback), 'bytes': stat.size, 'blocks': stat.count}
+           for stat in snapshot.statistics('lineno')[:TOP_ENTRIES]]
+    return result, {'profile': {'mode': mode, 'workers': workers, 'current_bytes': current,
+                                'peak_bytes': peak, 'top': top}}
+
+
+def add_arguments(parser):
+    """Add --stats, --profile and --slowest to a script's argument parser."""
+    parser.add_argument('--stats', nargs='?', const='', metavar='PATH',
+                        help='time each stage and write a JSON report (default: <script>.stats.json)')
+    parser.add_argument('--profile', choices=PROFILE_MODES,
+                        help='also run under cProfile or tracemalloc (implies --stats); '
+                             'covers the main process only, not the workers of -j')
+    parser.add_argument('--slowest', type=int, default=10, help='files listed in the report')
+
+
+def run_with_stats(args, script, books_dir, run, jobs=1):
+    """Call run(stats) with stats set up as the parsed arguments ask.
+
+    jobs is the number of worker processes run uses, for the profile report.
+    """
+    if args.stats is None and not args.profile:
+        return run(NULL_STATS)
+
+    stats = BuildStats(script)
+    report_path = args.stats or os.path.join(books_dir, f'{script}.stats.json')
+    extra = None
+    if args.profile:
+        prof_path = os.path.splitext(report_path)[0] + '.prof'
+        result, extra = run_profiled(lambda: run(stats), args.profile, prof_path, jobs)
+    else:
+        result = run(stats)
+    report = stats.report(args.slowest, extra)
+    print_report(report)
+    write_report(report, report_path)
+    return result
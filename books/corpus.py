@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Read the cleaned chapter pages back in as verses.
+- Find chapter pages (*.htm or *.html) and resolve them to BOOKS entries
+- Split a page's <main> into verse texts using the verse spans written by
+  modernize_bible.clean_paragraph
+"""
+
+import os
+import re
+import glob
+import html
+
+from add_navigation import BOOKS, split_chapter_stem
+from modernize_bible import LEGACY_FILENAMES as LEGACY_PAGES, iter_html_events, get_attr
+
+# Book ordinal (position in BOOKS) by filename prefix
+BOOK_ORDINALS = {book[0]: i for i, book in enumerate(BOOKS)}
+
+# Old stem -> current stem of pages older builds named differently
+# (modernize_bible.LEGACY_FILENAMES). A page published under its old name
+# is still read; a current page of the same chapter takes precedence.
+LEGACY_FILENAMES = {old[:-len('.htm')]: new[:-len('.htm')] for old, new in LEGACY_PAGES.items()}
+
+_MAIN_RE = re.compile(r'<main class="main">(.*?)</main>', re.DOTALL)
+_VERSE_ID_RE = re.compile(r'v(\d+)')
+
+
+def parse_chapter_filename(basename):
+    """Return (book_info, chapter) for a chapter page name, or None."""
+    stem, ext = os.path.splitext(basename)
+    if ext not in ('.htm', '.html'):
+        return None
+    parsed = split_chapter_stem(LEGACY_FILENAMES.get(stem, stem))
+    if not parsed:
+        return None
+    _, book, chapter = parsed
+    if not 1 <= chapter <= book[2]:
+        return None
+    return book, chapter
+
+
+def find_chapter_files(books_dir):
+    """Return [(book_ordinal, chapter, path)] in canonical book order.
+
+    If a chapter exists as both .htm and .html, the .html page is used,
+    and a page under its current name is used over one under a legacy name
+    (which may be a redirect).
+    """
+    found = {}
+    legacy = {}
+    for path in sorted(glob.glob(os.path.join(books_dir, '*.htm*'))):
+        basename = os.path.basename(path)
+        parsed = parse_chapter_filename(basename)
+        if parsed:
+            book, chapter = parsed
+            pages = legacy if os.path.splitext(basename)[0] in LEGACY_FILENAMES else found
+            pages[(BOOK_ORDINALS[book[0]], chapter)] = path
+    found = {**legacy, **found}
+    return [(ordinal, chapter, path) for (ordinal, chapter), path in sorted(found.items())]
+
+
+def chapter_file_naming(ordinal, path):
+    """Return (prefix, chapter digits, extension, filename) for a file of find_chapter_files.
+
+    The first three say how the book's chapter files are named, from its
+    current names even for a page kept under a legacy name (Psalm_151, 2,
+    '.html' for Psalm_151201.html); filename is that legacy name, else None.
+    """
+    stem, ext = os.path.splitext(os.path.basename(path))
+    name = LEGACY_FILENAMES.get(stem, stem)
+    prefix = name[:len(BOOKS[ordinal][0])]
+    return prefix, len(name) - len(prefix), ext, stem + ext if name != stem else None
+
+
+def extract_main(page_html):
+    """Return the inner HTML of a page's <main class="main">."""
+    match = _MAIN_RE.search(page_html)
+    return match.group(1) if match else ''
+
+
+def parse_verses(main_html):
+    """Split cleaned main content into [(verse, text)].
+
+    Only paragraph text counts; titles, chapter labels and section headings
+    are skipped, as are footnote marks. Text that follows a verse in a later
+    paragraph (poetry lines, quotations) belongs to that verse. Entities are
+    decoded and whitespace is collapsed.
+    """
+    verses = []
+    parts = None
+    in_paragraph = False
+    skip_until = None   # end tag that closes a verse number or notemark
+
+    for kind, tag, attrs, raw in iter_html_events(main_html):
+        if skip_until:
+            if kind == 'end' and tag == skip_until:
+                skip_until = None
+            continue
+
+        if kind == 'text':
+            if in_paragraph and parts is not None:
+                parts.append(raw)
+        elif kind == 'start':
+            if tag == 'p':
+                in_paragraph = True
+                if parts is not None:
+                    parts.append(' ')
+            elif tag == 'span' and get_attr(attrs, 'class') == 'verse':
+                match = _VERSE_ID_RE.fullmatch(get_attr(attrs, 'id') or '')
+                if match:
+                    parts = []
+                    verses.append((int(match.group(1)), parts))
+                skip_until = 'span'
+            elif tag == 'a' and get_attr(attrs, 'class') == 'notemark':
+                skip_until = 'a'
+        elif tag == 'p':
+            in_paragraph = False
+
+    return [(verse, ' '.join(html.unescape(''.join(parts)).split()))
+            for verse, parts in verses]
+
+
+def read_chapter_verses(path):
+    """Read a chapter page and return [(verse, text)]."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return parse_verses(extract_main(f.read()))
+
+
+def iter_verses(books_dir):
+    """Yield (book_ordinal, chapter, verse, text) for the whole corpus."""
+    for ordinal, chapter, path in find_chapter_files(books_dir):
+        for verse, text in read_chapter_verses(path):
+            yield ordinal, chapter, verse, text
+
+
+def format_reference(book_ordinal, chapter, verse=None):
+    """Format a reference for display, e.g. 'Mark 15:34'."""
+    name = BOOKS[book_ordinal][1]
+    return f'{name} {chapter}:{verse}' if verse is not None else f'{name} {chapter}'
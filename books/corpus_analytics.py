@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Word statistics and related chapters from a chapter x term count matrix.
+- Tokenizes the verse text once (search_index.tokenize) into a sparse
+  matrix of counts: one row per chapter in canonical order, so the rows
+  of a book are contiguous, and one column per term. Rows carry their
+  book ordinal, so book and testament totals are bincounts
+- The matrix is cached in books/analytics.npz with a fingerprint of the
+  chapter files (names, sizes, mtimes) and rebuilt when one changes
+- Queries are NumPy array operations on the cached arrays: word
+  frequency by book or testament (the ot / dc / nt tags of BOOKS),
+  concordance counts per chapter (a trailing * matches a prefix), the
+  most distinctive words of a chapter by TF-IDF, and the chapters most
+  similar to a chapter by cosine similarity of their TF-IDF vectors
+- Needs NumPy; with SciPy installed the similarity product uses
+  scipy.sparse, otherwise a term-major copy of the matrix and bincount
+
+Usage:
+  python corpus_analytics.py build
+  python corpus_analytics.py freq shepherd [--by testament]
+  python corpus_analytics.py concordance 'shepherd*' sheep
+  python corpus_analytics.py tfidf 'Ruth 1' [-k 10]
+  python corpus_analytics.py related 'John 10' [-k 10]
+  python corpus_analytics.py bench
+"""
+
+import os
+import time
+import random
+import hashlib
+import argparse
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import scipy.sparse as sparse
+except ImportError:
+    sparse = None
+
+from add_navigation import BOOKS
+from corpus import BOOK_ORDINALS, find_chapter_files, format_reference, read_chapter_verses
+from references import parse_reference
+from search_index import tokenize
+
+ANALYTICS_NAME = 'analytics.npz'
+FORMAT_VERSION = 1
+TESTAMENTS = ['ot', 'dc', 'nt']
+
+# Sorts after every term, for the end of a prefix range
+_LAST = '\U0010ffff'
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError('corpus_analytics needs NumPy (pip install numpy)')
+
+
+def source_fingerprint(files):
+    """Hash of the chapter files' names, sizes and mtimes, to tell when the cache is stale."""
+    digest = hashlib.sha256(f'{FORMAT_VERSION}\n'.encode())
+    for _, _, path in files:
+        st = os.stat(path)
+        digest.update(f'{os.path.basename(path)}\0{st.st_size}\0{st.st_mtime_ns}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def build_matrix(books_dir, path):
+    """Tokenize every chapter in books_dir and write the count matrix to path.
+
+    Returns (chapters, terms, entries).
+    """
+    require_numpy()
+    files = find_chapter_files(books_dir)
+    chapters = []
+    for _, _, chapter_path in files:
+        counts = Counter()
+        for _, text in read_chapter_verses(chapter_path):
+            counts.update(tokenize(text))
+        chapters.append(counts)
+
+    terms = sorted(set().union(*chapters))
+    term_ids = {term: i for i, term in enumerate(terms)}
+    indptr = np.zeros(len(chapters) + 1, dtype=np.int64)
+    indices = []
+    counts = []
+    for row, chapter in enumerate(chapters):
+        entries = sorted((term_ids[term], count) for term, count in chapter.items())
+        indices.extend(term for term, _ in entries)
+        counts.extend(count for _, count in entries)
+        indptr[row + 1] = len(indices)
+    indices = np.array(indices, dtype=np.int32)
+
+    # Term-major order of the entries: the chapters of a term are one slice
+    term_ptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(indices, minlength=len(terms)), out=term_ptr[1:])
+
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path,
+             fingerprint=np.array(source_fingerprint(files)),
+             refs=np.array([(ordinal, chapter) for ordinal, chapter, _ in files], dtype=np.int32).reshape(-1, 2),
+             terms=np.array(terms, dtype=str),
+             indptr=indptr, indices=indices, counts=np.array(counts, dtype=np.int32),
+             term_ptr=term_ptr, term_entries=np.argsort(indices, kind='stable').astype(np.int32))
+    os.replace(tmp_path, path)
+    return len(chapters), len(terms), len(indices)
+
+
+def load_matrix(books_dir, path=None, rebuild=True):
+    """Open the cached matrix of books_dir, building it first when missing or stale."""
+    require_numpy()
+    path = path or os.path.join(books_dir, ANALYTICS_NAME)
+    if rebuild:
+        fresh = False
+        if os.path.exists(path):
+            with np.load(path) as data:
+                fresh = str(data['fingerprint']) == source_fingerprint(find_chapter_files(books_dir))
+        if not fresh:
+            build_matrix(books_dir, path)
+    return CorpusMatrix(path)
+
+
+def slices(starts, ends):
+    """Concatenate the index ranges [start, end) into one array."""
+    lengths = ends - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return np.arange(lengths.sum()) + offsets
+
+
+class CorpusMatrix:
+    """The cached chapter x term counts and the queries on them."""
+
+    def __init__(self, path):
+        require_numpy()
+        with np.load(path) as data:
+            self.refs = data['refs']
+            self.terms = data['terms']
+            self.indptr = data['indptr']
+            self.indices = data['indices']
+            self.counts = data['counts']
+            self.term_ptr = data['term_ptr']
+            self.term_entries = data['term_entries']
+        self.chapters = len(self.refs)
+        self.entry_rows = np.repeat(np.arange(self.chapters, dtype=np.int32), np.diff(self.indptr))
+        self.term_rows = self.entry_rows[self.term_entries]
+        self.term_counts = self.counts[self.term_entries]
+        self.books = self.refs[:, 0]
+        self.chapter_tokens = np.bincount(self.entry_rows, weights=self.counts, minlength=self.chapters)
+        self.book_tokens = np.bincount(self.books, weights=self.chapter_tokens, minlength=len(BOOKS))
+        self.testament_of = np.array([TESTAMENTS.index(book[3]) for book in BOOKS])
+        self.row_of = {(int(ordinal), int(chapter)): row for row, (ordinal, chapter) in enumerate(self.refs)}
+        self._weights = None
+        self._sparse = None
+
+    def lookup(self, word):
+        """Term ids a query word stands for: the word, or every term it starts when it ends in '*'."""
+        tokens = tokenize(word)
+        if len(tokens) != 1:
+            return np.zeros(0, dtype=np.int64)
+        start = int(np.searchsorted(self.terms, tokens[0]))
+        if word.endswith('*'):
+            return np.arange(start, int(np.searchsorted(self.terms, tokens[0] + _LAST)))
+        if start < len(self.terms) and self.terms[start] == tokens[0]:
+            return np.array([start])
+        return np.zeros(0, dtype=np.int64)
+
+    def occurrences(self, ids):
+        """Return (rows, counts) of the chapters using any of the term ids, rows ascending."""
+        take = slices(self.term_ptr[ids], self.term_ptr[ids + 1])
+        rows, counts = self.term_rows[take], self.term_counts[take]
+        if len(ids) > 1:
+            rows, inverse = np.unique(rows, return_inverse=True)
+            counts = np.bincount(inverse, weights=counts).astype(np.int64)
+        return rows, counts
+
+    def frequency(self, word, by='book'):
+        """Return (occurrences, tokens) per book ordinal, or per TESTAMENTS entry."""
+        rows, counts = self.occurrences(self.lookup(word))
+        found = np.bincount(self.books[rows], weights=counts, minlength=len(BOOKS))
+        if by == 'testament':
+            return (np.bincount(self.testament_of, weights=found, minlength=len(TESTAMENTS)),
+                    np.bincount(self.testament_of, weights=self.book_tokens, minlength=len(TESTAMENTS)))
+        return found, self.book_tokens
+
+    def concordance(self, words):
+        """Return {word: (rows, counts)} of the chapters each word occurs in."""
+        return {word: self.occurrences(self.lookup(word)) for word in words}
+
+    @property
+    def weights(self):
+        """TF-IDF weight of every entry, each chapter's row scaled to unit length."""
+        if self._weights is None:
+            idf = np.log(self.chapters / np.maximum(np.diff(self.term_ptr), 1))
+            weights = self.counts * idf[self.indices]
+            norms = np.sqrt(np.bincount(self.entry_rows, weights=weights * weights, minlength=self.chapters))
+            weights /= np.where(norms > 0, norms, 1)[self.entry_rows]
+            self._weights = weights
+            self._term_weights = weights[self.term_entries]
+        return self._weights
+
+    def top_terms(self, row, k=10):
+        """Return [(term, weight)] of the chapter's highest TF-IDF terms."""
+        start, end = self.indptr[row], self.indptr[row + 1]
+        weights = self.weights[start:end]
+        top = np.argsort(-weights)[:k]
+        return [(str(self.terms[self.indices[start + i]]), float(weights[i])) for i in top]
+
+    def similarities(self, row):
+        """Cosine similarity of every chapter to the chapter at row."""
+        weights = self.weights
+        start, end = self.indptr[row], self.indptr[row + 1]
+        if sparse is not None:
+            if self._sparse is None:
+                self._sparse = sparse.csr_matrix((weights, self.indices, self.indptr),
+                                                 shape=(self.chapters, len(self.terms)))
+            query = np.zeros(len(self.terms))
+            query[self.indices[start:end]] = weights[start:end]
+            return self._sparse.dot(query)
+        ids = self.indices[start:end]
+        starts, ends = self.term_ptr[ids], self.term_ptr[ids + 1]
+        take = slices(starts, ends)
+        products = self._term_weights[take] * np.repeat(weights[start:end], ends - starts)
+        return np.bincount(self.term_rows[take], weights=products, minlength=self.chapters)
+
+    def related(self, row, k=10):
+        """Return [(row, similarity)] of the k chapters most like the chapter at row."""
+        scores = self.similarities(row)
+        scores[row] = -np.inf
+        k = min(k, self.chapters - 1)
+        top = np.argpartition(-scores, k - 1)[:k] if k > 0 else np.zeros(0, dtype=np.int64)
+        return [(int(i), float(scores[i])) for i in top[np.argsort(-scores[top])]]
+
+    def reference(self, row):
+        ordinal, chapter = self.refs[row]
+        return format_reference(int(ordinal), int(chapter))
+
+
+def chapter_row(matrix, reference):
+    """Row of the chapter a reference such as 'John 10' names; raises ValueError."""
+    ref = parse_reference(reference)[0]
+    row = matrix.row_of.get((BOOK_ORDINALS[ref.book], ref.start_chapter))
+    if row is None:
+        raise ValueError(f"No chapter page for {reference!r}")
+    return row
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def bench(matrix, count=500, seed=1):
+    """Time each kind of query; print p50 / p99 in milliseconds."""
+    rng = random.Random(seed)
+    words = [str(term) for term in matrix.terms[np.diff(matrix.term_ptr) >= 5]]
+    matrix.weights   # computed once, on first use
+
+    cases = {
+        'frequency by book': lambda: matrix.frequency(rng.choice(words)),
+        'frequency by testament': lambda: matrix.frequency(rng.choice(words), 'testament'),
+        'concordance, prefix': lambda: matrix.concordance([rng.choice(words)[:3] + '*']),
+        'tf-idf top 10': lambda: matrix.top_terms(rng.randrange(matrix.chapters)),
+        'related chapters, top 10': lambda: matrix.related(rng.randrange(matrix.chapters)),
+    }
+    print(f"{'Query':26s} {'p50 ms':>8s} {'p99 ms':>8s}")
+    for name, run in cases.items():
+        samples = []
+        for _ in range(count):
+            started = time.perf_counter()
+            run()
+            samples.append((time.perf_counter() - started) * 1000)
+        print(f"{name:26s} {percentile(samples, 0.5):8.3f} {percentile(samples, 0.99):8.3f}")
+
+
+def print_frequency(matrix, word, by):
+    found, tokens = matrix.frequency(word, by)
+    names = TESTAMENTS if by == 'testament' else [book[1] for book in BOOKS]
+    for name, hits, total in zip(names, found, tokens):
+        if hits:
+            print(f"  {name:24s} {int(hits):7,d} {hits / total * 10000:9.2f} per 10,000 words")
+    print(f"{word}: {int(found.sum()):,} occurrences in {int(tokens.sum()):,} words")
+
+
+def main(argv=None):
+    books_dir = os.path.dirname(os.path.abspath(__file__))
+    default_path = os.path.join(books_dir, ANALYTICS_NAME)
+
+    parser = argparse.ArgumentParser(description='Word statistics and related chapters')
+    parser.add_argument('--matrix', default=default_path, help='cached matrix file')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('build', help='build the matrix from the chapter pages')
+    freq = sub.add_parser('freq', help='frequency of a word by book or testament')
+    freq.add_argument('word')
+    freq.add_argument('--by', choices=['book', 'testament'], default='book')
+    concordance = sub.add_parser('concordance', help='occurrences of words per chapter')
+    concordance.add_argument('words', nargs='+', help="words; 'shepherd*' matches a prefix")
+    concordance.add_argument('-n', '--limit', type=int, default=10, help='chapters to list per word')
+    for name, help_text in (('tfidf', 'most distinctive words of a chapter'),
+                            ('related', 'chapters most similar to a chapter')):
+        command = sub.add_parser(name, help=help_text)
+        command.add_argument('chapter', help="a chapter, e.g. 'John 10'")
+        command.add_argument('-k', type=int, default=10, help='number of results')
+    sub.add_parser('bench', help='time each kind of query')
+    args = parser.parse_args(argv)
+
+    if np is None:
+        parser.error('corpus_analytics needs NumPy (pip install numpy)')
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        chapters, terms, entries = build_matrix(books_dir, args.matrix)
+        elapsed = time.perf_counter() - start
+        print(f"Counted {terms:,} terms in {chapters:,} chapters ({entries:,} entries) in {elapsed:.2f}s")
+        print(f"Wrote {args.matrix} ({os.path.getsize(args.matrix):,} bytes)")
+        return
+
+    start = time.perf_counter()
+    matrix = load_matrix(books_dir, args.matrix)
+    loaded = time.perf_counter()
+    if args.command == 'bench':
+        print(f"Loaded {args.matrix} in {(loaded - start) * 1000:.1f} ms "
+              f"({'scipy.sparse' if sparse is not None else 'NumPy only'})")
+        bench(matrix)
+        return
+
+    if args.command == 'freq':
+        print_frequency(matrix, args.word, args.by)
+    elif args.command == 'concordance':
+        for word, (rows, counts) in matrix.concordance(args.words).items():
+            print(f"{word}: {int(counts.sum()):,} occurrences in {len(rows):,} chapters")
+            for i in np.argsort(-counts, kind='stable')[:args.limit]:
+                print(f"  {matrix.reference(rows[i]):28s} {int(counts[i]):4d}")
+    else:
+        try:
+            row = chapter_row(matrix, args.chapter)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.command == 'tfidf':
+            for term, weight in matrix.top_terms(row, args.k):
+                print(f"  {term:20s} {weight:.3f}")
+        else:
+            for other, score in matrix.related(row, args.k):
+                print(f"  {matrix.reference(other):28s} {score:.3f}")
+    done = time.perf_counter()
+    print(f"(load {(loaded - start) * 1000:.1f} ms, query {(done - loaded) * 1000:.2f} ms)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Verse-level cross-reference graph from the footnotes.
+- References in footnote text (the footer entries and the notemark titles
+  clean_paragraph writes) are found with references.scan_references; each
+  one is an edge from the verse the note is on to every verse it names
+- Stored as CSR adjacency arrays in a packed file: the edges of a verse
+  are one slice of a flat array, found through the same book / chapter /
+  verse slot arrays as verse_store.py. The reverse edges are stored the
+  same way, so "what cites this verse" is two array lookups and a slice
+- The 'crossrefs' stage of pipeline.py links the references in footnote
+  text to the verses they name. A note only its notemark's title holds
+  (Mark 15:34's "Psalm 22:1") first gets its footer entry, written from
+  the title, so its references are linked and its #FN link resolves
+
+Usage:
+  python cross_references.py build [-j N]
+  python cross_references.py cites 'Mark 15:34'
+  python cross_references.py cited-by 'Psalm 22:1'
+  python cross_references.py top [N]
+"""
+
+import os
+import re
+import html
+import time
+import argparse
+from array import array
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from add_navigation import BOOKS, chapter_filename, get_book_info, split_chapter_stem
+from corpus import BOOK_ORDINALS, extract_main, find_chapter_files, format_reference
+from packed_arrays import PackedFile, write_packed
+from references import format_range, parse_reference, scan_references
+from sqlite_export import parse_chapter, parse_footnotes
+from verse_store import book_ordinal
+
+GRAPH_NAME = 'crossrefs.idx'
+MAGIC = b'WEBXRF01'
+
+# Header counts: books, verse slots, edges, notes with references
+SECTIONS = [
+    ('book_start', 'I'),     # first chapter slot of each book, plus end
+    ('chapter_start', 'I'),  # first verse slot of each chapter slot, plus end
+    ('slot_refs', 'H'),      # book ordinal, chapter, verse of each verse slot
+    ('out_start', 'I'),      # first forward edge of each verse slot, plus end
+    ('out_edges', 'I'),      # verse slots cited by each slot
+    ('in_start', 'I'),       # first reverse edge of each verse slot, plus end
+    ('in_edges', 'I'),       # verse slots citing each slot
+]
+
+# As in verse_store.py: slot = start + number, and slots for chapter 0,
+# verse 0 and verses not in the text have no edges
+
+_FOOTER_RE = re.compile(r'(<footer class="footnote">)(.*?)(</footer>)', re.DOTALL)
+_SPLIT_TAGS_RE = re.compile(r'(<[^>]*>)')
+_OPEN_A_RE = re.compile(r'<a[\s>]', re.IGNORECASE)
+_CLOSE_A_RE = re.compile(r'</a\s*>', re.IGNORECASE)
+_ENTRY_RE = re.compile(r'<p class="f" id="(FN\d+)">.*?</p>', re.DOTALL)
+
+
+def chapter_notes(task):
+    """Return (ordinal, chapter, highest verse, [(verse, VerseRange)]) for one page.
+
+    Every footnote is read once: the footer entry when it has one, else
+    the title of its notemark.
+    """
+    ordinal, chapter, path = task
+    with open(path, 'r', encoding='utf-8') as f:
+        page_html = f.read()
+    verses, _, notemarks, _ = parse_chapter(extract_main(page_html))
+    notes = parse_footnotes(page_html)
+    for verse, note, marker, title in notemarks:
+        if note not in notes and title:
+            notes[note] = (verse, marker, title)
+    found = []
+    for verse, _, text in notes.values():
+        if verse is None:
+            continue
+        seen = set()
+        for _, _, ref in scan_references(text):
+            if ref not in seen:
+                seen.add(ref)
+                found.append((verse, ref))
+    return ordinal, chapter, max((verse for verse, _ in verses), default=0), found
+
+
+def iter_chapter_notes(books_dir, jobs=1):
+    """Yield chapter_notes() of every chapter page in canonical order."""
+    tasks = find_chapter_files(books_dir)
+    if jobs <= 1:
+        for task in tasks:
+            yield chapter_notes(task)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(chapter_notes, tasks, chunksize=16)
+
+
+def expand_range(ref, verse_counts):
+    """Yield (ordinal, chapter, verse) for every verse in a VerseRange.
+
+    A whole-chapter reference names every verse of its chapters; verses
+    past the end of a chapter are dropped.
+    """
+    ordinal = BOOK_ORDINALS[ref.book]
+    for chapter in range(ref.start_chapter, ref.end_chapter + 1):
+        count = verse_counts.get((ordinal, chapter), 0)
+        first = ref.start_verse if ref.start_verse is not None and chapter == ref.start_chapter else 1
+        last = ref.end_verse if ref.end_verse is not None and chapter == ref.end_chapter else count
+        for verse in range(first, min(last, count) + 1):
+            yield ordinal, chapter, verse
+
+
+def to_csr(adjacency, slot_count):
+    """Pack {slot: set of slots} into (start, edges) arrays."""
+    start = array('I')
+    edges = array('I')
+    for slot in range(slot_count):
+        start.append(len(edges))
+        edges.extend(sorted(adjacency.get(slot, ())))
+    start.append(len(edges))
+    return start, edges
+
+
+def build_graph(books_dir, path, jobs=1):
+    """Extract the cross-references in books_dir and write the graph to path.
+
+    Returns (notes with references, references, edges).
+    """
+    verse_counts = {}
+    citations = []   # (ordinal, chapter, verse, VerseRange)
+    for ordinal, chapter, highest, found in iter_chapter_notes(books_dir, jobs):
+        verse_counts[(ordinal, chapter)] = highest
+        citations.extend((ordinal, chapter, verse, ref) for verse, ref in found)
+
+    book_start = array('I')
+    chapter_start = array('I')
+    slot_refs = array('H')
+    for ordinal, book in enumerate(BOOKS):
+        book_start.append(len(chapter_start))
+        for chapter in range(book[2] + 1):
+            chapter_start.append(len(slot_refs) // 3)
+            for verse in range(verse_counts.get((ordinal, chapter), 0) + 1):
+                slot_refs.extend((ordinal, chapter, verse))
+    book_start.append(len(chapter_start))
+    slot_count = len(slot_refs) // 3
+    chapter_start.append(slot_count)
+
+    def slot(ordinal, chapter, verse):
+        return chapter_start[book_start[ordinal] + chapter] + verse
+
+    forward = defaultdict(set)
+    reverse = defaultdict(set)
+    notes = set()
+    for ordinal, chapter, verse, ref in citations:
+        source = slot(ordinal, chapter, verse)
+        notes.add(source)
+        for target in expand_range(ref, verse_counts):
+            target = slot(*target)
+            if target != source:
+                forward[source].add(target)
+                reverse[target].add(source)
+
+    arrays = {'book_start': book_start, 'chapter_start': chapter_start, 'slot_refs': slot_refs}
+    arrays['out_start'], arrays['out_edges'] = to_csr(forward, slot_count)
+    arrays['in_start'], arrays['in_edges'] = to_csr(reverse, slot_count)
+    edges = len(arrays['out_edges'])
+    write_packed(path, MAGIC, (len(BOOKS), slot_count, edges, len(notes)), SECTIONS, arrays)
+    return len(notes), len(citations), edges
+
+
+class CrossReferenceGraph(PackedFile):
+    """A memory-mapped graph written by build_graph."""
+
+    def __init__(self, path):
+        super().__init__(path, MAGIC, SECTIONS, 4)
+        self.book_count, self.slot_count, self.edge_count, self.note_count = self.counts
+
+    def verse_count(self, ordinal, chapter):
+        """Return the highest verse number of a chapter (0 if the book has no such chapter)."""
+        start = self.book_start[ordinal]
+        if not 0 < chapter < self.book_start[ordinal + 1] - start:
+            return 0
+        return self.chapter_start[start + chapter + 1] - self.chapter_start[start + chapter] - 1
+
+    def slot(self, book, chapter, verse):
+        """Return the slot of a verse, or None if the text has no such verse."""
+        ordinal = book_ordinal(book)
+        if not 0 < verse <= self.verse_count(ordinal, chapter):
+            return None
+        return self.chapter_start[self.book_start[ordinal] + chapter] + verse
+
+    def ref(self, slot):
+        """Return (book ordinal, chapter, verse) for a slot."""
+        return tuple(self.slot_refs[3 * slot:3 * slot + 3])
+
+    def _edges(self, start, edges, book, chapter, verse):
+        slot = self.slot(book, chapter, verse)
+        if slot is None:
+            return []
+        return [self.ref(target) for target in edges[start[slot]:start[slot + 1]]]
+
+    def cites(self, book, chapter, verse):
+        """Return [(book ordinal, chapter, verse)] the verse's footnotes refer to."""
+        return self._edges(self.out_start, self.out_edges, book, chapter, verse)
+
+    def cited_by(self, book, chapter, verse):
+        """Return [(book ordinal, chapter, verse)] whose footnotes refer to the verse."""
+        return self._edges(self.in_start, self.in_edges, book, chapter, verse)
+
+    def cited_count(self, slot):
+        return self.in_start[slot + 1] - self.in_start[slot]
+
+    def lookup(self, reference, reverse=False):
+        """Return [(verse, [edges])] for every verse of a reference such as 'Ps 22:1-2'."""
+        query = self.cited_by if reverse else self.cites
+        result = []
+        for ref in parse_reference(reference):
+            ordinal = BOOK_ORDINALS[ref.book]
+            for chapter in range(ref.start_chapter, ref.end_chapter + 1):
+                count = self.verse_count(ordinal, chapter)
+                first = ref.start_verse if ref.start_verse and chapter == ref.start_chapter else 1
+                last = ref.end_verse if ref.end_verse and chapter == ref.end_chapter else count
+                for verse in range(first, min(last, count) + 1):
+                    result.append(((ordinal, chapter, verse), query(ordinal, chapter, verse)))
+        return result
+
+
+def reference_href(ref, table=None):
+    """Return the link to the first verse of a VerseRange, or None if the book is not in table."""
+    book = get_book_info(ref.book, table)
+    if book is None:
+        return None
+    href = chapter_filename(book[0], ref.start_chapter, table)
+    return f'{href}#v{ref.start_verse}' if ref.start_verse is not None else href
+
+
+def link_text(text, table=None):
+    """Wrap every reference in a run of footnote text in a link."""
+    out = []
+    pos = 0
+    for start, end, ref in scan_references(text):
+        if start < pos:
+            continue   # a later range of a list ('Ps 1:1, 3') shares the first link
+        href = reference_href(ref, table)
+        if href is None:
+            continue
+        out.append(text[pos:start])
+        out.append(f'<a class="xref" href="{href}">{text[start:end]}</a>')
+        pos = end
+    out.append(text[pos:])
+    return ''.join(out)
+
+
+def add_missing_footnotes(page_html, chapter):
+    """Write the footer entries of the notes only their notemark's title holds.
+
+    Entries are in the order of the notemarks, formatted as
+    modernize_bible.clean_footnotes writes them.
+    """
+    footer = _FOOTER_RE.search(page_html)
+    entries = {}
+    if footer:
+        entries = {match.group(1): match.group(0) for match in _ENTRY_RE.finditer(footer.group(2))}
+    _, _, notemarks, _ = parse_chapter(extract_main(page_html))
+    missing = [(verse, note, marker, title) for verse, note, marker, title in notemarks
+               if note not in entries and title and verse is not None]
+    if not missing:
+        return page_html
+    for verse, note, marker, title in missing:
+        entries[note] = (f'<p class="f" id="{note}"><span class="notemark">{html.escape(marker)}</span> '
+                         f'<a class="notebackref" href="#v{verse}">{chapter}:{verse}</a> '
+                         f'{html.escape(title, quote=False)}</p>')
+    order = [note for _, note, _, _ in notemarks if note in entries]
+    order += [note for note in entries if note not in order]
+    body = '\n' + ''.join(f'    {entries[note]}\n' for note in order) + '  '
+    if footer:
+        return page_html[:footer.start(2)] + body + page_html[footer.end(2):]
+    end = page_html.find('</main>')
+    if end < 0:
+        return page_html
+    # Where add_navigation's template puts the footer
+    end += len('</main>\n\n')
+    return page_html[:end] + f'<footer class="footnote">{body}</footer>' + page_html[end:]
+
+
+def link_footnotes(page_html, table=None):
+    """Link the references in a page's footnote footer; text already in a link is left alone."""
+    footer = _FOOTER_RE.search(page_html)
+    if not footer:
+        return page_html
+    parts = _SPLIT_TAGS_RE.split(footer.group(2))
+    depth = 0
+    for i, part in enumerate(parts):
+        if i % 2:
+            if _OPEN_A_RE.match(part):
+                depth += 1
+            elif _CLOSE_A_RE.match(part):
+                depth = max(depth - 1, 0)
+        elif part and not depth:
+            parts[i] = link_text(part, table)
+    return (page_html[:footer.start(2)] + ''.join(parts) + page_html[footer.end(2):])
+
+
+def crossrefs_stage(doc, options, stats):
+    """Pipeline stage: link the references in the footnotes, title-only notes included."""
+    table = options.get('table')
+    parsed = split_chapter_stem(os.path.splitext(doc.name)[0], table)
+    content = doc.content
+    if parsed:
+        content = add_missing_footnotes(content, parsed[2])
+    doc.content = link_footnotes(content, table)
+
+
+def format_verse(verse_ref):
+    return format_reference(*verse_ref)
+
+
+def main(argv=None):
+    books_dir = os.path.dirname(os.path.abspath(__file__))
+    default_graph = os.path.join(books_dir, GRAPH_NAME)
+
+    parser = argparse.ArgumentParser(description='Cross-reference graph from the footnotes')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help='extract the references and write the graph')
+    build.add_argument('--out', default=default_graph, help='graph file to write')
+    build.add_argument('-j', '--jobs', type=int, default=1,
+                       help='number of worker processes parsing pages (0 = one per CPU)')
+    for name, help_text in (('cites', 'verses a passage refers to'),
+                            ('cited-by', 'verses that refer to a passage')):
+        query = sub.add_parser(name, help=help_text)
+        query.add_argument('--graph', default=default_graph, help='graph file to read')
+        query.add_argument('reference', nargs='+', help="e.g. 'Psalm 22:1'")
+    top = sub.add_parser('top', help='the most cited verses')
+    top.add_argument('--graph', default=default_graph, help='graph file to read')
+    top.add_argument('count', nargs='?', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        notes, references, edges = build_graph(books_dir, args.out, args.jobs or os.cpu_count() or 1)
+        elapsed = time.perf_counter() - start
+        print(f"{references:,} references in {notes:,} annotated verses -> {edges:,} verse edges "
+              f"in {elapsed:.2f}s")
+        print(f"Wrote {args.out} ({os.path.getsize(args.out):,} bytes)")
+        return
+
+    graph = CrossReferenceGraph(args.graph)
+    if args.command == 'top':
+        counts = sorted(range(graph.slot_count), key=lambda slot: -graph.cited_count(slot))
+        for slot in counts[:args.count]:
+            print(f"{graph.cited_count(slot):5d}  {format_verse(graph.ref(slot))}")
+        return
+
+    reference = ' '.join(args.reference)
+    try:
+        ranges = parse_reference(reference)
+    except ValueError as e:
+        parser.error(str(e))
+    start = time.perf_counter()
+    result = graph.lookup(reference, reverse=args.command == 'cited-by')
+    elapsed = time.perf_counter() - start
+    verb = 'cited by' if args.command == 'cited-by' else 'cites'
+    for verse_ref, edges in result:
+        if edges:
+            print(f"{format_verse(verse_ref)} {verb}: " + '; '.join(format_verse(e) for e in edges))
+    print(f"({sum(len(edges) for _, edges in result)} edges for "
+          f"{'; '.join(format_range(r) for r in ranges)} in {elapsed * 1e6:.0f} us)")
+
+
+if __name__ == '__main__':
+    main()
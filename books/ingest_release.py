@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Bring a new upstream release into books/, touching only what changed.
+- Reads a directory of upstream pages (ABB01.htm, as eBible ships them),
+  names them through the edition's book table (BOOK_MAPPING) and runs
+  them through the pipeline stages in memory
+- Each new chapter is compared with the page already in books/ verse by
+  verse, by a hash of each verse's text; headings, footnotes and words
+  of Jesus are compared as one more hash per chapter. Markup and
+  whitespace do not count, so a page built by older code, or minified,
+  compares equal when its text is the same
+- Reports the books, chapters and verses that were changed, added or
+  removed, then writes only the pages of those chapters (and the chapter
+  lists that differ), leaving every other file and its mtime alone;
+  --json saves the report with the list of written pages
+- Published pages are found whatever their case and extension
+  (JOB01.html for Job01.htm) or under a legacy name (Psalm_151201.html),
+  and a page is written back under the name it was published with, its
+  links spelled .html when the published pages use .html
+- Chapters missing from the release are reported but not deleted, so a
+  release can also be a partial drop of just the changed files
+- --dry-run reports without writing
+
+Usage:
+  python ingest_release.py RELEASE_DIR [--books-dir DIR] [--stages links,clean,navigation] [-j N] [--dry-run] [--json PATH]
+"""
+
+import os
+import re
+import glob
+import json
+import hashlib
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from book_tables import load_book_table
+from corpus import LEGACY_FILENAMES, extract_main
+from modernize_bible import get_book_abbrev
+from pipeline import BOOKS_DIR, STAGES, check_stages, process_document, upstream_sources
+from sqlite_export import parse_chapter, parse_footnotes
+
+DEFAULT_STAGES = ['links', 'clean', 'navigation']
+HASH_BYTES = 8
+
+# A link to a page in the same site: no scheme, ends in .htm
+_HTM_LINK_RE = re.compile(r'(\bhref="(?![a-z]+:)[^"#]*\.htm)(?=[#"])')
+
+# status is 'same', 'changed', 'new' or 'list' (a chapter list page that
+# differs); content is only kept for pages that will be written
+Change = namedtuple('Change', 'name target book chapter status changed added removed notes content')
+
+
+def digest(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=HASH_BYTES).hexdigest()
+
+
+def chapter_fingerprint(page_html):
+    """Return ({verse: hash of its text}, hash of the headings, footnotes and wj spans)."""
+    verses, headings, _, wj = parse_chapter(extract_main(page_html))
+    notes = sorted(parse_footnotes(page_html).values())
+    return {verse: digest(text) for verse, text in verses}, digest(repr((headings, notes, wj)))
+
+
+def diff_verses(old, new):
+    """Return (changed, added, removed) verse numbers between two {verse: hash}."""
+    changed = sorted(verse for verse in old.keys() & new.keys() if old[verse] != new[verse])
+    return changed, sorted(new.keys() - old.keys()), sorted(old.keys() - new.keys())
+
+
+def published_pages(books_dir):
+    """Return {lowercase stem: path} of the pages in books_dir.
+
+    A .html page wins over a .htm one, as in corpus.find_chapter_files,
+    and a page under a legacy name stands in for its current name.
+    """
+    pages = {}
+    for ext in ('.htm', '.html'):
+        for path in glob.glob(os.path.join(books_dir, '*' + ext)):
+            pages[os.path.basename(path)[:-len(ext)].lower()] = path
+    for old, new in LEGACY_FILENAMES.items():
+        if old.lower() in pages:
+            pages.setdefault(new.lower(), pages[old.lower()])
+    return pages
+
+
+def existing_page(pages, name):
+    """Return the path of the published page for output name, or None."""
+    return pages.get(os.path.splitext(name)[0].lower())
+
+
+def published_extension(pages):
+    """The extension most published pages use."""
+    exts = [os.path.splitext(path)[1] for path in pages.values()]
+    return max(('.htm', '.html'), key=exts.count)
+
+
+def spell_links(content, ext):
+    """Spell the page links of built content as the published pages do."""
+    return _HTM_LINK_RE.sub(r'\1l', content) if ext == '.html' else content
+
+
+def compare_page(task):
+    """Build one upstream page and compare it with the published one; return a Change.
+
+    target is the published page, or where a new one goes.
+    """
+    path, name, target, stages, options = task
+    table = options['table']
+    abbrev, chapter = get_book_abbrev(os.path.basename(path), table)
+    book = table.display_name(table.mapping[abbrev])
+    chapter = int(chapter) if chapter else None
+    doc = process_document(path, name, stages, options)
+    if doc.skip:
+        return Change(name, target, book, chapter, 'same', [], [], [], False, None)
+    content = spell_links(doc.content, os.path.splitext(target)[1])
+    if not os.path.exists(target):
+        new, _ = chapter_fingerprint(content) if chapter else ({}, None)
+        return Change(name, target, book, chapter, 'new', [], sorted(new), [], False, content)
+
+    with open(target, 'r', encoding='utf-8') as f:
+        published = f.read()
+    if not chapter:
+        status = 'same' if published == content else 'list'
+        return Change(name, target, book, None, status, [], [], [], False,
+                      content if status != 'same' else None)
+
+    old_verses, old_notes = chapter_fingerprint(published)
+    new_verses, new_notes = chapter_fingerprint(content)
+    changed, added, removed = diff_verses(old_verses, new_verses)
+    notes = old_notes != new_notes
+    status = 'changed' if changed or added or removed or notes else 'same'
+    return Change(name, target, book, chapter, status, changed, added, removed, notes,
+                  content if status != 'same' else None)
+
+
+def compare_release(release_dir, books_dir, stages=DEFAULT_STAGES, jobs=1):
+    """Return ([Change] for every page of the release, [(book, chapter)] missing from it).
+
+    Raises ValueError when books_dir has no chapter pages to take the book table from.
+    """
+    table = load_book_table(books_dir)
+    options = {'books_dir': books_dir, 'label': None, 'table': table, 'shared_nav': False}
+    pages = published_pages(books_dir)
+    ext = published_extension(pages)
+    sources = upstream_sources(release_dir, table)
+    tasks = [(path, name, existing_page(pages, name)
+              or os.path.join(books_dir, os.path.splitext(name)[0] + ext), stages, options)
+             for path, name in sources]
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            changes = list(pool.map(compare_page, tasks, chunksize=16))
+    else:
+        changes = [compare_page(task) for task in tasks]
+
+    released = {(change.book, change.chapter) for change in changes}
+    missing = []
+    for prefix, name, chapters, _ in table.books:
+        if (name, None) not in released and not any((name, c) in released for c in range(1, chapters + 1)):
+            continue   # The release does not carry this book at all
+        for chapter in range(1, chapters + 1):
+            if (name, chapter) not in released and existing_page(pages, table.chapter_filename(prefix, chapter)):
+                missing.append((name, chapter))
+    return changes, missing
+
+
+def verse_list(verses):
+    """Format verse numbers with runs collapsed: [1, 2, 3, 7] -> '1-3, 7'."""
+    runs = []
+    for verse in verses:
+        if runs and verse == runs[-1][1] + 1:
+            runs[-1][1] = verse
+        else:
+            runs.append([verse, verse])
+    return ', '.join(f'{a}-{b}' if a != b else f'{a}' for a, b in runs)
+
+
+def describe(change):
+    """One report line for a changed page."""
+    where = f'{change.book} {change.chapter}' if change.chapter else f'{change.book} (chapter list)'
+    if change.status == 'new':
+        return f'{where}: new chapter, {len(change.added)} verses'
+    if change.status == 'list':
+        return f'{where}: changed'
+    details = []
+    for label, verses in (('changed', change.changed), ('added', change.added), ('removed', change.removed)):
+        if verses:
+            details.append(f"{label} {'verse' if len(verses) == 1 else 'verses'} {verse_list(verses)}")
+    if change.notes:
+        details.append('headings or footnotes changed')
+    return f"{where}: {'; '.join(details)}"
+
+
+def print_report(changes, missing):
+    touched = [change for change in changes if change.status != 'same']
+    for change in touched:
+        print(f'  {describe(change)}')
+    for book, chapter in missing:
+        print(f'  {book} {chapter}: not in the release (left in place)')
+    books = {change.book for change in touched}
+    counts = [sum(len(getattr(change, field)) for change in touched)
+              for field in ('changed', 'added', 'removed')]
+    print(f"{len(changes)} pages compared; {len(touched)} pages in {len(books)} "
+          f"{'book' if len(books) == 1 else 'books'} differ: {counts[0]} verses changed, "
+          f"{counts[1]} added, {counts[2]} removed")
+
+
+def publish(changes):
+    """Write the pages that differ; return their paths."""
+    written = []
+    for change in changes:
+        if change.content is None:
+            continue
+        tmp_path = change.target + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(change.content)
+        os.replace(tmp_path, change.target)
+        written.append(change.target)
+    return written
+
+
+def write_json(path, release_dir, changes, missing, written):
+    report = {
+        'release': os.path.abspath(release_dir),
+        'compared': len(changes),
+        'pages': [{'page': os.path.basename(change.target), 'book': change.book,
+                   'chapter': change.chapter, 'status': change.status,
+                   'changed': change.changed, 'added': change.added, 'removed': change.removed,
+                   'notes': change.notes}
+                  for change in changes if change.status != 'same'],
+        'missing': [{'book': book, 'chapter': chapter} for book, chapter in missing],
+        'written': [os.path.basename(path) for path in written],
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Diff a new upstream release against books/ '
+                                                 'and write only the changed chapters')
+    parser.add_argument('release_dir', help='directory of upstream pages (ABB01.htm)')
+    parser.add_argument('--books-dir', default=BOOKS_DIR, help='published books/ directory')
+    parser.add_argument('--stages', default=','.join(DEFAULT_STAGES),
+                        help=f"comma-separated pipeline stages, starting with the upstream ones "
+                             f"(default: {','.join(DEFAULT_STAGES)})")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes (0 = one per CPU)')
+    parser.add_argument('--dry-run', action='store_true', help='report the changes without writing')
+    parser.add_argument('--json', help='also write the report to this JSON file')
+    args = parser.parse_args(argv)
+
+    stages = [name.strip() for name in args.stages.split(',') if name.strip()]
+    try:
+        check_stages(stages)
+        if not stages or not STAGES[stages[0]].upstream:
+            raise ValueError('the stages must start with links or clean, which read upstream pages')
+        # The book table the stages render with comes from the published pages
+        load_book_table(args.books_dir)
+    except ValueError as e:
+        parser.error(str(e))
+    jobs = args.jobs or os.cpu_count() or 1
+
+    changes, missing = compare_release(args.release_dir, args.books_dir, stages, jobs)
+    print(f"Release {args.release_dir} against {args.books_dir}:")
+    print_report(changes, missing)
+
+    written = [] if args.dry_run else publish(changes)
+    if written:
+        print(f"Wrote {len(written)} pages: {', '.join(os.path.basename(path) for path in written)}")
+    elif not args.dry_run:
+        print('Nothing to write')
+    if args.json:
+        write_json(args.json, args.release_dir, changes, missing, written)
+        print(f"Report saved to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Strip insignificant whitespace from the generated pages.
+- HtmlMinifier is fed the page in chunks and returns output as it goes,
+  so a file is never held in memory as a whole
+- Whitespace between two block-level tags (the indentation of the
+  sidebar, nav and footer blocks) is dropped; any other whitespace run
+  at the edge of text becomes a single space or newline, which renders
+  the same
+- Text is otherwise left as it is, so the whitespace inside verse text
+  is preserved; tags, with their attributes (the title of a notemark),
+  are copied unchanged, and so are <pre>, <textarea>, <script> and
+  <style> contents
+- Registered as the 'minify' stage of pipeline.py; run on its own it
+  rewrites the given pages in place and reports the bytes saved
+
+Usage:
+  python minify_html.py [FILES ...]   (default: the chapter pages in books/)
+"""
+
+import os
+import re
+import sys
+import glob
+import argparse
+
+BOOKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CHUNK_SIZE = 64 * 1024
+
+# Tags that start or end a block, so whitespace next to them never renders
+BLOCK_TAGS = frozenset('''!doctype html head body title meta link base script style noscript template
+    div p main nav aside header footer section article details summary dialog figure figcaption
+    h1 h2 h3 h4 h5 h6 ul ol li dl dt dd table thead tbody tfoot tr td th caption colgroup col
+    form fieldset legend select option optgroup hr br blockquote address'''.split())
+
+# Elements whose content is copied unchanged
+RAW_TAGS = frozenset('pre textarea script style'.split())
+
+# A complete tag or comment; quoted attribute values may contain '>'
+_TAG_RE = re.compile(r'''<(?:!--.*?-->|(/?)(!?[A-Za-z][\w:-]*)[^>"']*(?:(?:"[^"]*"|'[^']*')[^>"']*)*>)''',
+                     re.DOTALL)
+# What a tag may start with; a '<' followed by anything else is text
+_TAG_START_RE = re.compile(r'<(?:!|/?[A-Za-z]|/?\Z)')
+_LEADING_WS_RE = re.compile(r'^[ \t\n\r\f]+')
+_TRAILING_WS_RE = re.compile(r'[ \t\n\r\f]+$')
+_WS_ONLY_RE = re.compile(r'[ \t\n\r\f]*$')
+
+
+def collapse(whitespace):
+    return '\n' if '\n' in whitespace else ' '
+
+
+class HtmlMinifier:
+    """Streaming whitespace minifier: feed() chunks, then close()."""
+
+    def __init__(self):
+        self._buffer = ''
+        self._raw_end = None     # regex for the end of a raw element we are in
+        self._after_block = True  # the last tag was block-level (or we are at the start)
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def feed(self, data):
+        self.bytes_in += len(data.encode('utf-8'))
+        self._buffer += data
+        return self._emit(self._drain(final=False))
+
+    def close(self):
+        return self._emit(self._drain(final=True))
+
+    def _emit(self, out):
+        self.bytes_out += len(out.encode('utf-8'))
+        return out
+
+    def _text(self, text, next_block):
+        """Minify the text between two tags; next_block tells about the tag that follows."""
+        if not text:
+            return ''
+        if _WS_ONLY_RE.match(text):
+            if self._after_block and next_block:
+                return ''
+            return collapse(text)
+        match = _LEADING_WS_RE.match(text)
+        if match:
+            text = ('' if self._after_block else collapse(match.group(0))) + text[match.end():]
+        match = _TRAILING_WS_RE.search(text)
+        if match:
+            text = text[:match.start()] + ('' if next_block else collapse(match.group(0)))
+        return text
+
+    def _drain(self, final):
+        buf = self._buffer
+        out = []
+        pos = 0
+        while True:
+            if self._raw_end is not None:
+                match = self._raw_end.search(buf, pos)
+                if match is None:
+                    if final:
+                        out.append(buf[pos:])
+                        pos = len(buf)
+                    else:
+                        # Keep enough to see an end tag split across chunks
+                        keep = max(pos, len(buf) - 16)
+                        out.append(buf[pos:keep])
+                        pos = keep
+                    break
+                out.append(buf[pos:match.start()])
+                pos = match.start()
+                self._raw_end = None
+                continue
+
+            # Find the next tag, skipping a '<' that cannot start one
+            search = pos
+            while True:
+                lt = buf.find('<', search)
+                if lt < 0 or _TAG_START_RE.match(buf, lt):
+                    break
+                search = lt + 1
+            if lt < 0:
+                if final:
+                    out.append(self._text(buf[pos:], True))
+                    pos = len(buf)
+                break
+            match = _TAG_RE.match(buf, lt)
+            if match is None:
+                if final:
+                    # An unterminated tag: leave the rest alone
+                    out.append(self._text(buf[pos:lt], False) + buf[lt:])
+                    pos = len(buf)
+                break
+
+            name = (match.group(2) or '').lower()
+            is_block = name in BLOCK_TAGS
+            out.append(self._text(buf[pos:lt], is_block))
+            out.append(match.group(0))
+            pos = match.end()
+            if name:
+                self._after_block = is_block
+            if name in RAW_TAGS and not match.group(1):
+                self._raw_end = re.compile(rf'</{name}\s*>', re.IGNORECASE)
+
+        self._buffer = buf[pos:]
+        return ''.join(out)
+
+
+def minify_html(content):
+    """Minify a whole page held in memory."""
+    minifier = HtmlMinifier()
+    return minifier.feed(content) + minifier.close()
+
+
+def minify_file(path, chunk_size=CHUNK_SIZE):
+    """Minify a page in place, streaming it through a temporary file.
+
+    Returns (bytes before, bytes after); the file is left alone when
+    nothing changes.
+    """
+    minifier = HtmlMinifier()
+    tmp_path = path + '.tmp'
+    with open(path, 'r', encoding='utf-8') as src, open(tmp_path, 'w', encoding='utf-8') as dst:
+        while True:
+            chunk = src.read(chunk_size)
+            if not chunk:
+                break
+            dst.write(minifier.feed(chunk))
+        dst.write(minifier.close())
+    if minifier.bytes_out < minifier.bytes_in:
+        os.replace(tmp_path, path)
+    else:
+        os.remove(tmp_path)
+    return minifier.bytes_in, minifier.bytes_out
+
+
+def minify_stage(doc, options, stats):
+    """Pipeline stage: minify the page and note the bytes saved."""
+    before = len(doc.content.encode('utf-8'))
+    doc.content = minify_html(doc.content)
+    doc.saved = before - len(doc.content.encode('utf-8'))
+
+
+def print_savings(saved, bytes_after, top=10):
+    """Report {file: bytes saved} in total and for the files that saved most."""
+    total = sum(saved.values())
+    before = bytes_after + total
+    percent = 100 * total / before if before else 0
+    print(f"Minified {len(saved)} files: saved {total:,} of {before:,} bytes ({percent:.1f}%)")
+    largest = sorted((item for item in saved.items() if item[1]), key=lambda item: -item[1])[:top]
+    if largest and top:
+        print("  Largest savings:")
+        for name, count in largest:
+            print(f"    {name:28s} {count:>9,} bytes")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Minify the generated pages in place')
+    parser.add_argument('files', nargs='*', help='pages to minify (default: the chapter pages in books/)')
+    parser.add_argument('--quiet', action='store_true', help='only print the totals')
+    args = parser.parse_args(argv)
+    files = args.files or sorted(glob.glob(os.path.join(BOOKS_DIR, '*[0-9].htm')))
+
+    saved = {}
+    bytes_after = 0
+    for path in files:
+        before, after = minify_file(path)
+        name = os.path.basename(path)
+        saved[name] = before - after
+        bytes_after += after
+        if not args.quiet:
+            print(f"  {name}: {before:,} -> {after:,} bytes (-{before - after:,})")
+    print_savings(saved, bytes_after, 0 if args.quiet else 10)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
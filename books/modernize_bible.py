@@ -4,12 +4,15 @@ Modernize World English Bible HTML files:
 1. Rename files to full book names
 2. Update internal links
 3. Clean up HTML structure
+4. Leave redirect pages under the names older builds gave Psalm 151
 """
 
 import os
 import re
-import glob
-import shutil
+import argparse
+
+from build_manifest import write_if_changed
+from build_stats import NULL_STATS, add_arguments, run_with_stats
 
 # Mapping of old abbreviations to new full names
 BOOK_MAPPING = {
@@ -94,29 +97,74 @@ BOOK_MAPPING = {
     '4MA': '4_Maccabees',
     '1ES': '1_Esdras',
     '2ES': '2_Esdras',
-    'PS': 'Psalm_151',
+    'PS2': 'Psalm_151',
     # Supplementary
     'FRT': 'Front_Matter',
     'GLO': 'Glossary',
 }
 
-def update_links_in_content(content):
+# Psalm 151 pages as builds before BOOK_MAPPING knew 'PS2' named them
+# (PS201.htm was split as PS + 201); links and bookmarks to those URLs
+# land on a redirect page written next to the new one
+LEGACY_FILENAMES = {
+    'Psalm_151201.htm': 'Psalm_15101.htm',
+    'Psalm_151200.htm': 'Psalm_15100.htm',
+    'Psalm_1512.htm': 'Psalm_151.htm',
+}
+LEGACY_REDIRECTS = {new: old for old, new in LEGACY_FILENAMES.items()}
+
+def abbrev_alternation(abbrevs):
+    """Regex alternation of the abbreviations, longest first.
+
+    An abbreviation may end in a digit (PS2, Psalm 151): trying the
+    longest first splits PS201.htm into PS2 and chapter 01.
+    """
+    for abbrev in abbrevs:
+        if not re.fullmatch(r'\w+', abbrev):
+            raise ValueError(f"Invalid book abbreviation: {abbrev!r}")
+    return '|'.join(re.escape(abbrev) for abbrev in sorted(abbrevs, key=len, reverse=True))
+
+
+def make_link_rewriter(mapping):
+    """Compile a function that rewrites abbreviated chapter links in one pass.
+
+    Every ``href='ABB.htm'`` / ``href='ABB01.htm'`` in the content is matched
+    by a single regex scan and the abbreviation is looked up in ``mapping``,
+    so the cost barely depends on how many abbreviations there are.
+    """
+    mapping = dict(mapping)
+    # The chapter digits are whatever follows a known abbreviation
+    pattern = re.compile(rf"(href=['\"])({abbrev_alternation(mapping)})(\d*\.htm['\"])")
+
+    def replace(match):
+        new_name = mapping.get(match.group(2))
+        if new_name is None:
+            return match.group(0)
+        return match.group(1) + new_name + match.group(3)
+
+    def rewrite(content):
+        return pattern.sub(replace, content)
+
+    return rewrite
+
+
+_rewrite_links = make_link_rewriter(BOOK_MAPPING)
+
+
+def update_links_in_content(content, table=None):
     """Update all internal links in HTML content."""
-    for old_abbrev, new_name in BOOK_MAPPING.items():
-        # Match href='ABB.htm' or href='ABB01.htm' patterns
-        pattern = rf"(href=['\"]){old_abbrev}(\d*\.htm['\"])"
-        replacement = rf"\g<1>{new_name}\2"
-        content = re.sub(pattern, replacement, content)
-    return content
+    if table is not None:
+        return table.rewrite_links(content)
+    return _rewrite_links(content)
 
 
-def clean_html_content(content, book_name, chapter_num, is_chapter_list):
+def clean_html_content(content, book_name, chapter_num, is_chapter_list, stats=NULL_STATS):
     """Clean and modernize HTML content."""
 
     if is_chapter_list:
         return clean_chapter_list(content, book_name)
     else:
-        return clean_chapter_content(content, book_name, chapter_num)
+        return clean_chapter_content(content, book_name, chapter_num, stats)
 
 
 def clean_chapter_list(content, book_name):
@@ -153,8 +201,13 @@ def clean_chapter_list(content, book_name):
     return html
 
 
-def clean_chapter_content(content, book_name, chapter_num):
+def clean_chapter_content(content, book_name, chapter_num, stats=NULL_STATS):
     """Clean a chapter content page."""
+    return render_clean_page(book_name, chapter_num, *clean_chapter_parts(content, stats))
+
+
+def clean_chapter_parts(content, stats=NULL_STATS):
+    """Return (nav_html, main_html, footnotes_html) cleaned from an upstream page."""
 
     # Extract navigation links
     nav_match = re.search(r"<ul class=['\"]tnav['\"]>(.*?)</ul>", content, re.DOTALL)
@@ -174,46 +227,21 @@ def clean_chapter_content(content, book_name, chapter_num):
                           content, re.DOTALL)
     main_content = main_match.group(1) if main_match else ''
 
-    # Process title elements
-    titles = []
-    for match in re.finditer(r"<div class=['\"]mt(\d?)['\"]>([^<]*)</div>", main_content):
-        cls = 'mt' + match.group(1) if match.group(1) else 'mt'
-        text = match.group(2).strip()
-        if text:
-            titles.append(f'    <div class="{cls}">{text}</div>')
-
-    # Process chapter label
-    chapter_label = ''
-    ch_match = re.search(r"<div class=['\"]chapterlabel['\"][^>]*>([^<]*)</div>", main_content)
-    if ch_match:
-        chapter_label = f'    <h2 class="chapterlabel">{ch_match.group(1).strip()}</h2>'
-
-    # Process section markers (ms)
-    sections = []
-    for match in re.finditer(r"<div class=['\"]ms['\"]>([^<]*)</div>", main_content):
-        text = match.group(1).strip()
-        if text:
-            sections.append(f'    <div class="ms">{text}</div>')
-
-    # Process paragraphs and poetry
-    paragraphs = []
-    for match in re.finditer(r"<div class=['\"]([pqbm][\d]?)['\"]>(.*?)</div>", main_content, re.DOTALL):
-        cls = match.group(1)
-        para_content = clean_paragraph(match.group(2))
-        if para_content.strip():
-            paragraphs.append(f'    <p class="{cls}">{para_content}</p>')
-
-    # Build main content
-    main_parts = titles + ([chapter_label] if chapter_label else []) + sections + paragraphs
-    main_html = '\n'.join(main_parts)
+    # Titles, chapter label, section headings and paragraphs in source order
+    main_html = '\n'.join(parse_main_content(main_content))
 
     # Extract and clean footnotes
     footnotes_html = ''
-    fn_match = re.search(r"<div class=['\"]footnote['\"]>(.*?)</div>", content, re.DOTALL)
-    if fn_match:
-        footnotes_html = clean_footnotes(fn_match.group(1))
+    with stats.stage('footnotes'):
+        fn_match = re.search(r"<div class=['\"]footnote['\"]>(.*?)</div>", content, re.DOTALL)
+        if fn_match:
+            footnotes_html = clean_footnotes(fn_match.group(1))
+
+    return nav_html, main_html, footnotes_html
 
-    # Build final HTML
+
+def render_clean_page(book_name, chapter_num, nav_html, main_html, footnotes_html):
+    """Assemble a modernized chapter page from its cleaned parts."""
     html = f'''<!DOCTYPE html>
 <html lang="en">
 <head>
@@ -240,29 +268,176 @@ def clean_chapter_content(content, book_name, chapter_num):
     return html
 
 
-def clean_paragraph(content):
-    """Clean paragraph content."""
-    # Standardize quotes
-    content = re.sub(r"(\w+)='([^']*)'", r'\1="\2"', content)
-
-    # Clean verse spans
-    content = re.sub(
-        r'<span class="verse" id="V(\d+)">(\d+)&#160;</span>',
-        r'<span class="verse" id="v\1">\2</span> ',
-        content
-    )
-
-    # Move popup content to title attribute for cleaner HTML
-    content = re.sub(
-        r'<a href="#(FN\d+)" class="notemark">([^<]*)<span class="popup">([^<]*)</span></a>',
-        r'<a href="#\1" class="notemark" title="\3">\2</a>',
-        content
-    )
+# One token per tag or text run: (slash, tag name, attributes) or plain text
+_TOKEN_RE = re.compile(r"<(/?)([A-Za-z][A-Za-z0-9]*)([^>]*)>|[^<]+|<")
+_ATTR_RE = re.compile(r"""([\w-]+)=(?:'([^']*)'|"([^"]*)")""")
+_QUOTE_RE = re.compile(r"(\w+)='([^']*)'")
+_VERSE_ID_RE = re.compile(r'V(\d+)')
+_VERSE_NUM_RE = re.compile(r'(\d+)&#160;')
+_HEADING_CLASS_RE = re.compile(r'mt\d?|ms')
+_PARAGRAPH_CLASS_RE = re.compile(r'[pqbm]\d?')
+
+
+def iter_html_events(content):
+    """Tokenize HTML into a stream of (kind, tag, attrs, raw) events.
+
+    kind is 'start', 'end' or 'text'. Tags are lower-cased; attrs is the
+    raw attribute string of a start tag. Text is passed through untouched,
+    so entities such as &#160; survive.
+    """
+    for match in _TOKEN_RE.finditer(content):
+        tag = match.group(2)
+        if tag is None:
+            yield 'text', None, None, match.group(0)
+        elif match.group(1):
+            yield 'end', tag.lower(), None, match.group(0)
+        else:
+            yield 'start', tag.lower(), match.group(3), match.group(0)
+
+
+def get_attr(attrs, name):
+    """Return the value of attribute name from a raw attribute string."""
+    for match in _ATTR_RE.finditer(attrs or ''):
+        if match.group(1) == name:
+            value = match.group(2)
+            return value if value is not None else match.group(3)
+    return None
+
+
+def parse_main_content(main_content):
+    """Walk the legacy main content once and return cleaned lines in source order."""
+    lines = []
+    have_label = False
+    events = iter_html_events(main_content)
+    for kind, tag, attrs, raw in events:
+        if kind != 'start' or tag != 'div':
+            continue
+        cls = get_attr(attrs, 'class')
+        if cls is None:
+            continue
+
+        if _PARAGRAPH_CLASS_RE.fullmatch(cls):
+            para_content = clean_paragraph_events(events)
+            if para_content:
+                lines.append(f'    <p class="{cls}">{para_content}</p>')
+        elif _HEADING_CLASS_RE.fullmatch(cls):
+            text = read_plain_text(events)
+            if text:
+                lines.append(f'    <div class="{cls}">{text}</div>')
+        elif cls == 'chapterlabel':
+            text = read_plain_text(events)
+            if text is not None and not have_label:
+                lines.append(f'    <h2 class="chapterlabel">{text}</h2>')
+                have_label = True
+    return lines
+
+
+def read_plain_text(events):
+    """Consume events up to the closing </div> and return the stripped text.
+
+    Returns None if the element contains markup, which the legacy headings
+    never do.
+    """
+    parts = []
+    plain = True
+    for kind, tag, attrs, raw in events:
+        if kind == 'end' and tag == 'div':
+            break
+        if kind == 'text':
+            parts.append(raw)
+        else:
+            plain = False
+    return ''.join(parts).strip() if plain else None
+
+
+def clean_paragraph_events(events):
+    """Consume events up to the closing </div> and return the cleaned paragraph.
+
+    Verse spans and footnote marks are rewritten as they stream past:
+    - <span class="verse" id="V1">1&#160;</span> becomes
+      <span class="verse" id="v1">1</span> followed by a space
+    - <a class="notemark">*<span class="popup">text</span></a> becomes
+      <a class="notemark" title="text">*</a>
+    Anything that does not have the expected shape is passed through.
+    """
+    out = []
+    held = []       # raw tokens of a verse span or notemark being matched
+    state = None    # None, 'verse', 'mark', 'popup' or 'popup_done'
+    verse_id = fn_href = None
+    mark = popup = ''
+
+    for kind, tag, attrs, raw in events:
+        if kind == 'start':
+            raw = _QUOTE_RE.sub(r'\1="\2"', raw)
+
+        if state is not None:
+            held.append(raw)
+            if state == 'verse':
+                if kind == 'text' and len(held) == 2:
+                    continue
+                if kind == 'end' and tag == 'span' and len(held) == 3:
+                    number = _VERSE_NUM_RE.fullmatch(held[1])
+                    if number:
+                        out.append(f'<span class="verse" id="v{verse_id}">{number.group(1)}</span> ')
+                        state = None
+                        held = []
+                        continue
+            elif state == 'mark':
+                if kind == 'text' and len(held) == 2:
+                    mark = raw
+                    continue
+                if kind == 'start' and tag == 'span' and get_attr(attrs, 'class') == 'popup':
+                    state = 'popup'
+                    continue
+            elif state == 'popup':
+                if kind == 'text' and not popup:
+                    popup = raw
+                    continue
+                if kind == 'end' and tag == 'span':
+                    state = 'popup_done'
+                    continue
+            elif state == 'popup_done':
+                if kind == 'end' and tag == 'a':
+                    out.append(f'<a href="{fn_href}" class="notemark" title="{popup}">{mark}</a>')
+                    state = None
+                    held = []
+                    continue
+
+            # Not the expected shape: emit what was held back unchanged
+            held.pop()
+            out.extend(held)
+            held = []
+            state = None
+
+        if kind == 'end' and tag == 'div':
+            break
+
+        if kind == 'start' and tag == 'span' and get_attr(attrs, 'class') == 'verse':
+            match = _VERSE_ID_RE.fullmatch(get_attr(attrs, 'id') or '')
+            if match:
+                verse_id = match.group(1)
+                state = 'verse'
+                held = [raw]
+                continue
+        elif kind == 'start' and tag == 'a' and get_attr(attrs, 'class') == 'notemark':
+            fn_href = get_attr(attrs, 'href') or ''
+            if re.fullmatch(r'#FN\d+', fn_href):
+                state = 'mark'
+                held = [raw]
+                mark = popup = ''
+                continue
+
+        out.append(raw)
+
+    out.extend(held)
 
     # Clean whitespace
-    content = re.sub(r'\s+', ' ', content).strip()
+    return ' '.join(''.join(out).split())
 
-    return content
+
+def clean_paragraph(content):
+    """Clean paragraph content."""
+    return clean_paragraph_events(iter_html_events(content))
 
 
 def clean_footnotes(content):
@@ -283,15 +458,41 @@ def clean_footnotes(content):
     return '  <footer class="footnote">\n' + '\n'.join(footnotes) + '\n  </footer>\n'
 
 
-def get_book_abbrev(filename):
-    """Extract book abbreviation from filename."""
-    match = re.match(r'^([A-Z0-9]+?)(\d*)\.htm$', filename, re.IGNORECASE)
-    if match:
-        return match.group(1).upper(), match.group(2)
-    return None, None
+def make_name_splitter(abbrevs):
+    """Compile a function splitting 'ABB01.htm' into ('ABB', '01'), or (None, None)."""
+    pattern = re.compile(rf'^({abbrev_alternation(abbrevs)})(\d*)\.htm$', re.IGNORECASE)
 
+    def split(filename):
+        match = pattern.match(filename)
+        if match:
+            return match.group(1).upper(), match.group(2)
+        return None, None
 
-def process_file(filepath):
+    return split
+
+
+_split_name = make_name_splitter(BOOK_MAPPING)
+
+
+def get_book_abbrev(filename, table=None):
+    """Extract book abbreviation and chapter digits from an upstream filename."""
+    if table is not None:
+        return table.split_name(filename)
+    return _split_name(filename)
+
+
+def get_output_filename(basename, table=None):
+    """Return the modernized filename for an upstream file, or None."""
+    if table is not None:
+        return table.output_filename(basename)
+    abbrev, chapter = get_book_abbrev(basename)
+    if not abbrev or abbrev not in BOOK_MAPPING:
+        return None
+    new_name = BOOK_MAPPING[abbrev]
+    return f"{new_name}{chapter}.htm" if chapter else f"{new_name}.htm"
+
+
+def process_file(filepath, stats=NULL_STATS):
     """Process a single file: update links and clean HTML."""
     basename = os.path.basename(filepath)
     abbrev, chapter = get_book_abbrev(basename)
@@ -302,70 +503,100 @@ def process_file(filepath):
     new_name = BOOK_MAPPING[abbrev]
     is_chapter_list = not chapter
 
+    # Determine new filename
+    new_filename = get_output_filename(basename)
+    stats.begin_file(new_filename, filepath)
+
     # Read content
-    with open(filepath, 'r', encoding='utf-8-sig') as f:
-        content = f.read()
+    with stats.stage('read'):
+        with open(filepath, 'r', encoding='utf-8-sig') as f:
+            content = f.read()
 
     # Update links first
-    content = update_links_in_content(content)
+    with stats.stage('links'):
+        content = update_links_in_content(content)
 
     # Clean HTML
     book_display = new_name.replace('_', ' ')
-    content = clean_html_content(content, book_display, chapter, is_chapter_list)
-
-    # Determine new filename
-    new_filename = f"{new_name}{chapter}.htm" if chapter else f"{new_name}.htm"
+    with stats.stage('clean'):
+        content = clean_html_content(content, book_display, chapter, is_chapter_list, stats)
 
+    stats.end_file()
     return new_filename, content
 
 
-def main():
-    books_dir = os.path.dirname(os.path.abspath(__file__))
-
-    # Get all HTML files
-    htm_files = glob.glob(os.path.join(books_dir, '*.htm'))
-
-    # Skip utility files
-    skip_files = {'links.htm', 'webfaq.htm', 'copyright.htm', 'index.htm',
-                  'modernize_bible.py', 'cleanup_html.py', 'convert_to_json.py', 'update_links.py'}
-
-    print(f"Found {len(htm_files)} HTML files")
-
-    # Process files - collect results first
-    results = []
-    for filepath in sorted(htm_files):
-        basename = os.path.basename(filepath)
-        if basename in skip_files:
-            continue
+def render_redirect(target):
+    """A page that sends the browser on to target, keeping the #fragment."""
+    return f'''<!DOCTYPE html>
+<html lang="en">
+<head>
+  <meta charset="UTF-8">
+  <title>World English Bible</title>
+  <link rel="canonical" href="{target}">
+  <meta http-equiv="refresh" content="0; url={target}">
+  <script>location.replace('{target}' + location.hash);</script>
+</head>
+<body>
+  <p>This page has moved to <a href="{target}">{target}</a>.</p>
+</body>
+</html>
+'''
 
-        try:
-            new_filename, content = process_file(filepath)
-            if new_filename and content:
-                results.append((filepath, new_filename, content))
-        except Exception as e:
-            print(f"  Error processing {basename}: {e}")
 
-    print(f"Processing {len(results)} Bible files...")
+def write_result(books_dir, old_path, new_filename, content):
+    """Replace old_path with the rewritten file and report the rename.
 
-    # Delete old files and write new ones
-    for old_path, new_filename, content in results:
-        old_basename = os.path.basename(old_path)
-        new_path = os.path.join(books_dir, new_filename)
+    Returns True if the new file was written.
+    """
+    old_basename = os.path.basename(old_path)
+    new_path = os.path.join(books_dir, new_filename)
 
-        # Remove old file
-        if os.path.exists(old_path):
-            os.remove(old_path)
+    # Remove old file
+    if old_basename != new_filename and os.path.exists(old_path):
+        os.remove(old_path)
 
-        # Write new file
-        with open(new_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+    # Write new file, leaving it alone if the bytes did not change
+    changed = write_if_changed(new_path, content)
+    if new_filename in LEGACY_REDIRECTS:
+        write_if_changed(os.path.join(books_dir, LEGACY_REDIRECTS[new_filename]),
+                         render_redirect(new_filename))
 
-        if old_basename != new_filename:
-            print(f"  {old_basename} -> {new_filename}")
-        else:
-            print(f"  Updated: {new_filename}")
+    if old_basename != new_filename:
+        print(f"  {old_basename} -> {new_filename}")
+    elif changed:
+        print(f"  Updated: {new_filename}")
+    else:
+        print(f"  Unchanged: {new_filename}")
+    return changed
+
+
+def remove_upstream_file(old_path, new_path):
+    """Drop an upstream file whose modernized output is already current."""
+    if os.path.exists(old_path) and not os.path.samefile(old_path, new_path):
+        os.remove(old_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes (0 = one per CPU)')
+    parser.add_argument('--force', action='store_true',
+                        help='ignore the build manifest and rebuild every file')
+    parser.add_argument('--watch', action='store_true',
+                        help='after the run, keep rebuilding pages as they are edited')
+    add_arguments(parser)
+    # Imported here because the pipeline and watch mode are built on this module
+    from pipeline import build
+    from watch import add_watch_arguments, watch_from_args
+    add_watch_arguments(parser)
+    args = parser.parse_args(argv)
+    jobs = args.jobs or os.cpu_count() or 1
 
-    print(f"\nDone! Processed {len(results)} files")
+    books_dir = os.path.dirname(os.path.abspath(__file__))
+    run_with_stats(args, 'modernize_bible', books_dir,
+                   lambda stats: build(books_dir, ['links', 'clean'], jobs, args.force, stats=stats), jobs)
+    if args.watch:
+        watch_from_args(args, books_dir, ['links', 'clean'], jobs)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Flat binary files of named arrays, used by the memory-mapped corpus indexes.
+- A fixed header: magic, a few integer counts, then the offset and length
+  of every array
+- Arrays are stored little-endian, each aligned to 8 bytes
+- Reading memory-maps the file and exposes every array as a memoryview
+  cast to its typecode, so opening a file copies nothing
+"""
+
+import os
+import sys
+import mmap
+import struct
+from array import array
+
+
+def _header(count_fields, sections):
+    return struct.Struct('<8s' + 'Q' * count_fields + 'QQ' * len(sections))
+
+
+def write_packed(path, magic, counts, sections, arrays):
+    """Write arrays (by name, in sections order) to path.
+
+    sections is a list of (name, typecode); counts is a tuple of integers
+    stored in the header for the reader.
+    """
+    header = _header(len(counts), sections)
+    offset = header.size
+    layout = []
+    chunks = []
+    for name, typecode in sections:
+        data = arrays[name]
+        if not isinstance(data, array) or data.typecode != typecode:
+            data = array(typecode, data)
+        if sys.byteorder != 'little':
+            data = array(typecode, data)
+            data.byteswap()
+        raw = data.tobytes()
+        padding = -offset % 8
+        chunks.append(b'\0' * padding + raw)
+        offset += padding
+        layout.extend((offset, len(raw)))
+        offset += len(raw)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header.pack(magic, *counts, *layout))
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
+
+
+class PackedFile:
+    """A memory-mapped file written by write_packed.
+
+    counts holds the header integers; every array is available as an
+    attribute named after its section.
+    """
+
+    def __init__(self, path, magic, sections, count_fields):
+        header = _header(count_fields, sections)
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = header.unpack_from(self._mmap)
+        if fields[0] != magic:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a {magic.decode('ascii', 'replace')} file")
+        self.counts = fields[1:1 + count_fields]
+        self.sections = sections
+
+        view = memoryview(self._mmap)
+        layout = fields[1 + count_fields:]
+        for i, (name, typecode) in enumerate(sections):
+            offset, length = layout[2 * i], layout[2 * i + 1]
+            section = view[offset:offset + length]
+            if sys.byteorder != 'little':
+                section = array(typecode, section)
+                section.byteswap()
+                section = memoryview(section)
+            setattr(self, name, section.cast(typecode))
+        view.release()
+
+    def close(self):
+        """Release the arrays and the memory map."""
+        for name, _ in self.sections:
+            getattr(self, name).release()
+        self._mmap.close()
@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+"""
+Single-pass build of the chapter pages.
+- Reads each source page once, passes it through a list of stages as a
+  Document and writes the result once
+- Stages: links (update_links_in_content), clean (modernize_bible's
+  cleaner), navigation (add_navigation's page template), crossrefs
+  (links the references in footnotes, cross_references.py) and minify
+  (minify_html.py); the last two are not run by default, and more are
+  added with register_stage()
+- modernize_bible.py runs links,clean and add_navigation.py runs
+  navigation; by default this script runs all three, so upstream pages
+  are read and written once instead of twice
+- Book tables come from each edition's meta XML and chapter files
+  (book_tables.py); several translation directories can be built in one
+  run, their pages sharing one worker pool
+- Uses the build manifest, a bounded worker pool (-j) and --stats;
+  --search-index writes the browser search index (search_shards.py),
+  --service-worker the offline service worker (service_worker.py),
+  --check-links runs validate_links.py on the result, and --watch then
+  keeps rebuilding the pages that are edited (watch.py)
+
+Usage:
+  python pipeline.py [BOOKS_DIR ...] [--stages links,clean,navigation[,crossrefs][,minify]] [-j N] [--shared-nav] [--force] [--search-index] [--service-worker] [--check-links] [--watch]
+"""
+
+import os
+import re
+import sys
+import glob
+import argparse
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from add_navigation import (BOOK_TABLE_JS, extract_page_parts, parse_chapter_page_name,
+                            print_size_report, render_book_table_js, render_chapter_page)
+from book_tables import load_book_table
+from build_manifest import BuildManifest, generator_fingerprint, hash_bytes, hash_file, write_if_changed
+from build_stats import NULL_STATS, BuildStats, add_arguments, run_with_stats
+from cross_references import crossrefs_stage
+from minify_html import minify_stage, print_savings
+from modernize_bible import (clean_chapter_list, clean_chapter_parts, get_book_abbrev,
+                             get_output_filename, remove_upstream_file, render_clean_page,
+                             update_links_in_content, write_result)
+from search_shards import SEARCH_DIR, print_stats as print_search_stats, write_search_index
+from service_worker import SW_NAME, print_summary as print_service_worker, write_service_worker
+from validate_links import print_report as print_link_report, validate
+
+BOOKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Pages in books/ that are not part of the Bible text
+SKIP_FILES = {'links.htm', 'webfaq.htm', 'copyright.htm', 'index.htm'}
+
+# func(doc, options, stats); upstream stages read eBible pages (ABB01.htm)
+# and must come before the others; sources are hashed into the fingerprint
+Stage = namedtuple('Stage', 'func upstream sources')
+STAGES = {}
+
+
+class Document:
+    """One page on its way through the pipeline."""
+
+    def __init__(self, source_path, name, content):
+        self.source_path = source_path
+        self.name = name          # output filename
+        self.content = content    # the page as the last stage left it
+        self.parts = None         # (nav_html, main_html, footnotes_html) once cleaned
+        self.skip = False         # set by a stage when the page must not be written
+        self.saved = None         # bytes the minify stage took off
+
+
+def register_stage(name, func, upstream=False, sources=()):
+    """Add a stage; sources are the files whose code it runs."""
+    STAGES[name] = Stage(func, upstream, tuple(os.path.abspath(path) for path in sources))
+
+
+def links_stage(doc, options, stats):
+    doc.content = update_links_in_content(doc.content, options['table'])
+
+
+def clean_stage(doc, options, stats):
+    table = options['table']
+    abbrev, chapter = get_book_abbrev(os.path.basename(doc.source_path), table)
+    book_display = table.display_name(table.mapping[abbrev])
+    if not chapter:
+        doc.content = clean_chapter_list(doc.content, book_display)
+        return
+    doc.parts = clean_chapter_parts(doc.content, stats)
+    doc.content = render_clean_page(book_display, chapter, *doc.parts)
+
+
+def navigation_stage(doc, options, stats):
+    table = options['table']
+    parsed = parse_chapter_page_name(doc.name, table)
+    if not parsed:
+        return
+    if doc.parts:
+        # Same as extracting them back out of the cleaned page
+        main_content = doc.parts[1].lstrip('\n').rstrip()
+        footnote_content = doc.parts[2].strip()
+    else:
+        parts = extract_page_parts(doc.content)
+        if parts is None:
+            doc.skip = True
+            return
+        main_content, footnote_content = parts
+    doc.content = render_chapter_page(main_content, footnote_content, *parsed,
+                                      shared_nav=options.get('shared_nav', False), table=table)
+
+
+_MODERNIZE = os.path.join(BOOKS_DIR, 'modernize_bible.py')
+_NAVIGATION = os.path.join(BOOKS_DIR, 'add_navigation.py')
+_BOOK_TABLES = os.path.join(BOOKS_DIR, 'book_tables.py')
+register_stage('links', links_stage, upstream=True, sources=[_MODERNIZE])
+register_stage('clean', clean_stage, upstream=True, sources=[_MODERNIZE])
+register_stage('navigation', navigation_stage, sources=[_NAVIGATION])
+register_stage('crossrefs', crossrefs_stage,
+               sources=[os.path.join(BOOKS_DIR, 'cross_references.py'), os.path.join(BOOKS_DIR, 'references.py'),
+                        os.path.join(BOOKS_DIR, 'sqlite_export.py')])
+register_stage('minify', minify_stage, sources=[os.path.join(BOOKS_DIR, 'minify_html.py')])
+
+
+def upstream_sources(books_dir, table=None, paths=None):
+    """Return [(path, output name)] for the upstream pages (ABB01.htm) in books_dir.
+
+    paths limits the result to those files (default: every page).
+    """
+    if paths is None:
+        paths = glob.glob(os.path.join(books_dir, '*.htm'))
+    sources = []
+    for path in sorted(paths):
+        basename = os.path.basename(path)
+        new_filename = get_output_filename(basename, table)
+        if basename in SKIP_FILES or not new_filename:
+            continue
+        # Already modernized (e.g. Job01.htm, which also matches 'JOB')
+        if new_filename == basename:
+            continue
+        sources.append((path, new_filename))
+    return sources
+
+
+def page_sources(books_dir, paths=None):
+    """Return [(path, name)] for the modernized chapter pages, rewritten in place.
+
+    paths limits the result to those files (default: every page).
+    """
+    if paths is None:
+        paths = glob.glob(os.path.join(books_dir, '*.htm'))
+    return [(path, os.path.basename(path))
+            for path in sorted(paths)
+            if re.search(r'\d+\.htm$', os.path.basename(path))
+            and os.path.basename(path) not in SKIP_FILES]
+
+
+def stats_name(name, options):
+    """Name a page in the stats; pages of several translations are told apart by label."""
+    label = options.get('label')
+    return f'{label}/{name}' if label else name
+
+
+def process_document(path, name, stages, options, stats=NULL_STATS):
+    """Read one source page and run it through the stages; return the Document."""
+    stats.begin_file(stats_name(name, options), path)
+    with stats.stage('read'):
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            doc = Document(path, name, f.read())
+    for stage_name in stages:
+        with stats.stage(stage_name):
+            STAGES[stage_name].func(doc, options, stats)
+        if doc.skip:
+            break
+    stats.end_file()
+    return doc
+
+
+def process_document_with_stats(path, name, stages, options):
+    """process_document for a pool worker; also returns the worker's stats records."""
+    stats = BuildStats('pipeline')
+    doc = process_document(path, name, stages, options, stats)
+    return doc, stats.export()
+
+
+def iter_documents(tasks, stages, jobs=1, stats=NULL_STATS, pool=None):
+    """Yield (task, Document) for each (path, name, options) task, in input order.
+
+    With jobs > 1 the pages are processed in a pool of worker processes.
+    At most ``2 * jobs`` documents are in flight at once, so memory stays
+    bounded no matter how large the corpus is. Tasks of every translation
+    go through the same window, so the pool stays busy from one
+    translation to the next. A pool passed in (watch mode keeps one warm)
+    is used and left running.
+    """
+    if jobs <= 1:
+        for task in tasks:
+            try:
+                yield task, process_document(*task[:2], stages, task[2], stats)
+            except Exception as e:
+                print(f"  Error processing {os.path.basename(task[0])}: {e}")
+        return
+
+    if pool is None:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            yield from iter_documents(tasks, stages, jobs, stats, pool)
+        return
+
+    def submit(pool, task):
+        path, name, options = task
+        if stats.enabled:
+            return pool.submit(process_document_with_stats, path, name, stages, options)
+        return pool.submit(process_document, path, name, stages, options)
+
+    window = 2 * jobs
+    pending = deque()
+    remaining = iter(tasks)
+    for task in remaining:
+        pending.append((task, submit(pool, task)))
+        if len(pending) >= window:
+            break
+
+    while pending:
+        task, future = pending.popleft()
+        try:
+            result = future.result()
+            if stats.enabled:
+                doc, exported = result
+                stats.merge(exported)
+            else:
+                doc = result
+        except Exception as e:
+            print(f"  Error processing {os.path.basename(task[0])}: {e}")
+            doc = None
+
+        # Top the window back up before handing the result to the writer
+        source = next(remaining, None)
+        if source is not None:
+            pending.append((source, submit(pool, source)))
+
+        if doc is not None:
+            yield task, doc
+
+
+def check_stages(stages):
+    """Raise ValueError unless stages are known and upstream stages come first."""
+    for name in stages:
+        if name not in STAGES:
+            raise ValueError(f"unknown stage '{name}' (known: {', '.join(STAGES)})")
+    flags = [STAGES[name].upstream for name in stages]
+    if flags != sorted(flags, reverse=True):
+        raise ValueError('stages that read upstream pages (' +
+                         ', '.join(n for n, s in STAGES.items() if s.upstream) + ') must come first')
+
+
+class Translation:
+    """One translation directory in a build: its book table, manifest and counters."""
+
+    def __init__(self, books_dir, stages, force=False, shared_nav=False, label=None):
+        self.books_dir = books_dir
+        self.label = label
+        self.table = load_book_table(books_dir)
+        self.upstream = STAGES[stages[0]].upstream
+        self.shared_nav = shared_nav
+        self.options = {'books_dir': books_dir, 'label': label, 'table': self.table,
+                        'shared_nav': shared_nav}
+        self.scripts_dir = os.path.join(os.path.dirname(books_dir), 'scripts')
+        self.processed = self.updated = 0
+        self.bytes_read = self.bytes_out = self.bytes_written = 0
+        self.minified = {}
+
+        sources = self.sources()
+        self.print(f"Found {len(sources)} {'upstream' if self.upstream else 'chapter'} files "
+                   f"({len(self.table.books)} books)")
+
+        # Outputs built from the same input by the same code and tables are
+        # skipped. Upstream inputs are removed once modernized, so only their
+        # hash is checked; pages rewritten in place must still hold our bytes.
+        code = {os.path.abspath(__file__), _BOOK_TABLES}
+        for name in stages:
+            code.update(STAGES[name].sources)
+        fingerprint = generator_fingerprint(sorted(code), self.table.digest, stages, shared_nav)
+        self.manifest = BuildManifest(books_dir, '+'.join(stages), fingerprint, force=force)
+
+        if shared_nav and 'navigation' in stages:
+            os.makedirs(self.scripts_dir, exist_ok=True)
+            write_if_changed(os.path.join(self.scripts_dir, BOOK_TABLE_JS),
+                             render_book_table_js(self.table))
+
+        self.input_hashes = {}
+        self.skipped = 0
+        self.todo = self.plan(sources)
+
+    def sources(self, paths=None):
+        """Return [(path, output name)] of the pages this build reads, or of paths among them."""
+        if self.upstream:
+            return upstream_sources(self.books_dir, self.table, paths)
+        return page_sources(self.books_dir, paths)
+
+    def plan(self, sources):
+        """Return the sources that need building; the up-to-date ones are counted as skipped."""
+        todo = []
+        for path, name in sources:
+            if self.upstream:
+                input_hash = hash_file(path)
+                if self.manifest.is_fresh(name, input_hash, check_output=False):
+                    remove_upstream_file(path, os.path.join(self.books_dir, name))
+                    self.skipped += 1
+                    continue
+                self.input_hashes[path] = input_hash
+            elif self.manifest.is_fresh(name):
+                self.skipped += 1
+                continue
+            todo.append((path, name))
+        return todo
+
+    def print(self, message):
+        print(f"[{self.label}] {message}" if self.label else message)
+
+    def write(self, path, doc, stats=NULL_STATS):
+        """Write one processed page and record it in the manifest."""
+        self.bytes_read += os.path.getsize(path)
+        if doc.skip:
+            return
+        data = doc.content.encode('utf-8')
+        stats.begin_file(stats_name(doc.name, self.options))
+        with stats.stage('write'):
+            if self.upstream:
+                changed = write_result(self.books_dir, path, doc.name, doc.content)
+            else:
+                changed = write_if_changed(path, doc.content)
+        stats.end_file(len(data))
+        self.processed += 1
+        self.bytes_out += len(data)
+        if doc.saved is not None:
+            self.minified[doc.name] = doc.saved
+        if changed:
+            self.updated += 1
+            self.bytes_written += len(data)
+            if not self.upstream and self.updated % 100 == 0:
+                self.print(f"  Processed {self.updated} files...")
+        self.manifest.record(doc.name, hash_bytes(data),
+                             os.path.basename(path) if self.upstream else None,
+                             self.input_hashes.get(path))
+
+    def report(self, stages):
+        if self.skipped:
+            self.print(f"  Skipped {self.skipped} up-to-date files")
+        self.print(f"Done! Processed {self.processed} files ({self.updated} written) "
+                   f"with stages: {', '.join(stages)}")
+        self.print(f"Read {self.bytes_read:,} bytes, wrote {self.bytes_written:,} bytes")
+        if self.minified:
+            print_savings(self.minified, self.bytes_out)
+        if 'navigation' in stages and self.processed:
+            print_size_report(self.bytes_read, self.bytes_out, self.processed, self.scripts_dir,
+                              self.shared_nav)
+
+
+def translation_labels(books_dirs):
+    """Name each translation after its edition directory (eng-web/books -> eng-web).
+
+    A single translation is not labeled; clashing names fall back to the path.
+    """
+    if len(books_dirs) < 2:
+        return {books_dir: None for books_dir in books_dirs}
+    names = {books_dir: os.path.basename(os.path.dirname(books_dir)) for books_dir in books_dirs}
+    counts = {}
+    for name in names.values():
+        counts[name] = counts.get(name, 0) + 1
+    return {books_dir: name if counts[name] == 1 else books_dir for books_dir, name in names.items()}
+
+
+def build_translations(books_dirs, stages, jobs=1, force=False, shared_nav=False, stats=NULL_STATS):
+    """Run stages over every translation directory on one worker pool.
+
+    Each directory gets the book tables of its own edition (book_tables.py)
+    and its own manifest. Raises ValueError for unknown stages or an
+    edition without a VernacularParms file.
+    """
+    check_stages(stages)
+    books_dirs = [os.path.abspath(books_dir) for books_dir in books_dirs]
+    labels = translation_labels(books_dirs)
+    translations = {}
+    for books_dir in books_dirs:
+        translations[books_dir] = Translation(books_dir, stages, force, shared_nav, labels[books_dir])
+
+    tasks = [(path, name, translation.options)
+             for translation in translations.values() for path, name in translation.todo]
+    try:
+        # Each result is written as soon as it is ready; a page is only ever
+        # read by its own task, so replacing it early cannot affect the others.
+        for (path, name, options), doc in iter_documents(tasks, stages, jobs, stats):
+            translations[options['books_dir']].write(path, doc, stats)
+    finally:
+        for translation in translations.values():
+            translation.manifest.save()
+
+    for translation in translations.values():
+        print()
+        translation.report(stages)
+    return sum(translation.processed for translation in translations.values())
+
+
+def build(books_dir, stages, jobs=1, force=False, shared_nav=False, stats=NULL_STATS):
+    """Run stages over books_dir, reading and writing each page once."""
+    return build_translations([books_dir], stages, jobs, force, shared_nav, stats)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the chapter pages in one pass')
+    parser.add_argument('books_dirs', nargs='*', metavar='BOOKS_DIR',
+                        help='translation books/ directories, each with its meta/ next to it '
+                             '(default: this one)')
+    parser.add_argument('--stages', default='links,clean,navigation',
+                        help='comma-separated stages to run (default: links,clean,navigation)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes shared by all translations (0 = one per CPU)')
+    parser.add_argument('--force', action='store_true',
+                        help='ignore the build manifest and rebuild every page')
+    parser.add_argument('--shared-nav', action='store_true',
+                        help='write the book table once to scripts/books.js and '
+                             'let navigation.js build the sidebar and dropdown')
+    parser.add_argument('--search-index', action='store_true',
+                        help='write the browser search index (search_shards.py) of each translation')
+    parser.add_argument('--service-worker', action='store_true',
+                        help='write the offline service worker (service_worker.py) of each translation')
+    parser.add_argument('--check-links', action='store_true',
+                        help='run validate_links.py on each translation after the build')
+    parser.add_argument('--watch', action='store_true',
+                        help='after the build, keep rebuilding pages as they are edited (watch.py)')
+    add_arguments(parser)
+    # Imported here because watch mode is built on this module
+    from watch import add_watch_arguments, watch_from_args
+    add_watch_arguments(parser)
+    args = parser.parse_args(argv)
+    jobs = args.jobs or os.cpu_count() or 1
+    stages = [name.strip() for name in args.stages.split(',') if name.strip()]
+    books_dirs = args.books_dirs or [BOOKS_DIR]
+    try:
+        check_stages(stages)
+        if args.watch and len(books_dirs) > 1:
+            raise ValueError('--watch takes a single BOOKS_DIR')
+        for books_dir in books_dirs:
+            if not os.path.isdir(books_dir):
+                raise ValueError(f"not a directory: {books_dir}")
+            # Also checks the edition's metadata and chapter pages
+            load_book_table(books_dir)
+    except ValueError as e:
+        parser.error(str(e))
+
+    run_with_stats(args, 'pipeline', BOOKS_DIR,
+                   lambda stats: build_translations(books_dirs, stages, jobs, args.force,
+                                                    args.shared_nav, stats), jobs)
+
+    if args.search_index:
+        for books_dir in books_dirs:
+            out_dir = os.path.join(os.path.dirname(os.path.abspath(books_dir)), 'scripts', SEARCH_DIR)
+            print(f"\nWriting the search index to {out_dir}")
+            _, sizes, shard_of = write_search_index(books_dir, out_dir)
+            print_search_stats(sizes, shard_of, [])
+
+    if args.service_worker:
+        for books_dir in books_dirs:
+            site_dir = os.path.dirname(os.path.abspath(books_dir))
+            print()
+            config, page_bytes = write_service_worker(site_dir)
+            print_service_worker(os.path.join(site_dir, SW_NAME), config, page_bytes)
+
+    status = 0
+    if args.check_links:
+        for books_dir in books_dirs:
+            site_dir = os.path.dirname(os.path.abspath(books_dir))
+            print(f"\nChecking links in {site_dir}")
+            report = validate(site_dir, jobs)
+            print_link_report(report)
+            if report['dangling']:
+                status = 1
+
+    if args.watch:
+        watch_from_args(args, books_dirs[0], stages, jobs, args.shared_nav)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
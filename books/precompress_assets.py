@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Post-build stage: prepare the site for static hosting.
+- Copy the site (pages, styles, scripts, fonts, images) to a deploy directory
+- Rename shared assets to content-hashed names (styles.3f2a9c1e.css) and
+  rewrite the references to them in pages and in styles.css
+- Write .gz sidecars in parallel (and .br when the brotli module is installed)
+- Write deploy-manifest.json with the hashed names, sizes and cache policy
+- Regenerate sw.js, when the site has one, so the service worker
+  precaches the hashed names (service_worker.py)
+"""
+
+import os
+import re
+import glob
+import gzip
+import json
+import shutil
+import fnmatch
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from service_worker import SW_NAME, write_service_worker
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Shared assets that get content-hashed names, relative to the site root.
+# Fonts come first because styles.css refers to them.
+FINGERPRINT_PATTERNS = [
+    'styles/fonts/*.woff',
+    'styles/fonts/*.ttf',
+    'styles/fonts/*.eot',
+    'styles/*.css',
+    'scripts/*.js',
+]
+
+# Everything that is copied to the deploy directory
+SITE_PATTERNS = [
+    '*.htm',
+    'sw.js',
+    'books/*.htm',
+    'books/*.html',
+    'books/*.part',
+    'img/*',
+    'scripts/search/*.json',
+] + FINGERPRINT_PATTERNS
+
+# Files whose names already carry a content hash (search_shards.py)
+HASHED_PATTERNS = ['scripts/search/terms-*.json']
+
+# File types worth compressing (woff and images are already compressed)
+COMPRESS_EXTENSIONS = {'.htm', '.html', '.part', '.css', '.js', '.json', '.svg', '.ttf', '.eot'}
+
+MANIFEST_NAME = 'deploy-manifest.json'
+HASH_LENGTH = 8
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+
+def content_hash(data):
+    """Short hex content hash used in fingerprinted filenames."""
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def hashed_name(rel_path, data):
+    """styles/styles.css -> styles/styles.<hash>.css"""
+    root, ext = os.path.splitext(rel_path)
+    return f'{root}.{content_hash(data)}{ext}'
+
+
+def collect_site_files(site_dir):
+    """Return the relative paths of all files that make up the site."""
+    files = set()
+    for pattern in SITE_PATTERNS:
+        for path in glob.glob(os.path.join(site_dir, pattern)):
+            if os.path.isfile(path):
+                files.add(os.path.relpath(path, site_dir).replace(os.sep, '/'))
+    return sorted(files)
+
+
+def make_reference_rewriter(renames, base_dir):
+    """Compile a function that rewrites href/src/url() references.
+
+    renames maps site-relative paths to their hashed names. base_dir is the
+    site-relative directory of the document being rewritten, so relative
+    references like ../styles/styles.css or ./fonts/x.woff resolve.
+    """
+    pattern = re.compile(r"""((?:href|src)=["']|url\(["']?)([^"')]+)""")
+    names = {path.rsplit('/', 1)[-1] for path in renames}
+
+    def replace(match):
+        ref = match.group(2)
+        if ref.rsplit('/', 1)[-1] not in names:
+            return match.group(0)
+        target = os.path.normpath(os.path.join(base_dir, ref)).replace(os.sep, '/')
+        new_target = renames.get(target)
+        if new_target is None:
+            return match.group(0)
+        new_ref = os.path.relpath(new_target, base_dir or '.').replace(os.sep, '/')
+        if ref.startswith('./') and not new_ref.startswith('.'):
+            new_ref = './' + new_ref
+        return match.group(1) + new_ref
+
+    def rewrite(text):
+        return pattern.sub(replace, text)
+
+    return rewrite
+
+
+def compress_file(path, use_brotli):
+    """Write .gz (and .br) sidecars for path; return the compressed sizes."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    sizes = {}
+
+    # mtime=0 keeps the output byte-for-byte reproducible
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data):
+        with open(path + '.gz', 'wb') as f:
+            f.write(gz)
+        sizes['gzip'] = len(gz)
+
+    if use_brotli:
+        br = brotli.compress(data, quality=11)
+        if len(br) < len(data):
+            with open(path + '.br', 'wb') as f:
+                f.write(br)
+            sizes['br'] = len(br)
+
+    return sizes
+
+
+def build_deploy_tree(site_dir, out_dir):
+    """Copy the site into out_dir with hashed asset names.
+
+    Returns (entries, renames) where entries maps each logical path to its
+    deployed path.
+    """
+    files = collect_site_files(site_dir)
+    fingerprinted = set()
+    for pattern in FINGERPRINT_PATTERNS:
+        for path in glob.glob(os.path.join(site_dir, pattern)):
+            fingerprinted.add(os.path.relpath(path, site_dir).replace(os.sep, '/'))
+
+    renames = {}
+    entries = {}
+
+    def write(rel_path, data):
+        dest = os.path.join(out_dir, rel_path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(dest, 'wb') as f:
+            f.write(data)
+
+    # Assets in dependency order: fonts, then the stylesheets that use them
+    ordered = [rel for pattern in FINGERPRINT_PATTERNS for rel in files
+               if rel in fingerprinted and fnmatch.fnmatch(rel, pattern)]
+    for rel_path in ordered:
+        with open(os.path.join(site_dir, rel_path), 'rb') as f:
+            data = f.read()
+        if rel_path.endswith('.css'):
+            rewrite = make_reference_rewriter(renames, os.path.dirname(rel_path))
+            data = rewrite(data.decode('utf-8')).encode('utf-8')
+        new_path = hashed_name(rel_path, data)
+        renames[rel_path] = new_path
+        entries[rel_path] = new_path
+        write(new_path, data)
+
+    # Pages and everything else keep their names
+    rewriters = {}
+    for rel_path in files:
+        if rel_path in fingerprinted:
+            continue
+        src = os.path.join(site_dir, rel_path)
+        if os.path.splitext(rel_path)[1] in ('.htm', '.html'):
+            base_dir = os.path.dirname(rel_path)
+            if base_dir not in rewriters:
+                rewriters[base_dir] = make_reference_rewriter(renames, base_dir)
+            with open(src, 'r', encoding='utf-8', errors='surrogateescape') as f:
+                text = f.read()
+            write(rel_path, rewriters[base_dir](text).encode('utf-8', errors='surrogateescape'))
+        else:
+            dest = os.path.join(out_dir, rel_path)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(src, dest)
+        entries[rel_path] = rel_path
+
+    return entries, renames
+
+
+def main(argv=None):
+    books_dir = os.path.dirname(os.path.abspath(__file__))
+    site_dir = os.path.dirname(books_dir)
+
+    parser = argparse.ArgumentParser(description='Fingerprint and precompress the site for deployment')
+    parser.add_argument('--out', default=os.path.join(site_dir, 'dist'),
+                        help='deploy directory (default: ./dist)')
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+                        help='number of compression processes (0 = one per CPU)')
+    parser.add_argument('--brotli', action='store_true',
+                        help='also write .br sidecars (needs the brotli module)')
+    args = parser.parse_args(argv)
+    jobs = args.jobs or os.cpu_count() or 1
+
+    if args.brotli and brotli is None:
+        parser.error('--brotli needs the brotli module (pip install brotli)')
+
+    out_dir = os.path.abspath(args.out)
+    if os.path.exists(out_dir):
+        # Only ever clear a directory this script created
+        if os.listdir(out_dir) and not os.path.exists(os.path.join(out_dir, MANIFEST_NAME)):
+            parser.error(f'{out_dir} exists and is not a deploy directory')
+        shutil.rmtree(out_dir)
+
+    entries, renames = build_deploy_tree(site_dir, out_dir)
+    print(f"Copied {len(entries)} files to {out_dir}")
+    for old, new in renames.items():
+        print(f"  {old} -> {new}")
+    if SW_NAME in entries:
+        config, _ = write_service_worker(out_dir)
+        print(f"  {SW_NAME}: version {config['version']}, {len(config['precache'])} assets precached")
+
+    # Compress in parallel
+    deployed = sorted(set(entries.values()))
+    to_compress = [rel for rel in deployed if os.path.splitext(rel)[1] in COMPRESS_EXTENSIONS]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {rel: pool.submit(compress_file, os.path.join(out_dir, rel), args.brotli)
+                   for rel in to_compress}
+        compressed = {rel: future.result() for rel, future in futures.items()}
+
+    # Deploy manifest
+    hashed = set(renames.values())
+    files = {}
+    total = total_gz = 0
+    for logical, rel_path in sorted(entries.items()):
+        size = os.path.getsize(os.path.join(out_dir, rel_path))
+        info = {
+            'path': rel_path,
+            'size': size,
+            'cache_control': (IMMUTABLE if rel_path in hashed
+                              or any(fnmatch.fnmatch(rel_path, p) for p in HASHED_PATTERNS)
+                              else REVALIDATE),
+        }
+        info.update(compressed.get(rel_path, {}))
+        files[logical] = info
+        total += size
+        total_gz += info.get('gzip', size)
+
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump({'assets': renames, 'files': files}, f, indent=1, sort_keys=True)
+
+    print(f"Compressed {len(compressed)} files: {total:,} bytes -> {total_gz:,} bytes gzip")
+    print(f"Wrote {os.path.join(out_dir, MANIFEST_NAME)}")
+
+
+if __name__ == '__main__':
+    main()
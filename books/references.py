@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Parse and resolve scripture references such as '1 Jn 3:16', 'Ps 119:1-8'
+or 'Gen 1:1–2:3'.
+- Book names come from the BOOKS display names and filename prefixes, the
+  BOOK_MAPPING / USFM codes, the vernacular names in
+  meta/eng-web-VernacularParms.xml, unambiguous prefixes of the display
+  names, and a short list of common abbreviations
+- One compiled pattern finds candidate references; the book is then
+  resolved with a dict lookup on its normalized name, as in
+  modernize_bible's link rewriter
+- Chapters are validated against the chapter counts in BOOKS
+- scan_references() finds every reference in a document in one pass,
+  only trying the pattern where a word is followed by a number
+
+Usage:
+  python references.py parse '1 Jn 3:16' 'Ps 119:1-8, 12'
+  python references.py scan '*.html'
+"""
+
+import os
+import re
+import sys
+import glob
+import time
+import argparse
+from collections import namedtuple
+from xml.etree import ElementTree
+
+from add_navigation import BOOKS
+from modernize_bible import BOOK_MAPPING
+
+VERNACULAR_PARMS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'meta', 'eng-web-VernacularParms.xml')
+
+# A resolved range. book is a BOOKS filename prefix; a whole-chapter
+# reference has start_verse and end_verse set to None.
+VerseRange = namedtuple('VerseRange', 'book start_chapter start_verse end_chapter end_verse')
+
+# Abbreviations in common use that are not prefixes of a book name
+COMMON_ABBREVIATIONS = {
+    'Genesis': ['Gn'], 'Exodus': ['Ex'], 'Leviticus': ['Lv'], 'Numbers': ['Nm', 'Nb'],
+    'Deuteronomy': ['Dt'], 'Joshua': ['Jsh'], 'Judges': ['Jdg', 'Jgs'], 'Ruth': ['Rt'],
+    '1_Samuel': ['1 Sm'], '2_Samuel': ['2 Sm'], '1_Kings': ['1 Kgs'], '2_Kings': ['2 Kgs'],
+    '1_Chronicles': ['1 Chr'], '2_Chronicles': ['2 Chr'], 'Esther': ['Est'],
+    'Psalms': ['Ps', 'Pss', 'Psalm'], 'Proverbs': ['Prv', 'Pr'], 'Ecclesiastes': ['Eccl', 'Qoh'],
+    'Song_of_Solomon': ['Song', 'Sg', 'SoS', 'Song of Songs', 'Canticles'],
+    'Jeremiah': ['Jer'], 'Ezekiel': ['Ezk'], 'Daniel': ['Dn'], 'Joel': ['Jl'],
+    'Obadiah': ['Ob'], 'Micah': ['Mi'], 'Nahum': ['Na'], 'Habakkuk': ['Hb'],
+    'Zephaniah': ['Zep'], 'Haggai': ['Hg'], 'Zechariah': ['Zec'], 'Malachi': ['Ml'],
+    'Matthew': ['Mt'], 'Mark': ['Mk', 'Mr'], 'Luke': ['Lk'], 'John': ['Jn'],
+    'Romans': ['Rm'], '1_Corinthians': ['1 Cor'], '2_Corinthians': ['2 Cor'],
+    'Philippians': ['Php', 'Phil'], '1_Thessalonians': ['1 Thess', '1 Th'],
+    '2_Thessalonians': ['2 Thess', '2 Th'], '1_Timothy': ['1 Tm'], '2_Timothy': ['2 Tm'],
+    'Philemon': ['Phlm', 'Phm'], 'James': ['Jas', 'Jm'], '1_Peter': ['1 Pt'], '2_Peter': ['2 Pt'],
+    '1_John': ['1 Jn'], '2_John': ['2 Jn'], '3_John': ['3 Jn'], 'Jude': ['Jd'],
+    'Revelation': ['Rv', 'Apocalypse'], 'Tobit': ['Tb'], 'Judith': ['Jdt'],
+    'Wisdom_of_Solomon': ['Wis', 'Wisdom'], 'Sirach': ['Sir', 'Ecclesiasticus'],
+    '1_Maccabees': ['1 Mc', '1 Macc'], '2_Maccabees': ['2 Mc', '2 Macc'],
+    '3_Maccabees': ['3 Mc', '3 Macc'], '4_Maccabees': ['4 Mc', '4 Macc'],
+    'Psalm_151': ['Ps151', 'Ps 151'],
+}
+
+# Generated prefixes shorter than this (excluding a leading book number)
+# are too likely to be ordinary words
+MIN_PREFIX = 3
+
+# Characters scanned before / after a chapter number when matching a reference
+BOOK_WINDOW = 64
+SPAN_WINDOW = 24
+
+_NUMBER_WORDS = {
+    'first': '1', '1st': '1', 'i': '1',
+    'second': '2', '2nd': '2', 'ii': '2',
+    'third': '3', '3rd': '3', 'iii': '3',
+    'fourth': '4', '4th': '4', 'iv': '4',
+}
+_LEADING_NUMBER_RE = re.compile(r'^(first|second|third|fourth|1st|2nd|3rd|4th|iv|iii|ii|i)\b[\s._]*')
+_NON_ALNUM_RE = re.compile(r'[^0-9a-z]+')
+
+# Candidate reference: optional book number, a name of one or more words
+# ('Song of Solomon', 'Esther (Greek)'), then chapter[:verse][-[chapter:]verse]
+_BOOK = (r"(?:(?:[1-4]|IV|I{1,3}|First|Second|Third|Fourth|1st|2nd|3rd|4th)[ \t.]*)?"
+         r"[A-Za-z]+\.?(?:[ \t]+of[ \t]+(?:the[ \t]+)?[A-Za-z]+)?(?:[ \t]*\(Greek\))?")
+_SPAN = r"(\d{1,3})(?:[ \t]*:[ \t]*(\d{1,3}))?(?:[ \t]*[-–—][ \t]*(\d{1,3})(?:[ \t]*:[ \t]*(\d{1,3}))?)?"
+_REFERENCE_RE = re.compile(rf"(?<![\w])({_BOOK})(?:[ \t]+|(?<=\.)){_SPAN}(?![\w])")
+_ANCHOR_RE = re.compile(r"(?:[A-Za-z)][ \t]+|\.[ \t]*)\d")
+_CONTINUATION_RE = re.compile(rf"[ \t]*([,;])[ \t]*{_SPAN}(?![\w:])")
+_SEPARATOR_RE = re.compile(r"[ \t]*[,;][ \t]*")
+
+
+def normalize_book_name(name):
+    """Normalize a book name for lookup: '1 Jn.' -> '1jn', 'First John' -> '1john'."""
+    name = name.lower().strip()
+    match = _LEADING_NUMBER_RE.match(name)
+    if match:
+        name = _NUMBER_WORDS[match.group(1)] + name[match.end():]
+    return _NON_ALNUM_RE.sub('', name)
+
+
+def load_vernacular_names(path=VERNACULAR_PARMS):
+    """Return {book prefix: [names]} from a Paratext VernacularParms file."""
+    names = {}
+    try:
+        root = ElementTree.parse(path).getroot()
+    except (OSError, ElementTree.ParseError):
+        return names
+    for element in root.iter('scriptureBook'):
+        code = element.get('ubsAbbreviation', '')
+        prefix = BOOK_MAPPING.get(code)
+        if prefix and element.text:
+            names.setdefault(prefix, []).append(element.text.strip())
+    return names
+
+
+def build_alias_table(vernacular_path=VERNACULAR_PARMS):
+    """Build {normalized alias: book prefix}.
+
+    Explicit names always win. Generated prefixes are only added when they
+    point at a single book.
+    """
+    book_prefixes = {book[0] for book in BOOKS}
+    explicit = {}
+
+    def add(name, prefix):
+        key = normalize_book_name(name)
+        if key and prefix in book_prefixes:
+            explicit.setdefault(key, prefix)
+
+    # Earlier sources win. Common usage comes before the BOOK_MAPPING codes,
+    # so 'Ps' stays Psalms rather than a prefix of 'PS2' (Psalm 151).
+    for book in BOOKS:
+        add(book[1], book[0])
+        add(book[0].replace('_', ' '), book[0])
+    for prefix, names in COMMON_ABBREVIATIONS.items():
+        for name in names:
+            add(name, prefix)
+    for prefix, names in load_vernacular_names(vernacular_path).items():
+        for name in names:
+            add(name, prefix)
+    for code, prefix in BOOK_MAPPING.items():
+        add(code, prefix)
+
+    # Unambiguous prefixes of the display names: 'Deut', 'Hab', '1 Thess'
+    generated = {}
+    for book in BOOKS:
+        full = normalize_book_name(book[1])
+        number = full[0] if full[0].isdigit() else ''
+        for end in range(len(number) + MIN_PREFIX, len(full)):
+            generated.setdefault(full[:end], set()).add(book[0])
+
+    aliases = dict(explicit)
+    for key, prefixes in generated.items():
+        if key not in aliases and len(prefixes) == 1:
+            aliases[key] = prefixes.pop()
+    return aliases
+
+
+BOOK_ALIASES = build_alias_table()
+CHAPTER_COUNTS = {book[0]: book[2] for book in BOOKS}
+
+
+def resolve_book(name):
+    """Return the BOOKS prefix for a book name or abbreviation, or None."""
+    return BOOK_ALIASES.get(normalize_book_name(name))
+
+
+def make_range(book, chapter, verse, end_a, end_b):
+    """Build a validated VerseRange from parsed numbers, or return None.
+
+    end_a/end_b are the numbers after the dash: 'c:v-v' gives end_a only,
+    'c:v-c:v' gives both, 'c-c' gives end_a as a chapter.
+    """
+    chapter = int(chapter)
+    verse = int(verse) if verse is not None else None
+    end_a = int(end_a) if end_a is not None else None
+    end_b = int(end_b) if end_b is not None else None
+
+    # 'Psalm 151:3' is Psalm 151 (a one-chapter book), not Psalms 151
+    if book == 'Psalms' and chapter == 151:
+        book, chapter = 'Psalm_151', 1
+
+    count = CHAPTER_COUNTS[book]
+    if count == 1 and verse is None and chapter > 1:
+        # 'Jude 3' means verse 3 of the only chapter
+        chapter, verse, end_b, end_a = 1, chapter, None, end_a
+        end_chapter, end_verse = 1, end_a if end_a is not None else verse
+    elif verse is None:
+        end_chapter, end_verse = (end_a if end_a is not None else chapter), None
+    elif end_b is not None:
+        end_chapter, end_verse = end_a, end_b
+    else:
+        end_chapter, end_verse = chapter, end_a if end_a is not None else verse
+
+    if not 1 <= chapter <= end_chapter <= count:
+        return None
+    if verse is not None and (verse < 1 or (end_chapter == chapter and end_verse < verse)):
+        return None
+    return VerseRange(book, chapter, verse, end_chapter, end_verse)
+
+
+def _starts_reference(text, pos):
+    """Whether a reference with its own book name starts at pos."""
+    match = _REFERENCE_RE.match(text, pos)
+    return match is not None and _resolve(match) is not None
+
+
+def _continuations(text, pos, book, chapter):
+    """Parse ', 12' / '; 2:3' lists after a reference; return (ranges, end)."""
+    ranges = []
+    while True:
+        match = _CONTINUATION_RE.match(text, pos)
+        if not match:
+            return ranges, pos
+        sep, a, b, c, d = match.groups()
+        if _starts_reference(text, match.start(2)):
+            # '2 Samuel 7:14; 1 Chronicles 17:13': a new book, not chapter 1
+            return ranges, pos
+        if b is None and sep == ',' and chapter is not None:
+            # Same chapter: 'Ps 119:1-8, 12' or 'Ps 119:1-8, 12-16'
+            found = make_range(book, chapter, a, c, None)
+        else:
+            found = make_range(book, a, b, c, d)
+        if found is None:
+            return ranges, pos
+        ranges.append(found)
+        chapter = found.end_chapter if found.end_verse is not None else None
+        pos = match.end()
+
+
+def _resolve(match):
+    """Return the VerseRange for a candidate match, or None."""
+    book = BOOK_ALIASES.get(normalize_book_name(match.group(1)))
+    return make_range(book, *match.group(2, 3, 4, 5)) if book else None
+
+
+def scan_references(text):
+    """Yield (start, end, VerseRange) for every reference found in text.
+
+    Every reference has a chapter number right after a word, so the scan
+    jumps between those spots and only runs the full pattern on the few
+    dozen characters before each one.
+    """
+    pos = 0
+    search = _REFERENCE_RE.search
+    for anchor in _ANCHOR_RE.finditer(text):
+        digit = anchor.end() - 1
+        start = max(pos, digit - BOOK_WINDOW)
+        while start < digit:
+            match = search(text, start, digit + SPAN_WINDOW)
+            if not match or match.start(2) > digit:
+                break
+            # The window may cut the span short; match again unbounded
+            full = match.start(2) == digit and _REFERENCE_RE.match(text, match.start())
+            found = _resolve(full) if full else None
+            if found is None:
+                # Retry one word later: 'the book of Psalms 23:1'
+                start = match.start() + max(match.group(1).find(' ') + 1, 1)
+                continue
+            match = full
+            yield match.start(), match.end(), found
+            chapter = found.end_chapter if found.end_verse is not None else None
+            more, pos = _continuations(text, match.end(), found.book, chapter)
+            for extra in more:
+                yield match.start(), pos, extra
+            break
+
+
+def parse_reference(text):
+    """Parse one reference string into a list of VerseRanges.
+
+    A list may name further books: 'Ps 2:7; 1 Chr 17:13'. Raises
+    ValueError if text does not start with a valid reference.
+    """
+    text = text.strip()
+    ranges = []
+    pos = 0
+    while True:
+        match = _REFERENCE_RE.match(text, pos)
+        found = _resolve(match) if match else None
+        if found is None:
+            if not ranges:
+                raise ValueError(f"Not a scripture reference: {text!r}")
+            return ranges
+        chapter = found.end_chapter if found.end_verse is not None else None
+        more, pos = _continuations(text, match.end(), found.book, chapter)
+        ranges += [found] + more
+        separator = _SEPARATOR_RE.match(text, pos)
+        if not separator:
+            return ranges
+        pos = separator.end()
+
+
+def format_range(ref):
+    """Format a VerseRange for display: 'Mark 15:25-32', 'Genesis 1:1-2:3'."""
+    name = next(book[1] for book in BOOKS if book[0] == ref.book)
+    if ref.start_verse is None:
+        chapters = (f'{ref.start_chapter}' if ref.end_chapter == ref.start_chapter
+                    else f'{ref.start_chapter}-{ref.end_chapter}')
+        return f'{name} {chapters}'
+    text = f'{name} {ref.start_chapter}:{ref.start_verse}'
+    if ref.end_chapter != ref.start_chapter:
+        return f'{text}-{ref.end_chapter}:{ref.end_verse}'
+    if ref.end_verse != ref.start_verse:
+        return f'{text}-{ref.end_verse}'
+    return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Parse and find scripture references')
+    sub = parser.add_subparsers(dest='command', required=True)
+    parse = sub.add_parser('parse', help='resolve reference strings')
+    parse.add_argument('references', nargs='+')
+    scan = sub.add_parser('scan', help='find references in files')
+    scan.add_argument('files', nargs='+')
+    scan.add_argument('-q', '--quiet', action='store_true', help='only print totals')
+    args = parser.parse_args(argv)
+
+    if args.command == 'parse':
+        for text in args.references:
+            try:
+                ranges = parse_reference(text)
+            except ValueError as e:
+                print(f"  {text!r}: {e}")
+                continue
+            print(f"  {text!r} -> " + '; '.join(format_range(r) for r in ranges))
+        return
+
+    paths = [p for pattern in args.files for p in (glob.glob(pattern) or [pattern])]
+    found = 0
+    size = 0
+    start = time.perf_counter()
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        size += len(text)
+        for s, e, ref in scan_references(text):
+            found += 1
+            if not args.quiet:
+                print(f"{os.path.basename(path)}:{s}: {text[s:e]!r} -> {format_range(ref)}")
+    elapsed = time.perf_counter() - start
+    print(f"{found} references in {len(paths)} files, {size / 1e6:.1f} MB "
+          f"in {elapsed:.2f}s ({size / 1e6 / elapsed:.1f} MB/s)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Full-text search over the verse corpus.
+- Builds a positional inverted index keyed by (book, chapter, verse) from
+  the cleaned chapter pages
+- Persists it as one binary file of flat arrays that is memory-mapped on
+  load, so nothing has to be parsed before the first query
+- Answers term, boolean (AND / OR / NOT) and "phrase" queries, ranked by BM25
+
+Usage:
+  python search_index.py build
+  python search_index.py query 'shepherd AND NOT sheep'
+  python search_index.py query '"my shepherd"'
+"""
+
+import os
+import re
+import math
+import time
+import argparse
+from array import array
+from collections import defaultdict
+
+from corpus import iter_verses, format_reference
+from packed_arrays import PackedFile, write_packed
+
+INDEX_NAME = 'search.idx'
+MAGIC = b'WEBIDX01'
+
+# Header counts: documents, terms, total tokens
+SECTIONS = [
+    ('doc_refs', 'H'),      # book ordinal, chapter, verse per document
+    ('doc_len', 'H'),       # tokens per document
+    ('term_offsets', 'I'),  # start of each term in term_blob, plus end
+    ('term_blob', 'B'),     # sorted UTF-8 terms, concatenated
+    ('term_postings', 'I'), # first posting of each term, plus end
+    ('post_doc', 'I'),      # document of each posting
+    ('post_tf', 'H'),       # term frequency of each posting
+    ('post_pos', 'I'),      # start of each posting's positions, plus end
+    ('positions', 'H'),     # token positions within the document
+]
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+(?:'\w+)*")
+_QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def tokenize(text):
+    """Lower-case word tokens; curly apostrophes are folded into straight ones."""
+    return _TOKEN_RE.findall(text.lower().replace('’', "'"))
+
+
+def build_index(books_dir, path):
+    """Index every verse in books_dir and write the index to path."""
+    doc_refs = array('H')
+    doc_len = array('H')
+    postings = defaultdict(list)   # term -> [(doc, positions)]
+
+    for doc, (ordinal, chapter, verse, text) in enumerate(iter_verses(books_dir)):
+        doc_refs.extend((ordinal, chapter, verse))
+        tokens = tokenize(text)
+        doc_len.append(len(tokens))
+        positions = defaultdict(list)
+        for pos, token in enumerate(tokens):
+            positions[token].append(pos)
+        for token, token_positions in positions.items():
+            postings[token].append((doc, token_positions))
+
+    terms = sorted(postings)
+    arrays = {name: array(typecode) for name, typecode in SECTIONS}
+    arrays['doc_refs'] = doc_refs
+    arrays['doc_len'] = doc_len
+    blob = bytearray()
+    for term in terms:
+        arrays['term_offsets'].append(len(blob))
+        arrays['term_postings'].append(len(arrays['post_doc']))
+        blob += term.encode('utf-8')
+        for doc, token_positions in postings[term]:
+            arrays['post_doc'].append(doc)
+            arrays['post_tf'].append(len(token_positions))
+            arrays['post_pos'].append(len(arrays['positions']))
+            arrays['positions'].extend(token_positions)
+    arrays['term_offsets'].append(len(blob))
+    arrays['term_postings'].append(len(arrays['post_doc']))
+    arrays['post_pos'].append(len(arrays['positions']))
+    arrays['term_blob'] = array('B', blob)
+
+    write_packed(path, MAGIC, (len(doc_len), len(terms), sum(doc_len)), SECTIONS, arrays)
+    return len(doc_len), len(terms)
+
+
+class SearchIndex(PackedFile):
+    """A memory-mapped index written by build_index."""
+
+    def __init__(self, path):
+        super().__init__(path, MAGIC, SECTIONS, 3)
+        self.doc_count, self.term_count, token_count = self.counts
+        self.avg_len = token_count / self.doc_count if self.doc_count else 0.0
+
+    def ref(self, doc):
+        """Return (book_ordinal, chapter, verse) for a document id."""
+        return tuple(self.doc_refs[3 * doc:3 * doc + 3])
+
+    def _find_term(self, term):
+        """Binary search the term dictionary; return the term's index or -1."""
+        key = term.encode('utf-8')
+        lo, hi = 0, self.term_count
+        offsets, blob = self.term_offsets, self.term_blob
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found = bytes(blob[offsets[mid]:offsets[mid + 1]])
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def term_docs(self, term):
+        """Return {doc: term frequency} for a term."""
+        i = self._find_term(term)
+        if i < 0:
+            return {}
+        start, end = self.term_postings[i], self.term_postings[i + 1]
+        return dict(zip(self.post_doc[start:end], self.post_tf[start:end]))
+
+    def term_positions(self, term):
+        """Return {doc: [positions]} for a term."""
+        i = self._find_term(term)
+        if i < 0:
+            return {}
+        start, end = self.term_postings[i], self.term_postings[i + 1]
+        post_pos, positions = self.post_pos, self.positions
+        return {self.post_doc[p]: positions[post_pos[p]:post_pos[p + 1]]
+                for p in range(start, end)}
+
+    def phrase_docs(self, words):
+        """Return {doc: phrase frequency} for documents containing the phrase."""
+        if not words:
+            return {}
+        if len(words) == 1:
+            return self.term_docs(words[0])
+        # Start from the rarest word to keep the candidate set small
+        lists = [self.term_positions(word) for word in words]
+        candidates = set(min(lists, key=len))
+        for found in lists:
+            candidates &= found.keys()
+        matches = {}
+        for doc in candidates:
+            starts = set(lists[0][doc])
+            for offset, found in enumerate(lists[1:], 1):
+                starts &= {pos - offset for pos in found[doc]}
+                if not starts:
+                    break
+            if starts:
+                matches[doc] = len(starts)
+        return matches
+
+    def bm25(self, doc_tfs, scores):
+        """Add the BM25 contribution of one term ({doc: tf}) to scores."""
+        df = len(doc_tfs)
+        if not df:
+            return
+        idf = math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+        norm = K1 * (1 - B)
+        scale = K1 * B / self.avg_len
+        doc_len = self.doc_len
+        for doc, tf in doc_tfs.items():
+            scores[doc] += idf * tf * (K1 + 1) / (tf + norm + scale * doc_len[doc])
+
+    def search(self, query, limit=10):
+        """Run a query and return [(score, (book_ordinal, chapter, verse))].
+
+        Words and "quoted phrases" are ANDed by default. OR separates
+        alternatives, and NOT (or a leading -) excludes the next term.
+        """
+        scores = defaultdict(float)
+        for group in parse_query(query):
+            matched = None
+            group_scores = defaultdict(float)
+            excluded = set()
+            for negate, words in group:
+                docs = self.phrase_docs(words)
+                if negate:
+                    excluded.update(docs)
+                    continue
+                matched = set(docs) if matched is None else matched & docs.keys()
+                self.bm25(docs, group_scores)
+            if not matched:
+                continue
+            for doc in matched - excluded:
+                scores[doc] += group_scores[doc]
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(score, self.ref(doc)) for doc, score in ranked[:limit]]
+
+
+def parse_query(query):
+    """Parse a query into OR-groups of (negate, [words]) clauses."""
+    groups = [[]]
+    negate = False
+    for match in _QUERY_RE.finditer(query):
+        phrase, word = match.groups()
+        if word == 'OR':
+            groups.append([])
+            continue
+        if word == 'AND':
+            continue
+        if word == 'NOT':
+            negate = True
+            continue
+        if word and word.startswith('-') and len(word) > 1:
+            negate, word = True, word[1:]
+        words = tokenize(phrase if phrase is not None else word)
+        if words:
+            groups[-1].append((negate, words))
+        negate = False
+    return [group for group in groups if group]
+
+
+def main(argv=None):
+    books_dir = os.path.dirname(os.path.abspath(__file__))
+    default_index = os.path.join(books_dir, INDEX_NAME)
+
+    parser = argparse.ArgumentParser(description='Full-text search over the verse corpus')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help='build the index from the chapter pages')
+    build.add_argument('--out', default=default_index, help='index file to write')
+    query = sub.add_parser('query', help='search the index')
+    query.add_argument('--index', default=default_index, help='index file to read')
+    query.add_argument('-n', '--limit', type=int, default=10, help='number of results')
+    query.add_argument('terms', nargs='+', help='query text')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        docs, terms = build_index(books_dir, args.out)
+        elapsed = time.perf_counter() - start
+        print(f"Indexed {docs} verses, {terms} terms in {elapsed:.2f}s")
+        print(f"Wrote {args.out} ({os.path.getsize(args.out):,} bytes)")
+        return
+
+    start = time.perf_counter()
+    index = SearchIndex(args.index)
+    loaded = time.perf_counter()
+    results = index.search(' '.join(args.terms), args.limit)
+    done = time.perf_counter()
+    for score, ref in results:
+        print(f"  {format_reference(*ref):28s} {score:7.3f}")
+    print(f"{len(results)} results (load {(loaded - start) * 1000:.2f} ms, "
+          f"query {(done - loaded) * 1000:.2f} ms)")
+
+
+if __name__ == '__main__':
+    main()
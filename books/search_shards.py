@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Sharded search index for the browser, under scripts/search/.
+- index.json is the global dictionary: the books (with how their chapter
+  files are named, and the pages kept under a legacy name), the verse
+  count, and the first term of every shard
+- The terms are split, in sorted order, into shards of about
+  SHARD_BYTES each. A shard holds the postings of its terms, so a query
+  fetches index.json and one shard per query word; navigation.js keeps
+  the shards it has fetched
+- A posting list is the verse keys (book * 1000000 + chapter * 1000 +
+  verse) of a term, delta-encoded; a delta of 0 is another occurrence in
+  the same verse
+- Shard names carry a hash of their content, so a deployed shard never
+  changes and can be cached for good
+- Terms come from search_index.tokenize, so the browser and
+  search_index.py find the same verses for a word
+- Prints the shard sizes and the bytes a typical query downloads (two
+  words from a random verse), raw and gzipped
+
+Usage:
+  python search_shards.py [--out DIR] [--shard-bytes N] [--queries N]
+"""
+
+import os
+import json
+import gzip
+import glob
+import random
+import hashlib
+import argparse
+from collections import defaultdict
+
+from add_navigation import BOOKS
+from corpus import chapter_file_naming, find_chapter_files, read_chapter_verses
+from search_index import tokenize
+
+SEARCH_DIR = 'search'
+INDEX_NAME = 'index.json'
+SHARD_BYTES = 16 * 1024
+HASH_LENGTH = 8
+
+
+def verse_key(ordinal, chapter, verse):
+    return (ordinal * 1000 + chapter) * 1000 + verse
+
+
+def dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def collect_postings(books_dir):
+    """Return ({term: [verse keys, repeated per occurrence]}, verse count, book entries).
+
+    A book entry is [display name, filename prefix, chapter digits,
+    extension] as its chapter files are named on disk, followed by
+    {chapter: filename} when some are kept under a legacy name, or None
+    when the book has no chapter files.
+    """
+    postings = defaultdict(list)
+    books = [None] * len(BOOKS)
+    verses = 0
+    for ordinal, chapter, path in find_chapter_files(books_dir):
+        prefix, digits, ext, filename = chapter_file_naming(ordinal, path)
+        if books[ordinal] is None:
+            books[ordinal] = [BOOKS[ordinal][1], prefix, digits, ext]
+        if filename:
+            if len(books[ordinal]) == 4:
+                books[ordinal].append({})
+            books[ordinal][4][chapter] = filename
+        for verse, text in read_chapter_verses(path):
+            verses += 1
+            key = verse_key(ordinal, chapter, verse)
+            for token in tokenize(text):
+                postings[token].append(key)
+    return postings, verses, books
+
+
+def encode_postings(keys):
+    """Delta-encode sorted verse keys."""
+    keys = sorted(keys)
+    return [keys[0]] + [b - a for a, b in zip(keys, keys[1:])]
+
+
+def split_shards(postings, shard_bytes=SHARD_BYTES):
+    """Split the sorted terms into [{term: encoded postings}] of about shard_bytes each."""
+    shards = []
+    current = {}
+    size = 0
+    for term in sorted(postings):
+        encoded = encode_postings(postings[term])
+        entry_size = len(dumps({term: encoded}).encode('utf-8'))
+        if current and size + entry_size > shard_bytes:
+            shards.append(current)
+            current = {}
+            size = 0
+        current[term] = encoded
+        size += entry_size
+    if current:
+        shards.append(current)
+    return shards
+
+
+def write_search_index(books_dir, out_dir, shard_bytes=SHARD_BYTES):
+    """Write index.json and the shards to out_dir; remove shards left by earlier builds.
+
+    Returns (index data, {shard name: (raw bytes, gzipped bytes)}, {term: shard name}).
+    """
+    postings, verses, books = collect_postings(books_dir)
+    shards = split_shards(postings, shard_bytes)
+    os.makedirs(out_dir, exist_ok=True)
+
+    sizes = {}
+    shard_of = {}
+    names = []
+    for shard in shards:
+        data = dumps(shard).encode('utf-8')
+        name = f'terms-{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}.json'
+        path = os.path.join(out_dir, name)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(data)
+        names.append(name)
+        sizes[name] = (len(data), len(gzip.compress(data, mtime=0)))
+        for term in shard:
+            shard_of[term] = name
+
+    index = {
+        'version': 1,
+        'verses': verses,
+        'books': books,
+        'shards': [[next(iter(shard)), name] for shard, name in zip(shards, names)],
+    }
+    data = dumps(index).encode('utf-8')
+    tmp_path = os.path.join(out_dir, INDEX_NAME + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, os.path.join(out_dir, INDEX_NAME))
+    sizes[INDEX_NAME] = (len(data), len(gzip.compress(data, mtime=0)))
+
+    for path in glob.glob(os.path.join(out_dir, 'terms-*.json')):
+        if os.path.basename(path) not in sizes:
+            os.remove(path)
+    return index, sizes, shard_of
+
+
+def sample_queries(books_dir, count, seed=1):
+    """Return count queries of two words taken from random verses."""
+    rng = random.Random(seed)
+    files = find_chapter_files(books_dir)
+    queries = []
+    while len(queries) < count:
+        _, _, path = rng.choice(files)
+        verses = read_chapter_verses(path)
+        if not verses:
+            continue
+        words = [word for word in tokenize(rng.choice(verses)[1]) if len(word) > 3]
+        if len(words) >= 2:
+            queries.append(rng.sample(words, 2))
+    return queries
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def print_stats(sizes, shard_of, queries):
+    """Report shard sizes and the bytes each query downloads."""
+    index_raw, index_gz = sizes[INDEX_NAME]
+    shards = [size for name, size in sizes.items() if name != INDEX_NAME]
+    raw = [size[0] for size in shards]
+    gz = [size[1] for size in shards]
+    print(f"{len(shard_of):,} terms in {len(shards)} shards; "
+          f"total {sum(raw) + index_raw:,} bytes ({sum(gz) + index_gz:,} gzipped)")
+    print(f"  {INDEX_NAME}: {index_raw:,} bytes ({index_gz:,} gzipped)")
+    print(f"  Shards: min {min(raw):,}, median {percentile(raw, 0.5):,}, max {max(raw):,} bytes "
+          f"(gzipped: min {min(gz):,}, median {percentile(gz, 0.5):,}, max {max(gz):,})")
+
+    if not queries:
+        return
+    fetched = []
+    for words in queries:
+        names = {shard_of[word] for word in words if word in shard_of}
+        fetched.append((index_raw + sum(sizes[name][0] for name in names),
+                        index_gz + sum(sizes[name][1] for name in names)))
+    raw = [size[0] for size in fetched]
+    gz = [size[1] for size in fetched]
+    print(f"  Two-word query, first search on a page ({len(queries)} samples): "
+          f"median {percentile(gz, 0.5):,} bytes gzipped ({percentile(raw, 0.5):,} raw), "
+          f"p90 {percentile(gz, 0.9):,} ({percentile(raw, 0.9):,} raw)")
+
+
+def main(argv=None):
+    books_dir = os.path.dirname(os.path.abspath(__file__))
+    default_out = os.path.join(os.path.dirname(books_dir), 'scripts', SEARCH_DIR)
+
+    parser = argparse.ArgumentParser(description='Build the sharded search index for the browser')
+    parser.add_argument('--out', default=default_out, help='output directory (default: scripts/search)')
+    parser.add_argument('--shard-bytes', type=int, default=SHARD_BYTES,
+                        help=f'target size of a shard before compression (default: {SHARD_BYTES})')
+    parser.add_argument('--queries', type=int, default=1000,
+                        help='sample queries for the download statistics (0 to skip)')
+    args = parser.parse_args(argv)
+
+    _, sizes, shard_of = write_search_index(books_dir, args.out, args.shard_bytes)
+    print(f"Wrote {args.out}")
+    print_stats(sizes, shard_of, sample_queries(books_dir, args.queries) if args.queries else [])
+
+
+if __name__ == '__main__':
+    main()
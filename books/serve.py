@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+"""
+Local HTTP server for the site and the parsed corpus.
+- Serves pages and assets from a byte-bounded in-memory LRU cache, so a
+  warm hit costs no disk reads (files are re-stat'ed at most once a second)
+- A directory URL without its trailing slash is redirected to it
+- Strong ETags with If-None-Match / 304 handling
+- Serves the .gz sidecar written by precompress_assets when the client
+  accepts gzip, and compresses other text files once when it is missing
+- JSON endpoints backed by the parsed chapter pages:
+    /api/chapter/<book>/<chapter>    e.g. /api/chapter/Mark/15
+    /api/verses?ref=<reference>      e.g. /api/verses?ref=Mk+15:25-32
+    /api/stats                       cache statistics
+  Their responses are revalidated like files, against the chapter pages
+  they were read from (chapters added after startup need a restart)
+- A load-test command that reports throughput and latency percentiles
+
+Usage:
+  python serve.py serve [--root DIR] [--port 8000]
+  python serve.py bench [--url http://127.0.0.1:8000] [-c 16] [-n 5000]
+"""
+
+import os
+import sys
+import gzip
+import json
+import stat
+import time
+import random
+import socket
+import asyncio
+import hashlib
+import argparse
+import mimetypes
+import subprocess
+from collections import Counter, OrderedDict
+from email.utils import formatdate
+from functools import lru_cache
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from add_navigation import BOOKS
+from corpus import BOOK_ORDINALS, find_chapter_files, read_chapter_verses
+from precompress_assets import COMPRESS_EXTENSIONS, MANIFEST_NAME, REVALIDATE
+from references import format_range, parse_reference, resolve_book
+
+DEFAULT_CACHE_MB = 64
+# Seconds a cached file is trusted before it is checked against the disk
+STAT_INTERVAL = 1.0
+# Seconds an idle keep-alive connection is kept open
+IDLE_TIMEOUT = 15
+MAX_HEADER_BYTES = 16384
+
+TEXT_TYPES = {'.htm': 'text/html', '.html': 'text/html', '.css': 'text/css',
+              '.js': 'text/javascript', '.json': 'application/json', '.svg': 'image/svg+xml'}
+REASONS = {200: 'OK', 301: 'Moved Permanently', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+def make_etag(data):
+    """Strong ETag: a hash of the exact bytes sent."""
+    return '"' + hashlib.sha256(data).hexdigest()[:20] + '"'
+
+
+def content_type(path):
+    """Content-Type header value for a file path."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in TEXT_TYPES:
+        return TEXT_TYPES[ext] + '; charset=utf-8'
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+def accepts_gzip(header):
+    """True if an Accept-Encoding header allows gzip."""
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+def etag_matches(header, etag):
+    """If-None-Match comparison (weak, as RFC 9110 requires for this header)."""
+    if header.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in header.split(','))
+
+
+class CacheEntry:
+    """A ready-to-send response body plus what's needed to validate it."""
+
+    __slots__ = ('body', 'etag', 'content_type', 'encoding', 'stat', 'checked')
+
+    def __init__(self, body, content_type, encoding=None, stat=None):
+        self.body = body
+        self.etag = make_etag(body)
+        self.content_type = content_type
+        self.encoding = encoding
+        self.stat = stat
+        self.checked = time.monotonic()
+
+
+class ResponseCache:
+    """LRU cache of CacheEntry objects bounded by total body size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        self.discard(key)
+        # Anything bigger than an eighth of the budget would just churn it
+        if len(entry.body) > self.max_bytes // 8:
+            return
+        self.entries[key] = entry
+        self.size += len(entry.body)
+        while self.size > self.max_bytes:
+            _, old = self.entries.popitem(last=False)
+            self.size -= len(old.body)
+            self.evictions += 1
+
+    def discard(self, key):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old.body)
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.size, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+def stat_key(path):
+    """(mtime_ns, size) of a regular file, or None if it doesn't exist or is a directory."""
+    try:
+        st = os.stat(path)
+    except (OSError, ValueError):
+        # ValueError: a NUL in the path (%00 in the URL)
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+@lru_cache(maxsize=256)
+def parse_chapter_verses(path, file_stat):
+    """Parsed [(verse, text)] of a chapter page as of file_stat, kept for the verse endpoint."""
+    return read_chapter_verses(path)
+
+
+def chapter_verses(path):
+    # Keyed on the stat too, so an edited page is parsed again
+    return parse_chapter_verses(path, stat_key(path))
+
+
+class SiteServer:
+    """Request handling for one site root."""
+
+    def __init__(self, root, cache_bytes, log=False):
+        self.root = os.path.abspath(root)
+        self.cache = ResponseCache(cache_bytes)
+        self.log = log
+        self.chapters = {(ordinal, chapter): path for ordinal, chapter, path
+                         in find_chapter_files(os.path.join(self.root, 'books'))}
+        self.cache_control = self.load_cache_policy()
+
+    def load_cache_policy(self):
+        """Cache-Control per deployed path, from a deploy manifest if present."""
+        try:
+            with open(os.path.join(self.root, MANIFEST_NAME), encoding='utf-8') as f:
+                files = json.load(f)['files']
+        except (OSError, ValueError, KeyError):
+            return {}
+        return {info['path']: info['cache_control'] for info in files.values()}
+
+    # Static files
+
+    def resolve_path(self, url_path):
+        """Map a URL path to (relative path, file path), or None if outside the root."""
+        rel = os.path.normpath(unquote(url_path).lstrip('/')).replace(os.sep, '/')
+        if rel.startswith('..') or os.path.isabs(rel):
+            return None
+        if rel == '.':
+            rel = 'index.html'
+        elif url_path.endswith('/'):
+            rel += '/index.html'
+        return rel, os.path.join(self.root, rel)
+
+    def load_file(self, path, gzip_ok):
+        """Read a file (or its .gz sidecar) into a CacheEntry, or None."""
+        file_stat = stat_key(path)
+        if file_stat is None:
+            return None
+        ctype = content_type(path)
+        compressible = os.path.splitext(path)[1].lower() in COMPRESS_EXTENSIONS
+        if gzip_ok and compressible:
+            sidecar = path + '.gz'
+            if stat_key(sidecar) is not None:
+                with open(sidecar, 'rb') as f:
+                    return CacheEntry(f.read(), ctype, 'gzip', file_stat)
+        with open(path, 'rb') as f:
+            data = f.read()
+        if gzip_ok and compressible:
+            packed = gzip.compress(data, compresslevel=6, mtime=0)
+            if len(packed) < len(data):
+                return CacheEntry(packed, ctype, 'gzip', file_stat)
+        return CacheEntry(data, ctype, None, file_stat)
+
+    def static(self, url_path, gzip_ok):
+        resolved = self.resolve_path(url_path)
+        if resolved is None:
+            return None, None
+        rel, path = resolved
+        key = (rel, gzip_ok)
+        entry = self.cache.get(key)
+        if entry is not None and time.monotonic() - entry.checked > STAT_INTERVAL:
+            if stat_key(path) == entry.stat:
+                entry.checked = time.monotonic()
+            else:
+                self.cache.discard(key)
+                entry = None
+        if entry is None:
+            entry = self.load_file(path, gzip_ok)
+            if entry is None:
+                return None, None
+            self.cache.put(key, entry)
+        return entry, self.cache_control.get(rel, REVALIDATE)
+
+    def directory_location(self, url):
+        """Return the URL with a trailing slash if its path names a directory, else None."""
+        resolved = self.resolve_path(url.path)
+        if resolved is None or url.path.endswith('/') or not os.path.isdir(resolved[1]):
+            return None
+        return url.path + '/' + (f'?{url.query}' if url.query else '')
+
+    # JSON API
+
+    def api(self, url_path, query):
+        """Return a CacheEntry for an /api/ path, or None for 404."""
+        key = ('api', url_path, query)
+        entry = self.cache.get(key)
+        if entry is not None and time.monotonic() - entry.checked > STAT_INTERVAL:
+            # entry.stat holds (path, stat) of each chapter page it was built from
+            if all(stat_key(path) == file_stat for path, file_stat in entry.stat):
+                entry.checked = time.monotonic()
+            else:
+                self.cache.discard(key)
+                entry = None
+        if entry is not None:
+            return entry
+        parts = [unquote(part) for part in url_path.split('/')[2:] if part]
+        if parts == ['stats']:
+            # Never cached: it changes with every request
+            return CacheEntry(json.dumps(self.cache.stats()).encode(), 'application/json')
+        paths = []
+        if len(parts) == 3 and parts[0] == 'chapter' and parts[2].isdigit():
+            data = self.chapter_json(parts[1], int(parts[2]), paths)
+        elif parts == ['verses']:
+            data = self.verses_json(parse_qs(query).get('ref', [''])[0], paths)
+        else:
+            data = None
+        if data is None:
+            return None
+        entry = CacheEntry(json.dumps(data, ensure_ascii=False).encode('utf-8'),
+                           'application/json; charset=utf-8',
+                           stat=tuple((path, stat_key(path)) for path in paths))
+        self.cache.put(key, entry)
+        return entry
+
+    def chapter_json(self, book, chapter, paths):
+        """The chapter's verses; the page read is appended to paths."""
+        prefix = resolve_book(book)
+        path = self.chapters.get((BOOK_ORDINALS.get(prefix), chapter))
+        if path is None:
+            return None
+        paths.append(path)
+        info = BOOKS[BOOK_ORDINALS[prefix]]
+        return {'book': prefix, 'name': info[1], 'chapter': chapter, 'chapters': info[2],
+                'verses': [{'verse': v, 'text': text} for v, text in chapter_verses(path)]}
+
+    def verses_json(self, reference, paths):
+        """The verses of a reference; the pages read are appended to paths."""
+        try:
+            ranges = parse_reference(reference)
+        except ValueError:
+            return None
+        verses = []
+        for ref in ranges:
+            ordinal = BOOK_ORDINALS[ref.book]
+            for chapter in range(ref.start_chapter, ref.end_chapter + 1):
+                path = self.chapters.get((ordinal, chapter))
+                if path is None:
+                    continue
+                paths.append(path)
+                for verse, text in chapter_verses(path):
+                    if ref.start_verse is not None:
+                        if chapter == ref.start_chapter and verse < ref.start_verse:
+                            continue
+                        if chapter == ref.end_chapter and verse > ref.end_verse:
+                            continue
+                    verses.append({'book': ref.book, 'chapter': chapter, 'verse': verse, 'text': text})
+        return {'reference': reference, 'ranges': [format_range(ref) for ref in ranges],
+                'verses': verses}
+
+    # HTTP
+
+    def respond(self, method, target, headers):
+        """Return (status, [(header, value)], body) for a request."""
+        if method not in ('GET', 'HEAD'):
+            return 405, [('Allow', 'GET, HEAD')], b'Method not allowed\n'
+        url = urlsplit(target)
+        cache_control = 'no-cache'
+        if url.path.startswith('/api/'):
+            entry = self.api(url.path, url.query)
+        else:
+            entry, cache_control = self.static(url.path, accepts_gzip(headers.get('accept-encoding', '')))
+        if entry is None:
+            location = None if url.path.startswith('/api/') else self.directory_location(url)
+            if location:
+                return 301, [('Location', location)], b'Moved permanently\n'
+            return 404, [], b'Not found\n'
+
+        response_headers = [('ETag', entry.etag), ('Cache-Control', cache_control)]
+        if not url.path.startswith('/api/') and \
+                os.path.splitext(url.path)[1].lower() in COMPRESS_EXTENSIONS | {''}:
+            response_headers.append(('Vary', 'Accept-Encoding'))
+        if etag_matches(headers.get('if-none-match', ''), entry.etag):
+            return 304, response_headers, b''
+        response_headers.append(('Content-Type', entry.content_type))
+        if entry.encoding:
+            response_headers.append(('Content-Encoding', entry.encoding))
+        return 200, response_headers, entry.body
+
+    async def handle(self, reader, writer):
+        """Serve requests on one connection until it closes or idles out."""
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), IDLE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self.send(writer, 'HEAD', 400, [], b'Request header too large\n', False)
+                    return
+                lines = head.decode('latin-1').split('\r\n')
+                request_line = lines[0].split()
+                if len(request_line) != 3:
+                    await self.send(writer, 'GET', 400, [], b'Bad request\n', False)
+                    return
+                method, target, version = request_line
+                headers = {}
+                for line in lines[1:]:
+                    name, sep, value = line.partition(':')
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+                if headers.get('content-length', '0') != '0' or 'transfer-encoding' in headers:
+                    # GET/HEAD only: a request body means we can't find the next request
+                    keep_alive = False
+
+                start = time.perf_counter()
+                try:
+                    status, response_headers, body = self.respond(method, target, headers)
+                except Exception as e:
+                    print(f"Error handling {target}: {e}", file=sys.stderr)
+                    status, response_headers, body = 500, [], b'Internal server error\n'
+                await self.send(writer, method, status, response_headers, body, keep_alive)
+                if self.log:
+                    print(f"{method} {target} {status} {len(body)} "
+                          f"{(time.perf_counter() - start) * 1e6:.0f}us")
+                if not keep_alive:
+                    return
+        finally:
+            writer.close()
+
+    async def send(self, writer, method, status, headers, body, keep_alive):
+        lines = [f'HTTP/1.1 {status} {REASONS[status]}',
+                 f'Date: {formatdate(usegmt=True)}',
+                 f'Connection: {"keep-alive" if keep_alive else "close"}']
+        # A 304 has no body; a Content-Length would describe the full response
+        if status != 304:
+            lines.append(f'Content-Length: {len(body)}')
+        lines.extend(f'{name}: {value}' for name, value in headers)
+        if status != 304 and not any(name == 'Content-Type' for name, _ in headers):
+            lines.append('Content-Type: text/plain; charset=utf-8')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if method != 'HEAD' and status != 304:
+            writer.write(body)
+        await writer.drain()
+
+
+async def serve(root, host, port, cache_bytes, log=False):
+    site = SiteServer(root, cache_bytes, log)
+    server = await asyncio.start_server(site.handle, host, port, limit=MAX_HEADER_BYTES)
+    print(f"Serving {site.root} on http://{host}:{port}/ "
+          f"({len(site.chapters)} chapters, cache {cache_bytes // 2**20} MB)", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+# Load test
+
+async def fetch(reader, writer, host, path, etag=None):
+    """Send one keep-alive GET; return (status, etag, body bytes read)."""
+    request = (f'GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept-Encoding: gzip\r\n'
+               + (f'If-None-Match: {etag}\r\n' if etag else '') + '\r\n')
+    writer.write(request.encode('latin-1'))
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    length = 0
+    new_etag = None
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        name = name.lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'etag':
+            new_etag = value.strip()
+    if length:
+        await reader.readexactly(length)
+    return status, new_etag, len(head) + length
+
+
+async def load_client(host, port, paths, count, conditional, rng, results):
+    reader, writer = await asyncio.open_connection(host, port)
+    etags = {}
+    try:
+        for _ in range(count):
+            path = rng.choice(paths)
+            etag = etags.get(path) if rng.random() < conditional else None
+            start = time.perf_counter()
+            status, new_etag, size = await fetch(reader, writer, host, path, etag)
+            results.append((time.perf_counter() - start, status, size))
+            if new_etag:
+                etags[path] = new_etag
+    finally:
+        writer.close()
+
+
+async def warm_up(host, port, paths, clients):
+    """Request every path once (gzip, unconditional) to fill the server cache."""
+    async def client(chunk):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for path in chunk:
+                await fetch(reader, writer, host, path)
+        finally:
+            writer.close()
+    await asyncio.gather(*(client(paths[i::clients]) for i in range(clients)))
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def load_test(host, port, paths, clients, requests, conditional, seed):
+    """Run the load test; return (elapsed seconds, [(latency, status, bytes)])."""
+    results = []
+    per_client = [requests // clients + (i < requests % clients) for i in range(clients)]
+    start = time.perf_counter()
+    await asyncio.gather(*(load_client(host, port, paths, n, conditional, random.Random(seed + i), results)
+                           for i, n in enumerate(per_client) if n))
+    return time.perf_counter() - start, results
+
+
+def default_paths(root):
+    """A request mix of chapter pages, assets and API calls."""
+    books_dir = os.path.join(root, 'books')
+    paths = ['/books/' + os.path.basename(path) for _, _, path in find_chapter_files(books_dir)]
+    paths += ['/styles/styles.css', '/scripts/navigation.js', '/index.html']
+    paths += ['/api/chapter/Mark/15', '/api/chapter/Psalms/119', '/api/verses?ref=John+3:16',
+              '/api/verses?ref=Mark+15:25-32', '/api/verses?ref=Gen+1:1-2:3']
+    return paths
+
+
+def start_server_process(root, cache_mb):
+    """Start 'serve' on a free local port; return (process, port)."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'serve', '--root', root,
+                                '--port', str(port), '--cache-mb', str(cache_mb)],
+                               stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, port
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('server did not start')
+
+
+def get_json(host, port, path):
+    async def run():
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n'.encode())
+        data = await reader.read()
+        writer.close()
+        return json.loads(data.split(b'\r\n\r\n', 1)[1])
+    return asyncio.run(run())
+
+
+def run_bench(args):
+    process = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        process, port = start_server_process(args.root, args.cache_mb)
+        host = '127.0.0.1'
+    try:
+        paths = default_paths(args.root)
+        print(f"Load test: {args.requests} requests, {args.clients} connections, "
+              f"{len(paths)} paths, {args.conditional:.0%} conditional")
+        if args.warm:
+            asyncio.run(warm_up(host, port, paths, args.clients))
+        elapsed, results = asyncio.run(load_test(host, port, paths, args.clients, args.requests,
+                                                 args.conditional, args.seed))
+        stats = get_json(host, port, '/api/stats')
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    latencies = sorted(r[0] for r in results)
+    statuses = Counter(r[1] for r in results)
+    received = sum(r[2] for r in results)
+    print(f"  {len(results) / elapsed:,.0f} requests/s, {received / elapsed / 1e6:.1f} MB/s "
+          f"({len(results)} requests in {elapsed:.2f}s)")
+    print("  latency ms: " + ', '.join(f"{name} {percentile(latencies, q) * 1000:.2f}" for name, q in
+                                       (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))))
+    print("  status: " + ', '.join(f"{status} x{n}" for status, n in sorted(statuses.items())))
+    hit_rate = stats['hits'] / max(stats['hits'] + stats['misses'], 1)
+    print(f"  server cache: {stats['entries']} entries, {stats['bytes'] / 2**20:.1f} MB, "
+          f"hit rate {hit_rate:.1%}, {stats['evictions']} evictions")
+
+
+def main(argv=None):
+    books_dir = os.path.dirname(os.path.abspath(__file__))
+    site_dir = os.path.dirname(books_dir)
+
+    parser = argparse.ArgumentParser(description='Serve the site and the corpus API')
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('serve', 'run the server'), ('bench', 'load-test a server')):
+        command = sub.add_parser(name, help=help_text)
+        command.add_argument('--root', default=site_dir, help='site root (default: the repository)')
+        command.add_argument('--cache-mb', type=int, default=DEFAULT_CACHE_MB, help='response cache size')
+    serve_cmd = sub.choices['serve']
+    serve_cmd.add_argument('--host', default='127.0.0.1')
+    serve_cmd.add_argument('--port', type=int, default=8000)
+    serve_cmd.add_argument('--log', action='store_true', help='print a line per request')
+    bench = sub.choices['bench']
+    bench.add_argument('--url', help='server to test (default: start one on a free port)')
+    bench.add_argument('-c', '--clients', type=int, default=16, help='concurrent connections')
+    bench.add_argument('-n', '--requests', type=int, default=5000, help='total requests')
+    bench.add_argument('--conditional', type=float, default=0.3,
+                       help='fraction of repeat requests sent with If-None-Match')
+    bench.add_argument('--no-warm', dest='warm', action='store_false', help='skip the warm-up pass')
+    bench.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        try:
+            asyncio.run(serve(args.root, args.host, args.port, args.cache_mb * 2**20, args.log))
+        except KeyboardInterrupt:
+            pass
+    else:
+        run_bench(args)
+
+
+if __name__ == '__main__':
+    main()
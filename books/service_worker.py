@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Service worker for reading offline: writes sw.js at the site root.
+- The precache manifest lists the shared assets (stylesheet, scripts, the
+  woff font) with their content hashes; the worker's version is a hash
+  of the manifest, so any asset change installs a new worker, which
+  fetches them all at once and drops the old asset cache
+- Pages are cached as they are fetched, including the next chapter the
+  pages prefetch (add_navigation.py) and the parts of whole-book pages
+  (single_page.py), and served from the cache while a
+  fresh copy is fetched in the background, so a fixed page is picked up
+  on the next visit
+- With --per-book, opening a chapter also fills in the rest of its book
+- Storage is bounded: the page cache keeps at most one entry per chapter
+  and per chapter list, plus PAGE_SLACK other pages, dropping the least
+  recently fetched, so the whole Bible fits and nothing grows past it
+- navigation.js registers ../sw.js, so the worker's scope is the site;
+  precompress_assets.py regenerates it with the fingerprinted names
+
+Usage:
+  python service_worker.py [--per-book]
+"""
+
+import os
+import re
+import glob
+import json
+import hashlib
+import argparse
+
+from corpus import chapter_file_naming, find_chapter_files
+
+SW_NAME = 'sw.js'
+PRECACHE_PATTERNS = ['styles/*.css', 'scripts/*.js', 'styles/fonts/*.woff']
+PAGE_SLACK = 64
+HASH_LENGTH = 8
+
+_CONFIG_RE = re.compile(r'^const CONFIG = (.*);$', re.MULTILINE)
+
+WORKER_JS = r'''
+const ASSETS = 'web-assets-' + CONFIG.version;
+const PAGES = 'web-pages';
+const precached = new Set(CONFIG.precache.map(function(path) {
+  return new URL(path, self.location).href;
+}));
+const filled = new Set();
+
+self.addEventListener('install', function(event) {
+  event.waitUntil(caches.open(ASSETS).then(function(cache) {
+    return cache.addAll(CONFIG.precache);
+  }).then(function() {
+    return self.skipWaiting();
+  }));
+});
+
+self.addEventListener('activate', function(event) {
+  event.waitUntil(caches.keys().then(function(keys) {
+    return Promise.all(keys.filter(function(key) {
+      return key.startsWith('web-assets-') && key !== ASSETS;
+    }).map(function(key) {
+      return caches.delete(key);
+    }));
+  }).then(function() {
+    return self.clients.claim();
+  }));
+});
+
+// Drop the least recently stored pages beyond the limit
+function trimPages(cache) {
+  return cache.keys().then(function(keys) {
+    return Promise.all(keys.slice(0, Math.max(0, keys.length - CONFIG.maxPages)).map(function(key) {
+      return cache.delete(key);
+    }));
+  });
+}
+
+function storePage(cache, url, response) {
+  return cache.put(url, response).then(function() {
+    return trimPages(cache);
+  });
+}
+
+// Chapter filename -> the filenames of every chapter of its book
+const bookNames = new Map();
+CONFIG.books.forEach(function(book) {
+  const names = [];
+  for (let chapter = 1; chapter <= book[3]; chapter++) {
+    let num = String(chapter);
+    while (num.length < book[1]) num = '0' + num;
+    names.push((book[4] && book[4][chapter]) || book[0] + num + book[2]);
+  }
+  names.forEach(function(name) {
+    bookNames.set(name, names);
+  });
+});
+
+// The chapters of the book a page belongs to, as URLs
+function bookChapters(url) {
+  const name = url.pathname.slice(url.pathname.lastIndexOf('/') + 1);
+  return (bookNames.get(name) || []).map(function(chapterName) {
+    return new URL(chapterName, url).href;
+  });
+}
+
+function fillBook(cache, url) {
+  const urls = bookChapters(url);
+  if (!urls.length || filled.has(urls[0])) return Promise.resolve();
+  filled.add(urls[0]);
+  return urls.reduce(function(done, chapterUrl) {
+    return done.then(function() {
+      return cache.match(chapterUrl);
+    }).then(function(cached) {
+      if (cached) return;
+      return fetch(chapterUrl).then(function(response) {
+        if (response.ok) return storePage(cache, chapterUrl, response);
+      });
+    });
+  }, Promise.resolve()).catch(function() {
+    filled.delete(urls[0]);
+  });
+}
+
+// Cached copy first; the network refreshes the cache behind it
+function pageResponse(event, url) {
+  return caches.open(PAGES).then(function(cache) {
+    return cache.match(url.href).then(function(cached) {
+      const network = fetch(event.request).then(function(response) {
+        if (response.ok && response.type === 'basic') {
+          const copy = response.clone();
+          event.waitUntil(storePage(cache, url.href, copy).then(function() {
+            return CONFIG.perBook ? fillBook(cache, url) : null;
+          }));
+        }
+        return response;
+      });
+      if (!cached) return network;
+      event.waitUntil(network.catch(function() {}));
+      return cached;
+    });
+  });
+}
+
+self.addEventListener('fetch', function(event) {
+  const request = event.request;
+  if (request.method !== 'GET') return;
+  const url = new URL(request.url);
+  if (url.origin !== self.location.origin) return;
+  url.hash = '';
+  if (precached.has(url.href)) {
+    event.respondWith(caches.match(url.href, {cacheName: ASSETS}).then(function(cached) {
+      return cached || fetch(request);
+    }));
+  } else if (/\.(html?|part)$/.test(url.pathname) && !url.search) {
+    event.respondWith(pageResponse(event, url));
+  }
+});
+'''
+
+
+def precache_assets(site_dir):
+    """Return {site-relative path: content hash} for the assets the worker installs with."""
+    assets = {}
+    for pattern in PRECACHE_PATTERNS:
+        for path in sorted(glob.glob(os.path.join(site_dir, pattern))):
+            with open(path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()[:HASH_LENGTH]
+            assets[os.path.relpath(path, site_dir).replace(os.sep, '/')] = digest
+    return assets
+
+
+def book_entries(books_dir):
+    """Return ([[filename prefix, chapter digits, extension, chapters]], page bytes) for books_dir.
+
+    An entry is followed by {chapter: filename} when some of its chapters
+    are kept under a legacy name.
+    """
+    books = {}
+    total = 0
+    for ordinal, chapter, path in find_chapter_files(books_dir):
+        total += os.path.getsize(path)
+        prefix, digits, ext, filename = chapter_file_naming(ordinal, path)
+        if ordinal not in books:
+            books[ordinal] = [prefix, digits, ext, 0]
+        books[ordinal][3] = max(books[ordinal][3], chapter)
+        if filename:
+            if len(books[ordinal]) == 4:
+                books[ordinal].append({})
+            books[ordinal][4][chapter] = filename
+    return [books[ordinal] for ordinal in sorted(books)], total
+
+
+def read_config(path):
+    """Return the CONFIG of a written sw.js, or None."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            match = _CONFIG_RE.search(f.read())
+    except FileNotFoundError:
+        return None
+    return json.loads(match.group(1)) if match else None
+
+
+def make_config(site_dir, per_book=False):
+    """Return (worker CONFIG, bytes of chapter pages it may cache)."""
+    assets = precache_assets(site_dir)
+    books, page_bytes = book_entries(os.path.join(site_dir, 'books'))
+    config = {
+        'precache': sorted(assets),
+        'books': books,
+        'maxPages': sum(book[3] for book in books) + len(books) + PAGE_SLACK,
+        'perBook': per_book,
+    }
+    # The worker code is part of the version, so changing it reinstalls too
+    versioned = json.dumps([assets, config, WORKER_JS], sort_keys=True).encode('utf-8')
+    config['version'] = hashlib.sha256(versioned).hexdigest()[:HASH_LENGTH]
+    return config, page_bytes
+
+
+def render_service_worker(config):
+    return ('// Generated by books/service_worker.py - do not edit\n'
+            "'use strict';\n"
+            f'const CONFIG = {json.dumps(config, separators=(",", ":"))};\n'
+            + WORKER_JS)
+
+
+def write_service_worker(site_dir, per_book=None):
+    """Write site_dir/sw.js; per_book=None keeps the setting of the existing one.
+
+    Returns (config, bytes of chapter pages it may cache).
+    """
+    path = os.path.join(site_dir, SW_NAME)
+    if per_book is None:
+        previous = read_config(path)
+        per_book = bool(previous and previous.get('perBook'))
+    config, page_bytes = make_config(site_dir, per_book)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(render_service_worker(config))
+    os.replace(tmp_path, path)
+    return config, page_bytes
+
+
+def print_summary(path, config, page_bytes):
+    print(f"Wrote {path} (version {config['version']}): {len(config['precache'])} assets precached, "
+          f"pages cached {'per book' if config['perBook'] else 'on demand'}, "
+          f"at most {config['maxPages']:,} pages (the chapters are {page_bytes:,} bytes)")
+
+
+def main(argv=None):
+    site_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    parser = argparse.ArgumentParser(description='Write the offline service worker')
+    parser.add_argument('--site', default=site_dir, help='site root (default: the parent of books/)')
+    parser.add_argument('--per-book', action='store_true',
+                        help='cache the whole book when one of its chapters is opened')
+    args = parser.parse_args(argv)
+
+    config, page_bytes = write_service_worker(args.site, args.per_book)
+    print_summary(os.path.join(args.site, SW_NAME), config, page_bytes)
+
+
+if __name__ == '__main__':
+    main()
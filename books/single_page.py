@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Render a whole book, or the whole Bible, as one page.
+- Streams the <main> content and footnotes of each chapter page, in
+  canonical order, into one document with a single header and contents
+  list: one chapter is in memory at a time (one section with --sections)
+- Ids become chapter-qualified (v3 in Psalms023.htm becomes
+  Psalms023-v3, FN1 becomes Psalms023-FN1) and so do the links to them,
+  including links to other chapters of the document (Psalms024.htm#v1
+  becomes #Psalms024-v1); links to pages outside it are left alone
+- --sections splits the chapters after the first SECTION_BYTES into
+  .part files beside the page. The page holds a placeholder per part,
+  sized from its bytes and listing its chapters, and navigation.js loads
+  a part as it nears the viewport or when a link points into it, so a
+  large book like Psalms opens after its first section. A verse link
+  from one part into another goes to the chapter's own page instead
+- Writes BOOK.complete.htm (bible.complete.htm for --bible) next to the
+  chapter pages, so the chapter pages' relative links keep working
+
+Usage:
+  python single_page.py Psalms [Proverbs ...] [--sections] [--section-bytes N]
+  python single_page.py --bible [--sections]
+"""
+
+import os
+import re
+import html
+import glob
+import argparse
+from collections import namedtuple
+
+from add_navigation import BOOKS, extract_page_parts
+from corpus import BOOK_ORDINALS, find_chapter_files
+
+BIBLE_NAME = 'bible'
+SUFFIX = '.complete'
+PART_EXTENSION = '.part'
+SECTION_BYTES = 128 * 1024
+# Rough rendered height of page bytes, for the placeholders of unloaded parts
+BYTES_PER_EM = 70
+
+_ID_RE = re.compile(r'\bid="([^"]+)"')
+_HREF_RE = re.compile(r'\bhref="([^"#]*)(?:#([^"]*))?"')
+
+# stem: the chapter page name without extension, also the chapter's id
+Chapter = namedtuple('Chapter', 'ordinal chapter path stem section')
+
+
+def plan_sections(chapters, section_bytes=None):
+    """Return [Chapter] with each chapter's section: 0 inline, then one per part.
+
+    Sections are planned in a first pass over the pages, so links can
+    tell whether their target is in the same section.
+    """
+    planned = []
+    section = size = 0
+    for ordinal, chapter, path in chapters:
+        page_size = 0
+        if section_bytes:
+            with open(path, 'r', encoding='utf-8') as f:
+                parts = extract_page_parts(f.read())
+            page_size = sum(len(part.encode('utf-8')) for part in parts) if parts else 0
+        if section_bytes and size and size + page_size > section_bytes:
+            section += 1
+            size = 0
+        size += page_size
+        stem = os.path.splitext(os.path.basename(path))[0]
+        planned.append(Chapter(ordinal, chapter, path, stem, section))
+    return planned
+
+
+def make_link_rewriter(chapters):
+    """Compile a function rewriting the ids and links of one chapter's markup."""
+    by_name = {os.path.basename(chapter.path): chapter for chapter in chapters}
+
+    def rewrite(text, chapter):
+        def replace_href(match):
+            name, fragment = match.group(1), match.group(2)
+            target = chapter if not name else by_name.get(name)
+            if target is None:
+                return match.group(0)
+            if not fragment:
+                return f'href="#{target.stem}"'
+            if target.section != chapter.section and target.section:
+                # The id is in a part that may not be loaded: use the chapter page
+                return f'href="{os.path.basename(target.path)}#{fragment}"'
+            return f'href="#{target.stem}-{fragment}"'
+
+        text = _ID_RE.sub(lambda match: f'id="{chapter.stem}-{match.group(1)}"', text)
+        return _HREF_RE.sub(replace_href, text)
+
+    return rewrite
+
+
+def render_chapter(chapter, rewrite):
+    """Return one chapter's section of the document."""
+    with open(chapter.path, 'r', encoding='utf-8') as f:
+        parts = extract_page_parts(f.read())
+    main_content, footnote_content = parts if parts else ('', '')
+    footnotes = f'\n{rewrite(footnote_content, chapter)}' if footnote_content else ''
+    return (f'<section class="chapter-section" id="{chapter.stem}">\n'
+            f'{rewrite(main_content, chapter)}{footnotes}\n'
+            f'</section>\n')
+
+
+def chapter_label(chapter):
+    return f'{BOOKS[chapter.ordinal][1]} {chapter.chapter}'
+
+
+def render_book_title(ordinal, chapters):
+    """Return the heading and chapter list that open a book on a page of several books."""
+    links = '\n'.join(f'  <a href="#{chapter.stem}">{chapter.chapter}</a>' for chapter in chapters)
+    return (f'<h2 class="book-title">{html.escape(BOOKS[ordinal][1])}</h2>\n'
+            f'<nav class="book-contents">\n{links}\n</nav>\n')
+
+
+def render_placeholder(section, part_name, size):
+    """Return the stand-in for an unloaded part: its chapters link to their own pages."""
+    stems = ' '.join(chapter.stem for chapter in section)
+    links = '\n'.join(f'  <a id="{chapter.stem}" href="{os.path.basename(chapter.path)}">'
+                      f'{html.escape(chapter_label(chapter))}</a>' for chapter in section)
+    return (f'<div class="lazy-section" data-src="{part_name}" data-chapters="{stems}" '
+            f'style="min-height: {size // BYTES_PER_EM}em">\n{links}\n</div>\n')
+
+
+def render_header(title, books, chapters, is_bible, by_book):
+    """Return the top of the document: head, navigation and the contents list."""
+    if by_book:
+        # A book is reached through its first chapter, whose id a placeholder also carries
+        firsts = {}
+        for chapter in chapters:
+            firsts.setdefault(chapter.ordinal, chapter.stem)
+        names = [(stem, html.escape(BOOKS[ordinal][1])) for ordinal, stem in firsts.items()]
+        contents = '\n'.join(f'      <a href="#{stem}">{name}</a>' for stem, name in names)
+        options = '\n'.join(f'        <option value="#{stem}">{name}</option>' for stem, name in names)
+        crumb = ''
+    else:
+        contents = '\n'.join(f'      <a href="#{chapter.stem}">{chapter.chapter}</a>' for chapter in chapters)
+        options = '\n'.join(f'        <option value="#{chapter.stem}">Chapter {chapter.chapter}</option>'
+                            for chapter in chapters)
+        crumb = f'''
+      <span class="separator">&rsaquo;</span>
+      <a href="{books[0]}{os.path.splitext(chapters[0].path)[1]}">{html.escape(title)}</a>'''
+    return f'''<!DOCTYPE html>
+<html lang="en">
+<head>
+  <meta charset="UTF-8">
+  <meta name="viewport" content="width=device-width, initial-scale=1.0">
+  <meta name="description" content="{html.escape(title)} - World English Bible">
+  <title>World English Bible - {html.escape(title)}</title>
+  <link rel="stylesheet" href="../styles/styles.css">
+</head>
+<body>
+  <div class="page-wrapper">
+    <div class="content-wrapper">
+  <div class="top-nav">
+    <nav class="breadcrumb">
+      <a href="../index.htm">Home</a>{crumb}
+      <span class="separator">&rsaquo;</span>
+      <span class="current">{'Whole Bible' if is_bible else 'Whole book'}</span>
+    </nav>
+
+    <div class="chapter-nav">
+      <select aria-label="Go to">
+{options}
+      </select>
+    </div>
+  </div>
+      <main class="main single-page">
+    <h1>{html.escape(title)}</h1>
+    <nav class="book-contents">
+{contents}
+    </nav>
+'''
+
+
+FOOTER = '''      </main>
+
+      <footer class="copyright">
+        <p><a href="https://eBible.org/">eBible.org</a> | <a href="webfaq.htm">FAQ</a> | Public Domain</p>
+      </footer>
+    </div>
+  </div>
+  <script src="../scripts/navigation.js"></script>
+</body>
+</html>
+'''
+
+
+def write_single_page(books_dir, prefixes=None, section_bytes=None):
+    """Write one page for the books with the given prefixes, or for the whole Bible.
+
+    Returns (page path, [part paths], chapters written).
+    """
+    is_bible = prefixes is None
+    wanted = None if is_bible else {BOOK_ORDINALS[prefix] for prefix in prefixes}
+    found = [entry for entry in find_chapter_files(books_dir) if wanted is None or entry[0] in wanted]
+    if not found:
+        raise ValueError('no chapter pages found')
+    chapters = plan_sections(found, section_bytes)
+    books = []
+    for chapter in chapters:
+        if not books or books[-1] != BOOKS[chapter.ordinal][0]:
+            books.append(BOOKS[chapter.ordinal][0])
+
+    ext = os.path.splitext(chapters[0].path)[1]
+    name = BIBLE_NAME if is_bible else '_'.join(books)
+    title = 'The Holy Bible' if is_bible else ', '.join(BOOKS[BOOK_ORDINALS[prefix]][1] for prefix in books)
+    path = os.path.join(books_dir, f'{name}{SUFFIX}{ext}')
+    rewrite = make_link_rewriter(chapters)
+    # Several books get a heading each and a contents list of books
+    by_book = is_bible or len(books) > 1
+    parts = []
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as page:
+        page.write(render_header(title, books, chapters, is_bible, by_book))
+        section = []
+        section_out = None
+        book = None
+
+        def close_section():
+            part_name = os.path.basename(parts[-1])
+            section_out.close()
+            page.write(render_placeholder(section, part_name, os.path.getsize(parts[-1])))
+
+        for chapter in chapters:
+            if chapter.section and (not section or section[-1].section != chapter.section):
+                if section_out is not None:
+                    close_section()
+                parts.append(f'{path[:-len(ext)]}.{chapter.section}{PART_EXTENSION}')
+                section_out = open(parts[-1], 'w', encoding='utf-8')
+                section = []
+            out = section_out if chapter.section else page
+            if by_book and chapter.ordinal != book:
+                book = chapter.ordinal
+                out.write(render_book_title(book, [c for c in chapters if c.ordinal == book]))
+            out.write(render_chapter(chapter, rewrite))
+            if chapter.section:
+                section.append(chapter)
+        if section_out is not None:
+            close_section()
+        page.write(FOOTER)
+    os.replace(tmp_path, path)
+
+    # Parts left by an earlier run with more sections
+    for old in glob.glob(f'{glob.escape(path[:-len(ext)])}.*{PART_EXTENSION}'):
+        if old not in parts:
+            os.remove(old)
+    return path, parts, len(chapters)
+
+
+def main(argv=None):
+    books_dir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description='Render a whole book, or the Bible, as one page')
+    parser.add_argument('books', nargs='*', help="book filename prefixes, e.g. Psalms 1_Kings")
+    parser.add_argument('--bible', action='store_true', help='render the whole Bible')
+    parser.add_argument('--each', action='store_true', help='write one page per book rather than one for all')
+    parser.add_argument('--sections', action='store_true',
+                        help='put the chapters after the first section in parts loaded by navigation.js')
+    parser.add_argument('--section-bytes', type=int, default=SECTION_BYTES,
+                        help=f'page bytes per section with --sections (default: {SECTION_BYTES})')
+    parser.add_argument('--books-dir', default=books_dir, help='directory of the chapter pages')
+    args = parser.parse_args(argv)
+
+    if args.bible == bool(args.books):
+        parser.error('name one or more books, or use --bible')
+    unknown = [prefix for prefix in args.books if prefix not in BOOK_ORDINALS]
+    if unknown:
+        parser.error(f"unknown book: {', '.join(unknown)} (use filename prefixes such as Song_of_Solomon)")
+
+    groups = [None] if args.bible else [[prefix] for prefix in args.books] if args.each else [args.books]
+    for prefixes in groups:
+        try:
+            path, parts, count = write_single_page(args.books_dir, prefixes,
+                                                   args.section_bytes if args.sections else None)
+        except ValueError as e:
+            parser.error(f"{' '.join(prefixes or ['--bible'])}: {e}")
+        print(f"Wrote {path}: {count} chapters, {os.path.getsize(path):,} bytes"
+              + (f" plus {len(parts)} parts ({sum(os.path.getsize(p) for p in parts):,} bytes)"
+                 if parts else ''))
+
+
+if __name__ == '__main__':
+    main()
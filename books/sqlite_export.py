@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+Export the cleaned chapters to an SQLite database.
+- Tables: books, chapters, verses, footnotes (the entries clean_footnotes
+  writes, plus notemarks whose entry is missing, from their title),
+  headings (ms section headings) and wj (words of Jesus spans)
+- A verse's id encodes its reference as book * 1000000 + chapter * 1000
+  + verse, so a lookup or a range is a rowid range scan
+- verses_fts is an FTS5 index over the verse texts (external content)
+- Pages are parsed in a worker pool (-j); rows are loaded with batched
+  executemany in a single transaction, with journaling and syncing off.
+  The database is built under a temporary name and swapped in when done
+
+Usage:
+  python sqlite_export.py build [-j N]
+  python sqlite_export.py get 'John 3:16-18'
+  python sqlite_export.py search 'shepherd NOT sheep'
+  python sqlite_export.py bench
+"""
+
+import os
+import re
+import html
+import time
+import random
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from add_navigation import BOOKS
+from corpus import extract_main, find_chapter_files, format_reference
+from modernize_bible import get_attr, iter_html_events
+from references import parse_reference
+
+DATABASE_NAME = 'bible.sqlite'
+SCHEMA_VERSION = 1
+
+BATCH_SIZE = 5000
+
+# Speed over durability while loading: a failed build only leaves the
+# temporary file behind
+LOAD_PRAGMAS = [
+    'PRAGMA journal_mode = OFF',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA locking_mode = EXCLUSIVE',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -65536',
+]
+
+READ_PRAGMAS = [
+    'PRAGMA query_only = ON',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA cache_size = -16384',
+]
+
+SCHEMA = f'''
+PRAGMA user_version = {SCHEMA_VERSION};
+CREATE TABLE books (
+    id INTEGER PRIMARY KEY,
+    prefix TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    testament TEXT NOT NULL,
+    chapters INTEGER NOT NULL
+);
+CREATE TABLE chapters (
+    id INTEGER PRIMARY KEY,         -- book * 1000 + chapter
+    book_id INTEGER NOT NULL REFERENCES books(id),
+    chapter INTEGER NOT NULL,
+    verses INTEGER NOT NULL
+);
+CREATE TABLE verses (
+    id INTEGER PRIMARY KEY,         -- book * 1000000 + chapter * 1000 + verse
+    book_id INTEGER NOT NULL REFERENCES books(id),
+    chapter INTEGER NOT NULL,
+    verse INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE TABLE footnotes (
+    id INTEGER PRIMARY KEY,
+    verse_id INTEGER NOT NULL,
+    note TEXT NOT NULL,             -- the page's footnote id, e.g. FN1
+    marker TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE TABLE headings (
+    id INTEGER PRIMARY KEY,
+    chapter_id INTEGER NOT NULL REFERENCES chapters(id),
+    verse INTEGER,                  -- the verse it comes before
+    class TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE TABLE wj (
+    id INTEGER PRIMARY KEY,
+    verse_id INTEGER NOT NULL,
+    start INTEGER,                  -- character offset in verses.text
+    text TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE verses_fts USING fts5(
+    text, content='verses', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+'''
+
+# Built after the rows are in, which is faster than keeping them up to date
+INDEXES = '''
+CREATE INDEX footnotes_verse ON footnotes(verse_id);
+CREATE INDEX headings_chapter ON headings(chapter_id);
+CREATE INDEX wj_verse ON wj(verse_id);
+INSERT INTO verses_fts(verses_fts) VALUES ('rebuild');
+INSERT INTO verses_fts(verses_fts) VALUES ('optimize');
+'''
+
+INSERTS = {
+    'chapters': 'INSERT INTO chapters VALUES (?, ?, ?, ?)',
+    'verses': 'INSERT INTO verses VALUES (?, ?, ?, ?, ?)',
+    'footnotes': 'INSERT INTO footnotes (verse_id, note, marker, text) VALUES (?, ?, ?, ?)',
+    'headings': 'INSERT INTO headings (chapter_id, verse, class, text) VALUES (?, ?, ?, ?)',
+    'wj': 'INSERT INTO wj (verse_id, start, text) VALUES (?, ?, ?)',
+}
+
+_VERSE_ID_RE = re.compile(r'v(\d+)')
+_HEADING_CLASS_RE = re.compile(r'ms\d?')
+_FOOTER_RE = re.compile(r'<footer class="footnote">(.*?)</footer>', re.DOTALL)
+_FOOTNOTE_RE = re.compile(r'<p class="f" id="(FN\d+)"><span class="notemark">([^<]*)</span>\s*'
+                          r'<a class="notebackref" href="#v(\d+)">[^<]*</a>(.*?)</p>', re.DOTALL)
+_TAG_RE = re.compile(r'<[^>]*>')
+
+
+def verse_id(book_id, chapter, verse):
+    return (book_id * 1000 + chapter) * 1000 + verse
+
+
+def normalize(text):
+    """Decode entities and collapse whitespace, as corpus.parse_verses does."""
+    return ' '.join(html.unescape(text).split())
+
+
+def parse_chapter(main_html):
+    """Split cleaned main content into verses, headings, notemarks and wj spans.
+
+    Returns (verses, headings, notemarks, wj): [(verse, text)],
+    [(next verse, class, text)], [(verse, note id, marker, title)] and
+    [(verse, text)]. Verse texts match corpus.parse_verses.
+    """
+    verses = []
+    headings = []
+    notemarks = []
+    wj = []
+    parts = None
+    current = 0
+    in_paragraph = False
+    skip_until = None       # end tag that closes a verse number or notemark
+    notemark = None         # [verse, id, title, marker parts] while inside one
+    heading = None          # [class, parts] while inside an ms heading
+    wj_parts = None         # text of the open wj span
+    wj_depth = 0            # spans open inside it
+
+    for kind, tag, attrs, raw in iter_html_events(main_html):
+        if skip_until:
+            if kind == 'end' and tag == skip_until:
+                skip_until = None
+                if notemark is not None:
+                    notemarks.append((notemark[0], notemark[1], ''.join(notemark[3]).strip(),
+                                      notemark[2]))
+                    notemark = None
+            elif kind == 'text' and notemark is not None:
+                notemark[3].append(raw)
+            continue
+
+        if kind == 'text':
+            if heading is not None:
+                heading[1].append(raw)
+            if in_paragraph and parts is not None:
+                parts.append(raw)
+                if wj_parts is not None:
+                    wj_parts.append(raw)
+        elif kind == 'start':
+            css = get_attr(attrs, 'class')
+            if tag == 'p':
+                in_paragraph = True
+                if parts is not None:
+                    parts.append(' ')
+            elif tag == 'span' and css == 'verse':
+                match = _VERSE_ID_RE.fullmatch(get_attr(attrs, 'id') or '')
+                if match:
+                    current = int(match.group(1))
+                    parts = []
+                    verses.append((current, parts))
+                skip_until = 'span'
+            elif tag == 'a' and css == 'notemark':
+                href = get_attr(attrs, 'href') or ''
+                notemark = [current, href.lstrip('#'), html.unescape(get_attr(attrs, 'title') or '').strip(), []]
+                skip_until = 'a'
+            elif tag == 'span' and css == 'wj' and wj_parts is None:
+                wj_parts = []
+                wj.append((current, wj_parts))
+            elif tag == 'span' and wj_parts is not None:
+                wj_depth += 1
+            elif css and _HEADING_CLASS_RE.fullmatch(css):
+                heading = [css, []]
+                headings.append((len(verses), heading))
+        else:
+            if tag == 'p':
+                in_paragraph = False
+            elif tag == 'span' and wj_parts is not None:
+                if wj_depth:
+                    wj_depth -= 1
+                else:
+                    wj_parts = None
+            elif heading is not None and tag in ('div', 'p', 'h1', 'h2', 'h3', 'h4'):
+                heading = None
+
+    verse_numbers = [verse for verse, _ in verses]
+    return ([(verse, normalize(''.join(parts))) for verse, parts in verses],
+            [(verse_numbers[index] if index < len(verse_numbers) else None, css, normalize(''.join(text)))
+             for index, (css, text) in headings],
+            notemarks,
+            [(verse, normalize(''.join(text))) for verse, text in wj if normalize(''.join(text))])
+
+
+def parse_footnotes(page_html):
+    """Return {note id: (verse, marker, text)} from the page's footnote footer."""
+    footer = _FOOTER_RE.search(page_html)
+    if not footer:
+        return {}
+    return {note: (int(verse), marker, normalize(_TAG_RE.sub('', text)))
+            for note, marker, verse, text in _FOOTNOTE_RE.findall(footer.group(1))}
+
+
+def chapter_rows(task):
+    """Parse one chapter page into rows for every table but books."""
+    book_id, chapter, path = task
+    with open(path, 'r', encoding='utf-8') as f:
+        page_html = f.read()
+    verses, headings, notemarks, wj = parse_chapter(extract_main(page_html))
+    chapter_id = book_id * 1000 + chapter
+    texts = dict(verses)
+
+    rows = {
+        'chapters': [(chapter_id, book_id, chapter, max(texts, default=0))],
+        'verses': [(verse_id(book_id, chapter, verse), book_id, chapter, verse, text)
+                   for verse, text in verses],
+        'headings': [(chapter_id, verse, css, text) for verse, css, text in headings],
+        'footnotes': [],
+        'wj': [],
+    }
+
+    # Footer entries first; a notemark whose entry is missing still has its title
+    footnotes = parse_footnotes(page_html)
+    for verse, note, marker, title in notemarks:
+        if note not in footnotes and title:
+            footnotes[note] = (verse, marker, normalize(title))
+    for note, (verse, marker, text) in sorted(footnotes.items(), key=lambda item: int(item[0][2:])):
+        rows['footnotes'].append((verse_id(book_id, chapter, verse), note, marker, text))
+
+    # Offsets of the spans in the verse text, searched left to right
+    cursor = {}
+    for verse, text in wj:
+        verse_text = texts.get(verse, '')
+        start = verse_text.find(text, cursor.get(verse, 0))
+        if start >= 0:
+            cursor[verse] = start + len(text)
+        rows['wj'].append((verse_id(book_id, chapter, verse), start if start >= 0 else None, text))
+    return rows
+
+
+def iter_chapter_rows(books_dir, jobs=1):
+    """Yield the rows of each chapter in canonical order."""
+    tasks = [(ordinal + 1, chapter, path) for ordinal, chapter, path in find_chapter_files(books_dir)]
+    if jobs <= 1:
+        for task in tasks:
+            yield chapter_rows(task)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(chapter_rows, tasks, chunksize=16)
+
+
+def build_database(books_dir, path, jobs=1, batch_size=BATCH_SIZE):
+    """Load every chapter in books_dir into a new database at path.
+
+    Returns ({table: rows}, {step: seconds}).
+    """
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    counts = dict.fromkeys(['books'] + list(INSERTS), 0)
+    timings = {}
+
+    started = time.perf_counter()
+    conn = sqlite3.connect(tmp_path, isolation_level=None)
+    try:
+        for pragma in LOAD_PRAGMAS:
+            conn.execute(pragma)
+        conn.executescript(SCHEMA)
+
+        conn.execute('BEGIN')
+        conn.executemany('INSERT INTO books VALUES (?, ?, ?, ?, ?)',
+                         [(i + 1, book[0], book[1], book[3], book[2]) for i, book in enumerate(BOOKS)])
+        counts['books'] = len(BOOKS)
+
+        pending = {table: [] for table in INSERTS}
+
+        def flush(table):
+            conn.executemany(INSERTS[table], pending[table])
+            counts[table] += len(pending[table])
+            pending[table] = []
+
+        for rows in iter_chapter_rows(books_dir, jobs):
+            for table, table_rows in rows.items():
+                pending[table].extend(table_rows)
+                if len(pending[table]) >= batch_size:
+                    flush(table)
+        for table in INSERTS:
+            flush(table)
+        conn.execute('COMMIT')
+        timings['load'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        conn.executescript(f'BEGIN;\n{INDEXES}\nCOMMIT;')
+        conn.execute('ANALYZE')
+        timings['index'] = time.perf_counter() - started
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+    return counts, timings
+
+
+class BibleDatabase:
+    """Read-only queries on a database written by build_database."""
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} does not exist; run 'sqlite_export.py build' first")
+        self.conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        for pragma in READ_PRAGMAS:
+            self.conn.execute(pragma)
+        self.book_ids = {prefix: book_id for book_id, prefix in self.conn.execute('SELECT id, prefix FROM books')}
+
+    def get_range(self, book, chapter, first_verse=None, last_verse=None, last_chapter=None):
+        """Return [(chapter, verse, text)] from chapter:first_verse to last_chapter:last_verse."""
+        book_id = self.book_ids[book]
+        start = verse_id(book_id, chapter, first_verse or 0)
+        end = verse_id(book_id, last_chapter or chapter, last_verse if last_verse is not None else 999)
+        return self.conn.execute('SELECT chapter, verse, text FROM verses WHERE id BETWEEN ? AND ?',
+                                 (start, end)).fetchall()
+
+    def lookup(self, reference):
+        """Look up 'Mark 15:28', 'Mk 15:25-32', 'Gen 1:1-2:3', 'Ps 23' or 'Ps 2:7; Mark 15:34'.
+
+        Returns [(book prefix, chapter, verse, text)]: a reference may span books.
+        """
+        result = []
+        for ref in parse_reference(reference):
+            result.extend((ref.book,) + row for row in
+                          self.get_range(ref.book, ref.start_chapter, ref.start_verse,
+                                         ref.end_verse, ref.end_chapter))
+        return result
+
+    def search(self, query, limit=10):
+        """Return [(book_id, chapter, verse, snippet)] for an FTS5 query, best first."""
+        return self.conn.execute(
+            '''SELECT v.book_id, v.chapter, v.verse, snippet(verses_fts, 0, '[', ']', '...', 12)
+               FROM verses_fts JOIN verses v ON v.id = verses_fts.rowid
+               WHERE verses_fts MATCH ? ORDER BY rank LIMIT ?''', (query, limit)).fetchall()
+
+    def footnotes(self, book, chapter, verse):
+        """Return [(marker, text)] for the footnotes on one verse."""
+        return self.conn.execute('SELECT marker, text FROM footnotes WHERE verse_id = ?',
+                                 (verse_id(self.book_ids[book], chapter, verse),)).fetchall()
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def bench(db, count=2000, seed=1):
+    """Time verse lookups and full-text queries; print p50 / p99 in microseconds."""
+    rng = random.Random(seed)
+    refs = db.conn.execute('SELECT book_id, chapter, verse FROM verses').fetchall()
+    prefixes = {book_id: prefix for prefix, book_id in db.book_ids.items()}
+    names = dict(db.conn.execute('SELECT id, name FROM books'))
+    sample = db.conn.execute('SELECT text FROM verses WHERE id % 97 = 0').fetchall()
+    words = [word for (text,) in sample for word in re.findall(r'[A-Za-z]{4,}', text)]
+
+    def by_id():
+        book_id, chapter, verse = rng.choice(refs)
+        db.get_range(prefixes[book_id], chapter, verse, verse)
+
+    def by_reference():
+        book_id, chapter, verse = rng.choice(refs)
+        db.lookup(f'{names[book_id]} {chapter}:{verse}')
+
+    def full_text():
+        db.search(rng.choice(words))
+
+    def phrase():
+        db.search('"{} {}"'.format(*rng.sample(words, 2)))
+
+    cases = {
+        'verse by id': by_id,
+        'verse by reference': by_reference,
+        'full-text, top 10': full_text,
+        'full-text phrase': phrase,
+    }
+    print(f"{'Query':20s} {'p50 us':>8s} {'p99 us':>8s}")
+    for name, run in cases.items():
+        samples = []
+        for _ in range(count):
+            started = time.perf_counter()
+            run()
+            samples.append((time.perf_counter() - started) * 1e6)
+        print(f"{name:20s} {percentile(samples, 0.5):8.0f} {percentile(samples, 0.99):8.0f}")
+
+
+def main(argv=None):
+    books_dir = os.path.dirname(os.path.abspath(__file__))
+    default_db = os.path.join(books_dir, DATABASE_NAME)
+
+    parser = argparse.ArgumentParser(description='Export the chapters to SQLite')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help='load the chapter pages into a new database')
+    build.add_argument('--out', default=default_db, help='database file to write')
+    build.add_argument('-j', '--jobs', type=int, default=1,
+                       help='number of worker processes parsing pages (0 = one per CPU)')
+    get = sub.add_parser('get', help='print a verse or range with its footnotes')
+    get.add_argument('reference', nargs='+', help="e.g. 'Mark 15:25-32'")
+    search = sub.add_parser('search', help='run an FTS5 query')
+    search.add_argument('query', nargs='+', help="e.g. 'shepherd NOT sheep' or '\"my shepherd\"'")
+    search.add_argument('--limit', type=int, default=10)
+    timing = sub.add_parser('bench', help='time lookups and full-text queries')
+    timing.add_argument('--count', type=int, default=2000, help='queries per case')
+    for command in (get, search, timing):
+        command.add_argument('--db', default=default_db, help='database file to read')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        counts, timings = build_database(books_dir, args.out, args.jobs or os.cpu_count() or 1)
+        print(', '.join(f"{count:,} {table}" for table, count in counts.items()))
+        print(f"Loaded in {timings['load']:.2f}s, indexed in {timings['index']:.2f}s")
+        print(f"Wrote {args.out} ({os.path.getsize(args.out):,} bytes)")
+        return
+
+    db = BibleDatabase(args.db)
+    if args.command == 'bench':
+        bench(db, args.count)
+        return
+
+    started = time.perf_counter()
+    if args.command == 'get':
+        reference = ' '.join(args.reference)
+        try:
+            rows = db.lookup(reference)
+        except ValueError as e:
+            parser.error(str(e))
+        elapsed = time.perf_counter() - started
+        for book, chapter, verse, text in rows:
+            print(f"{format_reference(db.book_ids[book] - 1, chapter, verse)} {text}")
+            for marker, note in db.footnotes(book, chapter, verse):
+                print(f"    {marker} {note}")
+        print(f"({len(rows)} verses in {elapsed * 1e6:.0f} us)")
+    else:
+        try:
+            rows = db.search(' '.join(args.query), args.limit)
+        except sqlite3.OperationalError as e:
+            # An FTS5 syntax error, e.g. an unbalanced quote: "don't"
+            parser.error(f'{e}; put terms with punctuation in double quotes')
+        elapsed = time.perf_counter() - started
+        for book_id, chapter, verse, snippet in rows:
+            print(f"{format_reference(book_id - 1, chapter, verse)}: {snippet}")
+        print(f"({len(rows)} results in {elapsed * 1e6:.0f} us)")
+
+
+if __name__ == '__main__':
+    main()
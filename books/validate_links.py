@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Check every link in the site against the files and ids that exist.
+- Pages (.htm / .html) are scanned in parallel; each worker returns the
+  ids and the href / src targets of its pages
+- One index of every file and every id (vN, FNn, ...) is built from the
+  results, then every link is resolved against it in a single pass
+- Dangling links are reported by target: missing files, missing anchors,
+  and targets that only exist with the other extension (.htm links to
+  .html files) or in another case (Job01 links to JOB01)
+- Anchors no link points at are reported too. Verse ids (vN, and
+  Psalms023-vN on whole-book pages) are deep link targets for other
+  sites and ids named in scripts/ or styles/ are used by code, so
+  neither counts as unused
+- Exits with status 1 when there are dangling links, so it can run after
+  every build
+
+Usage:
+  python validate_links.py [SITE_DIR] [-j N] [--examples N] [--list-unused]
+"""
+
+import os
+import re
+import sys
+import html
+import time
+import argparse
+import posixpath
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+SITE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PAGE_EXTENSIONS = ('.htm', '.html')
+CODE_EXTENSIONS = ('.js', '.css')
+SKIP_DIRS = {'.git', '__pycache__', 'node_modules'}
+
+# Ids that are link targets by design rather than by a link in the site
+DEFAULT_KEEP = r'(?:\w+-)?v\d+'
+
+_ATTR_RE = re.compile(r"""\s(href|src|id)\s*=\s*(?:"([^"]*)"|'([^']*)')""", re.IGNORECASE)
+_EXTERNAL_RE = re.compile(r'^(?:[a-z][a-z0-9+.-]*:|//)', re.IGNORECASE)
+_WORD_RE = re.compile(r'[A-Za-z_][\w-]*')
+_FAMILY_RE = re.compile(r'^\D*')
+
+DANGLING_KINDS = {
+    'file': 'missing file',
+    'extension': 'wrong extension',
+    'case': 'wrong case',
+    'anchor': 'missing anchor',
+}
+
+
+def walk_site(site_dir):
+    """Return the relative paths (with /) of every file under site_dir."""
+    paths = []
+    for root, dirs, files in os.walk(site_dir):
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS and not d.startswith('.'))
+        rel_root = os.path.relpath(root, site_dir).replace(os.sep, '/')
+        for name in sorted(files):
+            paths.append(name if rel_root == '.' else f'{rel_root}/{name}')
+    return paths
+
+
+def scan_page(site_dir, relpath):
+    """Return (relpath, ids, {link: count}) for one page."""
+    with open(os.path.join(site_dir, relpath), 'r', encoding='utf-8-sig', errors='replace') as f:
+        content = f.read()
+    ids = []
+    links = Counter()
+    for match in _ATTR_RE.finditer(content):
+        value = match.group(2) if match.group(2) is not None else match.group(3)
+        if match.group(1).lower() == 'id':
+            ids.append(value)
+        else:
+            links[value] += 1
+    return relpath, ids, dict(links)
+
+
+def scan_pages(site_dir, chunk):
+    return [scan_page(site_dir, relpath) for relpath in chunk]
+
+
+def scan_site(site_dir, pages, jobs=1):
+    """Scan pages, in a pool of worker processes when jobs > 1."""
+    if jobs <= 1:
+        return scan_pages(site_dir, pages)
+    # A few chunks per worker keeps the pool busy without a task per page
+    size = max(1, len(pages) // (jobs * 4) + 1)
+    chunks = [pages[i:i + size] for i in range(0, len(pages), size)]
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for scanned in pool.map(scan_pages, [site_dir] * len(chunks), chunks):
+            results.extend(scanned)
+    return results
+
+
+def code_words(site_dir, files):
+    """Return every identifier-like word in the site's scripts and stylesheets."""
+    words = set()
+    for relpath in files:
+        if relpath.endswith(CODE_EXTENSIONS):
+            with open(os.path.join(site_dir, relpath), 'r', encoding='utf-8', errors='replace') as f:
+                words.update(_WORD_RE.findall(f.read()))
+    return words
+
+
+class SiteIndex:
+    """Every file in the site and every id in its pages."""
+
+    def __init__(self, files, scanned):
+        self.files = set(files)
+        self.ids = {}
+        self.duplicates = {}
+        for relpath, ids, _ in scanned:
+            unique = set(ids)
+            self.ids[relpath] = unique
+            if len(unique) != len(ids):
+                self.duplicates[relpath] = sorted(i for i, n in Counter(ids).items() if n > 1)
+        # Links to a directory get its index page
+        self.dir_pages = {}
+        for name in ('index.htm', 'index.html'):
+            for path in self.files:
+                if posixpath.basename(path) == name:
+                    self.dir_pages[posixpath.dirname(path) or '.'] = path
+        # For the hints: the same path in lower case, and without extension
+        self.lower = {path.lower(): path for path in self.files}
+        self.stems = {}
+        for path in self.files:
+            stem, ext = posixpath.splitext(path)
+            if ext in PAGE_EXTENSIONS:
+                self.stems.setdefault(stem.lower(), path)
+
+    def find_alternative(self, path):
+        """Return (kind, existing path) for a missing page that exists in another form."""
+        stem, ext = posixpath.splitext(path)
+        if ext in PAGE_EXTENSIONS:
+            other = stem + ('.html' if ext == '.htm' else '.htm')
+            if other in self.files:
+                return 'extension', other
+        if path.lower() in self.lower:
+            return 'case', self.lower[path.lower()]
+        if ext in PAGE_EXTENSIONS and stem.lower() in self.stems:
+            return 'extension', self.stems[stem.lower()]
+        return 'file', None
+
+
+def resolve_link(source, link):
+    """Return (target path, fragment) for a link on page source, or None to skip it.
+
+    External links, javascript: and bare '#' placeholders are skipped.
+    """
+    link = html.unescape(link).strip()
+    if not link or link == '#' or _EXTERNAL_RE.match(link):
+        return None
+    parts = urlsplit(link)
+    if not parts.path:
+        return source, unquote(parts.fragment)
+    path = posixpath.normpath(posixpath.join(posixpath.dirname(source), unquote(parts.path)))
+    return path, unquote(parts.fragment)
+
+
+def check_links(index, scanned):
+    """Resolve every link once.
+
+    Returns (links checked, {(kind, target, hint): [source pages]},
+    {page: ids that links point at}).
+    """
+    checked = 0
+    dangling = defaultdict(list)
+    targeted = defaultdict(set)
+    alternatives = {}
+    # Pages in one directory share most of their links (the sidebar), so
+    # each (directory, link) pair is resolved once
+    resolved_links = {}
+    for source, _, links in scanned:
+        directory = posixpath.dirname(source)
+        for link, count in links.items():
+            if link.startswith('#'):
+                resolved = resolve_link(source, link)
+            else:
+                key = (directory, link)
+                if key not in resolved_links:
+                    resolved_links[key] = resolve_link(source, link)
+                resolved = resolved_links[key]
+            if resolved is None:
+                continue
+            checked += count
+            path, fragment = resolved
+            path = index.dir_pages.get(path, path)
+            if path not in index.files:
+                if path not in alternatives:
+                    alternatives[path] = index.find_alternative(path)
+                kind, hint = alternatives[path]
+                dangling[(kind, path, hint)].append(source)
+                continue
+            if not fragment or path not in index.ids:
+                continue
+            targeted[path].add(fragment)
+            if fragment not in index.ids[path]:
+                dangling[('anchor', f'{path}#{fragment}', None)].append(source)
+    return checked, dangling, targeted
+
+
+def find_unused(index, targeted, keep_re, words):
+    """Return {page: [ids]} for ids no link targets and no code names."""
+    unused = {}
+    for path, ids in index.ids.items():
+        used = targeted.get(path, ())
+        names = sorted(i for i in ids
+                       if i not in used and i not in words and not keep_re.fullmatch(i))
+        if names:
+            unused[path] = names
+    return unused
+
+
+def validate(site_dir, jobs=1, keep=DEFAULT_KEEP):
+    """Scan and check the whole site; return a report dict."""
+    timings = {}
+    started = time.perf_counter()
+    files = walk_site(site_dir)
+    pages = [path for path in files if path.endswith(PAGE_EXTENSIONS)]
+    scanned = scan_site(site_dir, pages, jobs)
+    timings['scan'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index = SiteIndex(files, scanned)
+    words = code_words(site_dir, files)
+    timings['index'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    checked, dangling, targeted = check_links(index, scanned)
+    unused = find_unused(index, targeted, re.compile(keep), words)
+    timings['resolve'] = time.perf_counter() - started
+
+    return {
+        'pages': len(pages),
+        'files': len(files),
+        'ids': sum(len(ids) for ids in index.ids.values()),
+        'links': checked,
+        'dangling': dangling,
+        'unused': unused,
+        'duplicates': index.duplicates,
+        'timings': timings,
+    }
+
+
+def print_report(report, examples=10, list_unused=False):
+    timings = report['timings']
+    print(f"Checked {report['links']:,} links in {report['pages']:,} pages "
+          f"against {report['files']:,} files and {report['ids']:,} ids "
+          f"(scan {timings['scan']:.2f}s, index {timings['index']:.2f}s, "
+          f"resolve {timings['resolve']:.2f}s)")
+
+    dangling = report['dangling']
+    by_kind = defaultdict(list)
+    for key, sources in dangling.items():
+        by_kind[key[0]].append((key, sources))
+    for kind, label in DANGLING_KINDS.items():
+        entries = sorted(by_kind.get(kind, ()), key=lambda entry: (-len(entry[1]), entry[0][1]))
+        if not entries:
+            continue
+        links = sum(len(sources) for _, sources in entries)
+        print(f"\n{label}: {len(entries):,} targets, {links:,} links")
+        for (_, target, hint), sources in entries[:examples]:
+            hint = f" (exists as {hint})" if hint else ''
+            print(f"  {target}{hint} <- {sources[0]}"
+                  + (f" and {len(sources) - 1:,} more" if len(sources) > 1 else ''))
+        if len(entries) > examples:
+            print(f"  ... {len(entries) - examples:,} more")
+
+    unused = report['unused']
+    if unused:
+        families = Counter(_FAMILY_RE.match(name).group(0) or '(digits)'
+                           for names in unused.values() for name in names)
+        print(f"\nUnused anchors: {sum(families.values()):,} in {len(unused):,} pages ("
+              + ', '.join(f"{family}: {count:,}" for family, count in families.most_common()) + ')')
+        shown = sorted(unused.items()) if list_unused else sorted(unused.items())[:examples]
+        for path, names in shown:
+            print(f"  {path}: {', '.join(names)}")
+        if len(unused) > len(shown):
+            print(f"  ... {len(unused) - len(shown):,} more pages (--list-unused)")
+
+    duplicates = report['duplicates']
+    if duplicates:
+        print(f"\nDuplicate ids in {len(duplicates):,} pages")
+        for path, names in sorted(duplicates.items())[:examples]:
+            print(f"  {path}: {', '.join(names)}")
+
+    if not dangling:
+        print("\nNo dangling links")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check every link in the site')
+    parser.add_argument('site_dir', nargs='?', default=SITE_DIR,
+                        help='site root (default: the repository root)')
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+                        help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--examples', type=int, default=10, help='entries listed per problem')
+    parser.add_argument('--list-unused', action='store_true', help='list every page with unused anchors')
+    parser.add_argument('--keep', default=DEFAULT_KEEP,
+                        help=f'ids that are never reported as unused (regex, default: {DEFAULT_KEEP})')
+    args = parser.parse_args(argv)
+    jobs = args.jobs or os.cpu_count() or 1
+
+    report = validate(os.path.abspath(args.site_dir), jobs, args.keep)
+    print_report(report, args.examples, args.list_unused)
+    return 1 if report['dangling'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
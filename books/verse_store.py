@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Compact binary verse store with constant-time reference lookup.
+- Packs every verse text into one UTF-8 blob, in canonical book order
+- Indexes it with offset arrays keyed by (book ordinal from BOOKS,
+  chapter, verse): two array lookups find any verse
+- Memory-maps the file and slices the blob without copying, so a reader
+  costs a few MB of address space and no parsing
+
+Usage:
+  python verse_store.py build
+  python verse_store.py get 'Mark 15:28'
+  python verse_store.py get 'Mark 15:25-32'
+"""
+
+import os
+import time
+import argparse
+from array import array
+
+from add_navigation import BOOKS, get_book_info
+from corpus import BOOK_ORDINALS, iter_verses
+from packed_arrays import PackedFile, write_packed
+from references import parse_reference
+
+STORE_NAME = 'verses.bin'
+MAGIC = b'WEBVRS01'
+
+# Header counts: books, verses
+SECTIONS = [
+    ('book_start', 'I'),     # first chapter slot of each book, plus end
+    ('chapter_start', 'I'),  # first verse slot of each chapter slot, plus end
+    ('verse_offsets', 'I'),  # byte offset of each verse slot in text, plus end
+    ('text', 'B'),           # UTF-8 verse texts, back to back
+]
+
+# Chapter and verse slots start at 0, so slot = start + number. Slots for
+# numbers that don't occur (chapter 0, verse 0, omitted verses) are empty.
+
+# Book names accepted by the reader: filename prefix, display name and
+# lower-case forms of both
+BOOK_NAMES = {}
+for _ordinal, _book in enumerate(BOOKS):
+    for _name in (_book[0], _book[1]):
+        BOOK_NAMES[_name] = _ordinal
+        BOOK_NAMES[_name.lower()] = _ordinal
+
+
+def build_store(books_dir, path):
+    """Pack every verse in books_dir into a store at path."""
+    chapters = {}   # (ordinal, chapter) -> {verse: text}
+    for ordinal, chapter, verse, text in iter_verses(books_dir):
+        chapters.setdefault((ordinal, chapter), {})[verse] = text
+
+    book_start = array('I')
+    chapter_start = array('I')
+    verse_offsets = array('I')
+    text = bytearray()
+    verse_count = 0
+
+    for ordinal, book in enumerate(BOOKS):
+        book_start.append(len(chapter_start))
+        for chapter in range(book[2] + 1):
+            chapter_start.append(len(verse_offsets))
+            verses = chapters.get((ordinal, chapter), {})
+            for verse in range(max(verses, default=-1) + 1):
+                verse_offsets.append(len(text))
+                if verse in verses:
+                    text += verses[verse].encode('utf-8')
+                    verse_count += 1
+    book_start.append(len(chapter_start))
+    chapter_start.append(len(verse_offsets))
+    verse_offsets.append(len(text))
+
+    arrays = {
+        'book_start': book_start,
+        'chapter_start': chapter_start,
+        'verse_offsets': verse_offsets,
+        'text': array('B', text),
+    }
+    write_packed(path, MAGIC, (len(BOOKS), verse_count), SECTIONS, arrays)
+    return verse_count
+
+
+def book_ordinal(book):
+    """Resolve a book ordinal, filename prefix or display name to an ordinal."""
+    if isinstance(book, int):
+        if not 0 <= book < len(BOOKS):
+            raise KeyError(book)
+        return book
+    ordinal = BOOK_NAMES.get(book, BOOK_NAMES.get(book.lower()))
+    if ordinal is None:
+        info = get_book_info(book.replace(' ', '_'))
+        if info is None:
+            raise KeyError(book)
+        ordinal = BOOK_ORDINALS[info[0]]
+    return ordinal
+
+
+class VerseStore(PackedFile):
+    """A memory-mapped verse store written by build_store."""
+
+    def __init__(self, path):
+        super().__init__(path, MAGIC, SECTIONS, 2)
+        self.book_count, self.verse_count = self.counts
+
+    def _chapter_slot(self, ordinal, chapter):
+        """Return the chapter slot, or None if the book has no such chapter."""
+        start = self.book_start[ordinal]
+        if not 0 < chapter < self.book_start[ordinal + 1] - start:
+            return None
+        return start + chapter
+
+    def verse_count_of(self, book, chapter):
+        """Return the highest verse number in a chapter (0 if none)."""
+        slot = self._chapter_slot(book_ordinal(book), chapter)
+        if slot is None:
+            return 0
+        return max(self.chapter_start[slot + 1] - self.chapter_start[slot] - 1, 0)
+
+    def get_bytes(self, book, chapter, verse):
+        """Return a zero-copy memoryview of a verse's UTF-8 text, or None."""
+        slot = self._chapter_slot(book_ordinal(book), chapter)
+        if slot is None:
+            return None
+        start, end = self.chapter_start[slot], self.chapter_start[slot + 1]
+        if not 0 < verse < end - start:
+            return None
+        i = start + verse
+        return self.text[self.verse_offsets[i]:self.verse_offsets[i + 1]]
+
+    def get(self, book, chapter, verse):
+        """Return the text of one verse, e.g. get('Mark', 15, 28), or None."""
+        data = self.get_bytes(book, chapter, verse)
+        if data is None or not len(data):
+            return None
+        return str(data, 'utf-8')
+
+    def get_range(self, book, chapter, first_verse, last_verse=None, last_chapter=None):
+        """Return [(chapter, verse, text)] for a verse range within one book.
+
+        The range runs from chapter:first_verse to last_chapter:last_verse
+        (last_chapter defaults to chapter; last_verse to the end of it).
+        Verses missing from the text are skipped.
+        """
+        ordinal = book_ordinal(book)
+        last_chapter = last_chapter or chapter
+        result = []
+        for ch in range(chapter, last_chapter + 1):
+            count = self.verse_count_of(ordinal, ch)
+            start = first_verse if ch == chapter else 1
+            end = last_verse if ch == last_chapter and last_verse is not None else count
+            for verse in range(start, min(end, count) + 1):
+                text = self.get(ordinal, ch, verse)
+                if text is not None:
+                    result.append((ch, verse, text))
+        return result
+
+    def lookup(self, reference):
+        """Look up 'Mark 15:28', 'Mk 15:25-32', 'Gen 1:1-2:3', 'Ps 23' or 'Ps 1:1, 3'."""
+        result = []
+        for ref in parse_reference(reference):
+            result.extend(self.get_range(ref.book, ref.start_chapter, ref.start_verse or 1,
+                                         ref.end_verse, ref.end_chapter))
+        return result
+
+
+def main(argv=None):
+    books_dir = os.path.dirname(os.path.abspath(__file__))
+    default_store = os.path.join(books_dir, STORE_NAME)
+
+    parser = argparse.ArgumentParser(description='Compact binary verse store')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help='pack the chapter pages into a verse store')
+    build.add_argument('--out', default=default_store, help='store file to write')
+    get = sub.add_parser('get', help='print a verse or range')
+    get.add_argument('--store', default=default_store, help='store file to read')
+    get.add_argument('reference', nargs='+', help="e.g. 'Mark 15:25-32'")
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        count = build_store(books_dir, args.out)
+        elapsed = time.perf_counter() - start
+        print(f"Packed {count} verses in {elapsed:.2f}s")
+        print(f"Wrote {args.out} ({os.path.getsize(args.out):,} bytes)")
+        return
+
+    store = VerseStore(args.store)
+    start = time.perf_counter()
+    try:
+        verses = store.lookup(' '.join(args.reference))
+    except ValueError as e:
+        parser.error(str(e))
+    elapsed = time.perf_counter() - start
+    for chapter, verse, text in verses:
+        print(f"{chapter}:{verse} {text}")
+    print(f"({len(verses)} verses in {elapsed * 1e6:.0f} us)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Rebuild pages as they are edited.
+- Watches a books directory for *.htm changes: inotify on Linux when
+  available (through ctypes), otherwise polling the mtime and size of
+  every page
+- A burst of changes (an editor saving several files, a git checkout) is
+  collected until the directory has been quiet for the debounce window,
+  then built as one batch
+- Only the changed pages go through the pipeline, plus the pages whose
+  navigation depends on them: when a chapter file appears or disappears
+  the book table is reloaded, and the pages of every book whose entry
+  changed are rebuilt (every page when the sidebar changed, unless the
+  sidebar comes from the shared scripts/books.js, which is rewritten)
+- Pages go to a worker pool that stays up between batches (-j), so a
+  batch does not pay for starting processes and imports
+- Our own writes are recognized through the build manifest and ignored
+
+Usage:
+  python watch.py [BOOKS_DIR] [--stages navigation] [-j N] [--debounce MS] [--poll]
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from add_navigation import split_chapter_stem
+from book_tables import load_book_table
+from pipeline import BOOKS_DIR, Translation, build, check_stages, iter_documents
+
+WATCH_EXTENSION = '.htm'
+
+# Milliseconds
+DEBOUNCE = 50
+POLL_INTERVAL = 100
+
+# inotify(7)
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct('iIII')
+
+
+def snapshot(books_dir):
+    """Return {name: (mtime_ns, size)} for the watched files in books_dir."""
+    state = {}
+    with os.scandir(books_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(WATCH_EXTENSION):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                state[entry.name] = (st.st_mtime_ns, st.st_size)
+    return state
+
+
+class PollingWatcher:
+    """Finds changes by comparing snapshots of the directory."""
+
+    name = 'polling'
+
+    def __init__(self, books_dir, interval=POLL_INTERVAL):
+        self.books_dir = books_dir
+        self.interval = interval / 1000
+        self.state = snapshot(books_dir)
+
+    def wait(self, timeout=None):
+        """Return the names that changed, waiting up to timeout seconds (None: until one does)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            state = snapshot(self.books_dir)
+            changed = {name for name in state.keys() | self.state.keys()
+                       if state.get(name) != self.state.get(name)}
+            self.state = state
+            if changed:
+                return changed
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return set()
+                time.sleep(min(self.interval, left))
+            else:
+                time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Linux inotify through ctypes; raises OSError where it is not available."""
+
+    name = 'inotify'
+    MASK = IN_CLOSE_WRITE | IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, books_dir):
+        import ctypes
+        import ctypes.util
+
+        self.books_dir = books_dir
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+        except (OSError, AttributeError):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if add_watch(self.fd, os.fsencode(books_dir), self.MASK) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f'cannot watch {books_dir}')
+
+    def wait(self, timeout=None):
+        """Return the names that changed, waiting up to timeout seconds (None: until one does)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changed = set()
+        # Events for other files (our own .tmp writes, the manifest) are
+        # read and dropped, and the wait goes on until a page changes
+        while not changed:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if not select.select([self.fd], [], [], remaining)[0]:
+                break
+            self.read_events(changed)
+        return changed
+
+    def read_events(self, changed):
+        """Add the watched names of the pending events to changed."""
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(data):
+                _, mask, _, length = _EVENT.unpack_from(data, pos)
+                pos += _EVENT.size
+                name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+                pos += length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost: report every page
+                    changed.update(snapshot(self.books_dir))
+                elif name.endswith(WATCH_EXTENSION):
+                    changed.add(name)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(books_dir, poll=False, interval=POLL_INTERVAL):
+    """Return an inotify watcher, or a polling one when asked to or inotify is unavailable."""
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(books_dir)
+        except OSError:
+            pass
+    return PollingWatcher(books_dir, interval)
+
+
+def collect_batch(watcher, debounce=DEBOUNCE):
+    """Wait for a change, then keep collecting until debounce ms pass without one.
+
+    Returns (names, monotonic time of the first change).
+    """
+    names = watcher.wait()
+    first = time.monotonic()
+    while True:
+        more = watcher.wait(debounce / 1000)
+        if not more:
+            return names, first
+        names |= more
+
+
+def book_pages(sources, prefixes, table):
+    """Return the sources whose output is a chapter of one of the given books."""
+    found = []
+    for path, name in sources:
+        stem = name[:-len(WATCH_EXTENSION)]
+        parsed = split_chapter_stem(stem, table)
+        # Chapter list pages (Mark.htm) belong to their book too
+        book = parsed[1] if parsed else table.get_book_info(stem)
+        if book is not None and book[0] in prefixes:
+            found.append((path, name))
+    return found
+
+
+def dependent_sources(translation, old_table):
+    """Return the sources to rebuild after the book table changed, or None for all of them."""
+    table = translation.table
+    sidebar = [(book[0], book[1], book[3]) for book in table.books]
+    if sidebar != [(book[0], book[1], book[3]) for book in old_table.books] and not translation.shared_nav:
+        return None
+    changed = {book[0] for book in table.books
+               if old_table.get_book_info(book[0]) != book
+               or old_table.chapter_width(book[0]) != table.chapter_width(book[0])}
+    return book_pages(translation.sources(), changed, table)
+
+
+class Watch:
+    """A watched translation directory and the pool its batches run on."""
+
+    def __init__(self, books_dir, stages, jobs=1, shared_nav=False):
+        self.books_dir = os.path.abspath(books_dir)
+        self.stages = stages
+        self.jobs = jobs
+        self.shared_nav = shared_nav
+        self.translation = Translation(self.books_dir, stages, shared_nav=shared_nav)
+        self.files = set(snapshot(self.books_dir))
+        self.written_at = None
+        self.pool = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+        if self.pool is not None:
+            # Start the workers now, so the first batch finds them warm
+            list(self.pool.map(abs, range(jobs)))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def reload(self):
+        """Reload the book table; when it changed, return the sources that depend on it."""
+        old = self.translation
+        if load_book_table(self.books_dir) == old.table:
+            return []
+        # A new Translation gets the new table, its manifest fingerprint
+        # and, with --shared-nav, the new scripts/books.js
+        self.translation = Translation(self.books_dir, self.stages, shared_nav=self.shared_nav)
+        dependents = dependent_sources(self.translation, old.table)
+        return self.translation.sources() if dependents is None else dependents
+
+    def rebuild(self, names):
+        """Build the changed pages and their dependents.
+
+        Returns (names of the pages built, pages written).
+        """
+        files = set(snapshot(self.books_dir))
+        sources = self.translation.sources([os.path.join(self.books_dir, name)
+                                            for name in names if name in files])
+        # Only a page that appeared or disappeared can change the book table
+        if files != self.files:
+            sources += self.reload()
+        self.files = files
+        translation = self.translation
+        todo = translation.plan(sorted(set(sources)))
+        updated = translation.updated
+        tasks = [(path, name, translation.options) for path, name in todo]
+        for (path, _, _), doc in iter_documents(tasks, self.stages, self.jobs, pool=self.pool):
+            translation.write(path, doc)
+        self.written_at = time.monotonic()
+        written = translation.updated - updated
+        if written:
+            # The manifest is in the watched directory: leave it alone when idle
+            translation.manifest.save()
+        return [name for _, name in todo], written
+
+    def run(self, debounce=DEBOUNCE, poll=False, interval=POLL_INTERVAL, max_batches=None):
+        watcher = make_watcher(self.books_dir, poll, interval)
+        print(f"Watching {self.books_dir} ({watcher.name}, {debounce} ms debounce, "
+              f"{self.jobs} worker{'s' if self.jobs > 1 else ''}); Ctrl-C to stop")
+        batches = 0
+        try:
+            while max_batches is None or batches < max_batches:
+                names, first = collect_batch(watcher, debounce)
+                if not names:
+                    continue
+                built, written = self.rebuild(names)
+                batches += 1
+                if not built:
+                    continue
+                elapsed = (self.written_at - first) * 1000
+                shown = ', '.join(built[:5]) + (f" and {len(built) - 5} more" if len(built) > 5 else '')
+                print(f"{time.strftime('%H:%M:%S')} rebuilt {len(built)} pages ({written} written), "
+                      f"done {elapsed:.0f} ms after the first change: {shown}")
+        except KeyboardInterrupt:
+            print()
+        finally:
+            watcher.close()
+
+
+def run_watch(books_dir, stages, jobs=1, shared_nav=False, debounce=DEBOUNCE, poll=False,
+              interval=POLL_INTERVAL):
+    """Rebuild pages of books_dir as they change, until interrupted."""
+    session = Watch(books_dir, stages, jobs, shared_nav)
+    try:
+        session.run(debounce, poll, interval)
+    finally:
+        session.close()
+
+
+def watch_from_args(args, books_dir, stages, jobs=1, shared_nav=False):
+    """run_watch with the options add_watch_arguments added."""
+    print()
+    run_watch(books_dir, stages, jobs, shared_nav, args.debounce, args.poll, args.interval)
+
+
+def add_watch_arguments(parser):
+    """Add the options that tune watch mode to a build script's parser."""
+    parser.add_argument('--debounce', type=int, default=DEBOUNCE,
+                        help=f'quiet time in ms that ends a batch of changes in watch mode '
+                             f'(default: {DEBOUNCE})')
+    parser.add_argument('--poll', action='store_true',
+                        help='in watch mode, poll file mtimes and sizes instead of using inotify')
+    parser.add_argument('--interval', type=int, default=POLL_INTERVAL,
+                        help=f'polling interval in ms (default: {POLL_INTERVAL})')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuild pages as they are edited')
+    parser.add_argument('books_dir', nargs='?', default=BOOKS_DIR, help='books/ directory to watch')
+    parser.add_argument('--stages', default='navigation',
+                        help='comma-separated pipeline stages (default: navigation)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes kept warm (0 = one per CPU)')
+    parser.add_argument('--shared-nav', action='store_true', help='as in add_navigation.py')
+    add_watch_arguments(parser)
+    args = parser.parse_args(argv)
+    stages = [name.strip() for name in args.stages.split(',') if name.strip()]
+    try:
+        check_stages(stages)
+        load_book_table(args.books_dir)
+    except ValueError as e:
+        parser.error(str(e))
+    jobs = args.jobs or os.cpu_count() or 1
+    # Bring the directory up to date first
+    build(args.books_dir, stages, jobs, shared_nav=args.shared_nav)
+    watch_from_args(args, args.books_dir, stages, jobs, args.shared_nav)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,77 @@
 (function() {
   'use strict';
 
+  // The search index (search_shards.py) lives in search/ next to this
+  // script, and the service worker (service_worker.py) at the site root
+  const scriptBase = document.currentScript && document.currentScript.src
+    ? document.currentScript.src : null;
+  const searchBase = scriptBase ? new URL('search/', scriptBase) : null;
+  const SEARCH_LIMIT = 50;
+
+  // Pad a chapter number to the width used in filenames
+  function chapterFile(prefix, chapter, width, ext) {
+    let num = String(chapter);
+    while (num.length < width) num = '0' + num;
+    return prefix + num + ext;
+  }
+
+  // Build the sidebar and chapter dropdown from the shared book table
+  // (scripts/books.js) on pages generated with --shared-nav
+  function initSharedNav() {
+    const data = window.WEB_NAV;
+    const sidebar = document.querySelector('.sidebar[data-book]');
+    if (!data || !sidebar) return;
+
+    const currentBook = sidebar.getAttribute('data-book');
+    let book = null;
+
+    data.sections.forEach(function(section) {
+      const details = document.createElement('details');
+      details.className = 'sidebar-section';
+      if (section[2]) details.setAttribute('open', '');
+
+      const summary = document.createElement('summary');
+      summary.textContent = section[1];
+      details.appendChild(summary);
+
+      const list = document.createElement('ul');
+      data.books.forEach(function(entry) {
+        if (entry[3] !== section[0]) return;
+        const item = document.createElement('li');
+        const link = document.createElement('a');
+        link.href = chapterFile(entry[0], 1, 2, data.ext);
+        link.textContent = entry[1];
+        if (entry[0] === currentBook) {
+          link.className = 'active';
+          book = entry;
+        }
+        item.appendChild(link);
+        list.appendChild(item);
+      });
+      details.appendChild(list);
+      sidebar.appendChild(details);
+    });
+
+    const fallback = sidebar.querySelector('.sidebar-fallback');
+    if (fallback) fallback.remove();
+
+    const chapterNav = document.querySelector('.chapter-nav[data-prefix]');
+    if (!chapterNav || !book) return;
+
+    const prefix = chapterNav.getAttribute('data-prefix');
+    const current = chapterNav.getAttribute('data-chapter');
+    const select = document.createElement('select');
+    select.setAttribute('aria-label', 'Select chapter');
+    for (let i = 1; i <= book[2]; i++) {
+      const option = document.createElement('option');
+      option.value = chapterFile(prefix, i, book[4], data.ext);
+      option.textContent = 'Chapter ' + i;
+      if (String(i) === current) option.selected = true;
+      select.appendChild(option);
+    }
+    chapterNav.replaceChildren(select);
+  }
+
   // Sidebar toggle functionality
   function initSidebar() {
     const menuToggle = document.querySelector('.menu-toggle');
@@ -88,6 +159,255 @@
     });
   }
 
+  // Client-side search: index.json names the shards, and a query fetches
+  // only the shards holding its words. Fetched shards are kept.
+  let searchIndex = null;
+  const searchShards = {};
+
+  function fetchSearchFile(name) {
+    return fetch(new URL(name, searchBase)).then(function(response) {
+      if (!response.ok) throw new Error(name + ': ' + response.status);
+      return response.json();
+    });
+  }
+
+  function loadSearchIndex() {
+    if (!searchIndex) {
+      searchIndex = fetchSearchFile('index.json').catch(function(error) {
+        searchIndex = null;
+        throw error;
+      });
+    }
+    return searchIndex;
+  }
+
+  function loadShard(name) {
+    if (!searchShards[name]) {
+      searchShards[name] = fetchSearchFile(name).catch(function(error) {
+        delete searchShards[name];
+        throw error;
+      });
+    }
+    return searchShards[name];
+  }
+
+  // Same tokens as search_index.tokenize
+  function tokenize(text) {
+    return text.toLowerCase().replace(/\u2019/g, "'")
+      .match(/[\p{L}\p{N}_]+(?:'[\p{L}\p{N}_]+)*/gu) || [];
+  }
+
+  // The shard holding a term: the last one starting at or before it
+  function shardFor(index, term) {
+    let lo = 0;
+    let hi = index.shards.length - 1;
+    while (lo < hi) {
+      const mid = (lo + hi + 1) >> 1;
+      if (index.shards[mid][0] <= term) lo = mid; else hi = mid - 1;
+    }
+    return index.shards[lo][1];
+  }
+
+  // Posting lists are delta-encoded verse keys; a 0 delta repeats a verse
+  function decodePostings(deltas) {
+    const counts = new Map();
+    let key = 0;
+    deltas.forEach(function(delta) {
+      key += delta;
+      counts.set(key, (counts.get(key) || 0) + 1);
+    });
+    return counts;
+  }
+
+  // Verses holding every term, best first
+  function rankVerses(index, postings) {
+    const lists = postings.map(decodePostings).sort(function(a, b) { return a.size - b.size; });
+    const weights = lists.map(function(list) {
+      return Math.log(1 + (index.verses - list.size + 0.5) / (list.size + 0.5));
+    });
+    const hits = [];
+    lists[0].forEach(function(_, key) {
+      let score = 0;
+      for (let i = 0; i < lists.length; i++) {
+        const tf = lists[i].get(key);
+        if (!tf) return;
+        score += weights[i] * tf / (tf + 1.2);
+      }
+      hits.push([score, key]);
+    });
+    return hits.sort(function(a, b) { return b[0] - a[0] || a[1] - b[1]; });
+  }
+
+  function search(query) {
+    const terms = Array.from(new Set(tokenize(query)));
+    if (!terms.length) return Promise.resolve(null);
+    return loadSearchIndex().then(function(index) {
+      return Promise.all(terms.map(function(term) {
+        return loadShard(shardFor(index, term)).then(function(shard) {
+          // Own terms only: 'constructor' or 'toString' must not find Object.prototype
+          return Object.prototype.hasOwnProperty.call(shard, term) ? shard[term] : undefined;
+        });
+      })).then(function(postings) {
+        if (postings.some(function(list) { return !list; })) return { index: index, hits: [] };
+        return { index: index, hits: rankVerses(index, postings) };
+      });
+    });
+  }
+
+  function verseLink(index, key) {
+    const verse = key % 1000;
+    const chapter = Math.floor(key / 1000) % 1000;
+    const book = index.books[Math.floor(key / 1000000)];
+    // Pages kept under a legacy name are listed by chapter
+    const file = (book[4] && book[4][chapter]) || chapterFile(book[1], chapter, book[2], book[3]);
+    const link = document.createElement('a');
+    link.href = new URL('../../books/' + file + '#v' + verse, searchBase).href;
+    link.textContent = book[0] + ' ' + chapter + ':' + verse;
+    return link;
+  }
+
+  function initSearch() {
+    const topNav = document.querySelector('.top-nav');
+    if (!topNav || !searchBase || !window.fetch) return;
+
+    const form = document.createElement('form');
+    form.className = 'search-box';
+    form.setAttribute('role', 'search');
+    const input = document.createElement('input');
+    input.type = 'search';
+    input.placeholder = 'Search';
+    input.setAttribute('aria-label', 'Search the Bible');
+    const results = document.createElement('div');
+    results.className = 'search-results';
+    results.setAttribute('aria-live', 'polite');
+    results.hidden = true;
+    form.appendChild(input);
+    form.appendChild(results);
+    topNav.appendChild(form);
+
+    let pending = 0;
+    let timer = null;
+
+    function show(message, hits, index) {
+      results.replaceChildren();
+      const status = document.createElement('p');
+      status.textContent = message;
+      results.appendChild(status);
+      if (hits && hits.length) {
+        const list = document.createElement('ul');
+        hits.slice(0, SEARCH_LIMIT).forEach(function(hit) {
+          const item = document.createElement('li');
+          item.appendChild(verseLink(index, hit[1]));
+          list.appendChild(item);
+        });
+        results.appendChild(list);
+      }
+      results.hidden = false;
+    }
+
+    function run() {
+      const query = input.value.trim();
+      const request = ++pending;
+      if (!query) {
+        results.hidden = true;
+        return;
+      }
+      search(query).then(function(found) {
+        if (request !== pending || !found) return;
+        const count = found.hits.length;
+        show(count ? count + (count === 1 ? ' verse' : ' verses') +
+                     (count > SEARCH_LIMIT ? ', showing the first ' + SEARCH_LIMIT : '')
+                   : 'No verses found', found.hits, found.index);
+      }).catch(function() {
+        if (request === pending) show('Search is not available');
+      });
+    }
+
+    input.addEventListener('input', function() {
+      clearTimeout(timer);
+      timer = setTimeout(run, 250);
+    });
+    form.addEventListener('submit', function(e) {
+      e.preventDefault();
+      clearTimeout(timer);
+      run();
+    });
+    input.addEventListener('keydown', function(e) {
+      if (e.key === 'Escape') results.hidden = true;
+    });
+    document.addEventListener('click', function(e) {
+      if (!form.contains(e.target)) results.hidden = true;
+    });
+  }
+
+  // Whole-book pages (single_page.py --sections) leave later chapters in
+  // .part files; a part is loaded as it nears the viewport, or when a
+  // link points into one of its chapters
+  function initLazySections() {
+    const holders = Array.prototype.slice.call(document.querySelectorAll('.lazy-section[data-src]'));
+    if (!holders.length) return;
+    const loading = new Map();
+
+    function load(holder) {
+      if (!loading.has(holder)) {
+        loading.set(holder, fetch(holder.getAttribute('data-src')).then(function(response) {
+          if (!response.ok) throw new Error(holder.getAttribute('data-src') + ': ' + response.status);
+          return response.text();
+        }).then(function(text) {
+          holder.insertAdjacentHTML('beforebegin', text);
+          holder.remove();
+        }).catch(function(error) {
+          loading.delete(holder);
+          throw error;
+        }));
+      }
+      return loading.get(holder);
+    }
+
+    // Ids are chapter-qualified (Psalms023-v3), so the chapter names the part
+    function reveal() {
+      const id = decodeURIComponent(location.hash.slice(1));
+      if (!id) return;
+      const chapter = id.split('-')[0];
+      const holder = holders.find(function(h) {
+        return h.isConnected && h.getAttribute('data-chapters').split(' ').indexOf(chapter) >= 0;
+      });
+      if (!holder) return;
+      load(holder).then(function() {
+        const target = document.getElementById(id);
+        if (target) target.scrollIntoView();
+      }).catch(function() {});
+    }
+
+    if ('IntersectionObserver' in window) {
+      const observer = new IntersectionObserver(function(entries) {
+        entries.forEach(function(entry) {
+          if (!entry.isIntersecting) return;
+          observer.unobserve(entry.target);
+          load(entry.target).catch(function() {
+            observer.observe(entry.target);
+          });
+        });
+      }, {rootMargin: '1500px 0px'});
+      holders.forEach(function(holder) {
+        observer.observe(holder);
+      });
+    } else {
+      holders.forEach(function(holder) {
+        load(holder).catch(function() {});
+      });
+    }
+    window.addEventListener('hashchange', reveal);
+    reveal();
+  }
+
+  // Offline reading and instant next-chapter loads; sw.js is only there
+  // when the site was built with it
+  function initServiceWorker() {
+    if (!scriptBase || !('serviceWorker' in navigator) || !/^https?:$/.test(location.protocol)) return;
+    navigator.serviceWorker.register(new URL('../sw.js', scriptBase)).catch(function() {});
+  }
+
   // Initialize on DOM ready
   if (document.readyState === 'loading') {
     document.addEventListener('DOMContentLoaded', init);
@@ -96,8 +416,12 @@
   }
 
   function init() {
+    initSharedNav();
     initSidebar();
     initChapterDropdown();
     initKeyboardNav();
+    initSearch();
+    initLazySections();
+    initServiceWorker();
   }
 })();
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The scripts in books/ import each other as top-level modules
+BOOKS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'books')
+sys.path.insert(0, BOOKS_DIR)
@@ -0,0 +1,72 @@
+import os
+
+from build_manifest import BuildManifest, hash_bytes
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def built(books_dir, name, data, fingerprint='gen-1', input_hash=None):
+    """Write an output and record it in a saved manifest."""
+    write(os.path.join(books_dir, name), data)
+    manifest = BuildManifest(books_dir, 'test', fingerprint)
+    manifest.record(name, hash_bytes(data), 'IN.htm' if input_hash else None, input_hash)
+    manifest.save()
+
+
+def test_recorded_output_is_fresh(tmp_path):
+    built(str(tmp_path), 'Mark01.htm', b'page')
+    assert BuildManifest(str(tmp_path), 'test', 'gen-1').is_fresh('Mark01.htm')
+
+
+def test_unknown_output_is_stale(tmp_path):
+    assert not BuildManifest(str(tmp_path), 'test', 'gen-1').is_fresh('Mark01.htm')
+
+
+def test_new_generator_is_stale(tmp_path):
+    built(str(tmp_path), 'Mark01.htm', b'page')
+    assert not BuildManifest(str(tmp_path), 'test', 'gen-2').is_fresh('Mark01.htm')
+
+
+def test_force_is_stale(tmp_path):
+    built(str(tmp_path), 'Mark01.htm', b'page')
+    assert not BuildManifest(str(tmp_path), 'test', 'gen-1', force=True).is_fresh('Mark01.htm')
+
+
+def test_sections_are_separate(tmp_path):
+    built(str(tmp_path), 'Mark01.htm', b'page')
+    assert not BuildManifest(str(tmp_path), 'other', 'gen-1').is_fresh('Mark01.htm')
+
+
+def test_changed_input_is_stale(tmp_path):
+    built(str(tmp_path), 'Mark01.htm', b'page', input_hash='aaa')
+    manifest = BuildManifest(str(tmp_path), 'test', 'gen-1')
+    assert manifest.is_fresh('Mark01.htm', 'aaa')
+    assert not manifest.is_fresh('Mark01.htm', 'bbb')
+
+
+def test_edited_output_is_stale(tmp_path):
+    built(str(tmp_path), 'Mark01.htm', b'page')
+    write(os.path.join(str(tmp_path), 'Mark01.htm'), b'edited page')
+    assert not BuildManifest(str(tmp_path), 'test', 'gen-1').is_fresh('Mark01.htm')
+
+
+def test_touched_output_falls_back_to_its_hash(tmp_path):
+    built(str(tmp_path), 'Mark01.htm', b'page')
+    path = os.path.join(str(tmp_path), 'Mark01.htm')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    manifest = BuildManifest(str(tmp_path), 'test', 'gen-1')
+    assert manifest.is_fresh('Mark01.htm')
+    # Without checking the output, only the record matters
+    os.remove(path)
+    write(path, b'other')
+    assert manifest.is_fresh('Mark01.htm', check_output=False)
+
+
+def test_deleted_output_is_stale(tmp_path):
+    built(str(tmp_path), 'Mark01.htm', b'page')
+    os.remove(os.path.join(str(tmp_path), 'Mark01.htm'))
+    assert not BuildManifest(str(tmp_path), 'test', 'gen-1').is_fresh('Mark01.htm')
@@ -0,0 +1,54 @@
+import re
+import glob
+import os
+
+import pytest
+
+from modernize_bible import clean_paragraph
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def old_clean_paragraph(content):
+    """clean_paragraph as it was before the single-pass tokenizer (b90d87b)."""
+    content = re.sub(r"(\w+)='([^']*)'", r'\1="\2"', content)
+    content = re.sub(
+        r'<span class="verse" id="V(\d+)">(\d+)&#160;</span>',
+        r'<span class="verse" id="v\1">\2</span> ',
+        content
+    )
+    content = re.sub(
+        r'<a href="#(FN\d+)" class="notemark">([^<]*)<span class="popup">([^<]*)</span></a>',
+        r'<a href="#\1" class="notemark" title="\3">\2</a>',
+        content
+    )
+    return re.sub(r'\s+', ' ', content).strip()
+
+
+def fixture_paragraphs():
+    paragraphs = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES, '*.htm'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            paragraphs += re.findall(r"<div class='\w+'>(.*?)</div>", f.read(), re.DOTALL)
+    return paragraphs
+
+
+CASES = [
+    '',
+    '   plain   text\n  over lines  ',
+    '<span class="verse" id="V12">12&#160;</span>Then he said,',
+    '<span class="verse" id="V3">3&#160;</span>one <span class="verse" id="V4">4&#160;</span>two',
+    '“Behold,<a href="#FN2" class="notemark">†<span class="popup">Malachi 3:1</span></a> I send',
+    "<a href='PSA022.htm'>Psalm 22</a> and <span class='wj'>words</span>",
+    '<a href="#FN1" class="notemark">*<span class="popup"></span></a>',
+]
+
+
+@pytest.mark.parametrize('content', CASES + fixture_paragraphs())
+def test_matches_the_regex_implementation(content):
+    assert clean_paragraph(content) == old_clean_paragraph(content)
+
+
+def test_moves_the_popup_to_the_title():
+    cleaned = clean_paragraph('word<a href="#FN1" class="notemark">*<span class="popup">or, noon</span></a>')
+    assert cleaned == 'word<a href="#FN1" class="notemark" title="or, noon">*</a>'
@@ -0,0 +1,44 @@
+import pytest
+
+from book_tables import BookTable
+from modernize_bible import BOOK_MAPPING, get_book_abbrev, update_links_in_content
+
+
+@pytest.mark.parametrize('link, expected', [
+    ("<a href='PSA022.htm'>", "<a href='Psalms022.htm'>"),
+    ('<a href="MRK.htm">', '<a href="Mark.htm">'),
+    ('<a href="1CO13.htm">', '<a href="1_Corinthians13.htm">'),
+    # PS2 is Psalm 151, not a PS prefix followed by chapter digits
+    ('<a href="PS2.htm">', '<a href="Psalm_151.htm">'),
+    ('<a href="PS201.htm">', '<a href="Psalm_15101.htm">'),
+    ('<a href="XYZ01.htm">', '<a href="XYZ01.htm">'),
+    ('<a href="index.htm">', '<a href="index.htm">'),
+])
+def test_update_links(link, expected):
+    assert update_links_in_content(link) == expected
+
+
+def test_update_links_rewrites_every_link():
+    content = "<a href='MRK01.htm'>1</a> <a href='MRK02.htm'>2</a> <a href='JHN03.htm'>3</a>"
+    assert update_links_in_content(content) == \
+        "<a href='Mark01.htm'>1</a> <a href='Mark02.htm'>2</a> <a href='John03.htm'>3</a>"
+
+
+@pytest.mark.parametrize('filename, expected', [
+    ('PSA022.htm', ('PSA', '022')),
+    ('PS201.htm', ('PS2', '01')),
+    ('PS2.htm', ('PS2', '')),
+    ('mrk15.htm', ('MRK', '15')),
+    ('index.htm', (None, None)),
+])
+def test_get_book_abbrev(filename, expected):
+    assert get_book_abbrev(filename) == expected
+
+
+def test_book_table_uses_its_own_mapping():
+    table = BookTable([('Mark', 'Mark', 16, 'nt'), ('Marcos', 'Marcos', 16, 'nt')],
+                      {'MRK': 'Marcos', 'PS2': BOOK_MAPPING['PS2']})
+    assert table.output_filename('MRK15.htm') == 'Marcos15.htm'
+    assert table.output_filename('PS201.htm') == 'Psalm_15101.htm'
+    assert table.output_filename('JHN03.htm') is None
+    assert table.rewrite_links("<a href='MRK15.htm'>") == "<a href='Marcos15.htm'>"
@@ -0,0 +1,85 @@
+import os
+import re
+import shutil
+
+import pytest
+
+import pipeline
+from conftest import BOOKS_DIR
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PARMS = os.path.join(os.path.dirname(BOOKS_DIR), 'meta', 'eng-web-VernacularParms.xml')
+STAGES = ['links', 'clean', 'navigation', 'crossrefs']
+
+
+@pytest.fixture
+def edition(tmp_path):
+    """An edition of the upstream fixture pages: books/MRK01.htm ... and meta/."""
+    books_dir = tmp_path / 'books'
+    books_dir.mkdir()
+    (tmp_path / 'meta').mkdir()
+    shutil.copy(PARMS, str(tmp_path / 'meta'))
+    for name in os.listdir(FIXTURES):
+        shutil.copy(os.path.join(FIXTURES, name), str(books_dir))
+    return str(books_dir)
+
+
+def read(books_dir, name):
+    with open(os.path.join(books_dir, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def test_build_renames_and_navigates(edition):
+    assert pipeline.build(edition, STAGES) == 3
+    names = set(os.listdir(edition))
+    assert {'Mark01.htm', 'Mark02.htm', 'Psalm_15101.htm'} <= names
+    assert not names & {'MRK01.htm', 'MRK02.htm', 'PS201.htm'}
+
+    page = read(edition, 'Mark01.htm')
+    assert '<title>World English Bible - Mark 1</title>' in page
+    assert '<aside class="sidebar" id="sidebar">' in page
+    assert '<a href="Mark01.htm" class="active">Mark</a>' in page
+    assert '<a href="Psalm_15101.htm">Psalm 151</a>' in page
+    assert '<option value="Mark02.htm">Chapter 2</option>' in page
+    assert '<a href="Mark02.htm" title="Next">&rarr;</a>' in page
+    assert '<a href="Mark01.htm" title="Previous">&larr;</a>' in read(edition, 'Mark02.htm')
+
+
+def test_build_cleans_the_text(edition):
+    pipeline.build(edition, STAGES)
+    main = re.search(r'<main class="main">(.*?)</main>', read(edition, 'Mark01.htm'), re.DOTALL).group(1)
+    assert '<h2 class="chapterlabel">1</h2>' in main
+    assert '<p class="p"><span class="verse" id="v1">1</span> The beginning' in main
+    assert '<a href="#FN1" class="notemark" title="NU omits “the Son of God.”">*</a>' in main
+    assert '<a href="Psalms022.htm">Psalm 22</a> and <a href="Psalm_15101.htm">Psalm 151</a>' in main
+
+
+def test_build_writes_title_only_notes(edition):
+    pipeline.build(edition, STAGES)
+    # Malachi is not in this edition, so its reference stays text
+    assert ('<p class="f" id="FN2"><span class="notemark">†</span> <a class="notebackref" href="#v2">1:2</a> '
+            'Malachi 3:1</p>') in read(edition, 'Mark01.htm')
+    assert ('<p class="f" id="FN1"><span class="notemark">*</span> <a class="notebackref" href="#v1">2:1</a> '
+            'See <a class="xref" href="Mark01.htm#v21">Mark 1:21</a>.</p>') in read(edition, 'Mark02.htm')
+
+
+def test_build_leaves_a_redirect_under_the_legacy_name(edition):
+    pipeline.build(edition, STAGES)
+    assert 'Psalm_15101.htm' in read(edition, 'Psalm_151201.htm')
+
+
+def test_rebuild_skips_fresh_pages(edition):
+    pipeline.build(edition, STAGES)
+    page = read(edition, 'Mark02.htm')
+    # Navigation over the built pages: processed once, then skipped until one changes
+    assert pipeline.build(edition, ['navigation']) == 3
+    assert read(edition, 'Mark02.htm') == page
+    assert pipeline.build(edition, ['navigation']) == 0
+    path = os.path.join(edition, 'Mark02.htm')
+    os.utime(path)
+    assert pipeline.build(edition, ['navigation']) == 0
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('\n')
+    assert pipeline.build(edition, ['navigation']) == 1
+    assert read(edition, 'Mark02.htm') == page
+    assert pipeline.build(edition, ['navigation'], force=True) == 3
@@ -0,0 +1,36 @@
+import pytest
+
+from references import VerseRange, format_range, parse_reference, scan_references
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Mark 15:34', [VerseRange('Mark', 15, 34, 15, 34)]),
+    ('1 Jn 3:16', [VerseRange('1_John', 3, 16, 3, 16)]),
+    ('Ps 119:1-8, 12', [VerseRange('Psalms', 119, 1, 119, 8), VerseRange('Psalms', 119, 12, 119, 12)]),
+    ('Gen 1:1–2:3', [VerseRange('Genesis', 1, 1, 2, 3)]),
+    ('Mark 15', [VerseRange('Mark', 15, None, 15, None)]),
+    # One-chapter books take a verse number alone
+    ('Jude 3', [VerseRange('Jude', 1, 3, 1, 3)]),
+    ('Ps 151:1', [VerseRange('Psalm_151', 1, 1, 1, 1)]),
+])
+def test_parse_reference(text, expected):
+    assert parse_reference(text) == expected
+
+
+@pytest.mark.parametrize('text', ['', 'Foo 1:1', 'Gen 51:1', 'Mark'])
+def test_parse_reference_rejects(text):
+    with pytest.raises(ValueError):
+        parse_reference(text)
+
+
+def test_scan_references():
+    text = 'see Mark 15:34 and Ps 22:1; also 2 Kings 1:3.'
+    found = list(scan_references(text))
+    assert [text[start:end] for start, end, _ in found] == ['Mark 15:34', 'Ps 22:1', '2 Kings 1:3']
+    assert [ref.book for _, _, ref in found] == ['Mark', 'Psalms', '2_Kings']
+
+
+def test_format_range_round_trips():
+    for text in ('Mark 15:34', 'Genesis 1:1–2:3'):
+        ranges = parse_reference(text)
+        assert parse_reference(format_range(ranges[0])) == ranges